@@ -0,0 +1,63 @@
+"""Module with cloud managers which start fake instances for benchmarks."""
+
+import time
+import uuid
+
+from modules.readiness import Readiness
+
+
+class FakeGCPManager:
+    """
+    Class with interface of GCPManager backed by FakeInstance.
+
+    run_instance() sleeps boot_latency seconds and waits until the
+    fake instance accepts ssh commands, like a booting instance.
+    """
+
+    ip_address = "127.0.0.1"
+
+    def __init__(self, release, logger, instance_name=None, port=22, user=None,
+                 key_path=None, boot_latency=0.0, ssh_client=None):
+        self.release = release
+        self.logger = logger
+        self.instance_name = instance_name or self.generate_instance_name(release)
+        self.user = user
+        self.key_path = key_path
+        self.boot_latency = boot_latency
+        self.readiness = Readiness(self.logger, port=port, ssh_client=ssh_client)
+
+    @staticmethod
+    def generate_instance_name(release):
+        return f"fake-el{release}-{uuid.uuid4().hex[:8]}"
+
+    def run_instance(self):
+        started = time.monotonic()
+        time.sleep(self.boot_latency)
+        self.readiness.timings["insert"] = round(time.monotonic() - started, 3)
+        self.wait_ready()
+
+    def wait_ready(self):
+        self.readiness.wait_ssh(self.user, self.ip_address, self.key_path)
+        return self.readiness.timings
+
+    def instance_ip(self):
+        return self.ip_address
+
+    def terminate(self, wait=False):
+        self.logger.info(f"Fake instance {self.instance_name} deleted.")
+
+
+class FakeEC2Instance(FakeGCPManager):
+    """Class with interface of ec2_manager.Instance backed by FakeInstance."""
+
+    def __init__(self, release, logger, **kwargs):
+        super().__init__(release, logger, **kwargs)
+        self.instance_id = f"i-{uuid.uuid4().hex[:17]}"
+        time.sleep(self.boot_latency)
+
+    def instance_ip(self):
+        self.wait_ready()
+        return self.ip_address
+
+    def terminate(self):
+        self.logger.info(f"Fake instance {self.instance_id} terminated.")
@@ -0,0 +1,318 @@
+"""Module with local SSH server which plays a cloud instance for benchmarks."""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import socket
+import stat
+import subprocess
+import sys
+import tempfile
+import threading
+
+import paramiko
+
+FAKE_SUDO = """
+import os, sys
+os.execvp(sys.argv[1], sys.argv[1:])
+"""
+
+FAKE_SED = """
+import sys
+# Repository files of the instance are not touched.
+sys.exit(0)
+"""
+
+FAKE_DNF = r"""
+import json, os, shutil, sys, time
+
+repo = os.environ["FAKE_REPO"]
+time.sleep(float(os.environ.get("FAKE_DNF_LATENCY", "0")))
+with open(os.path.join(repo, "index.json")) as f:
+    index = json.load(f)
+args = [arg for arg in sys.argv[1:] if arg != "-y" and arg != "-q"]
+options = {arg.split("=", 1)[0]: arg.split("=", 1)[-1] for arg in args if arg.startswith("--")}
+names = [arg for arg in args[1:] if not arg.startswith("--")]
+command = args[0] if args else ""
+
+
+def keys(record):
+    name, version, release, arch = (record["name"], record["version"],
+                                    record["release"], record["arch"])
+    return {name, f"{name}.{arch}", f"{name}-{version}", f"{name}-{version}-{release}",
+            f"{name}-{version}-{release}.{arch}"}
+
+
+def match(spec, source):
+    return [file_name for file_name, record in index.items()
+            if spec in keys(record) and (record["arch"] == "src") == source]
+
+
+if command == "download":
+    source = "--source" in options
+    found = {}
+    for name in names:
+        files = match(name, source)
+        if not files:
+            print(f"No package {name} available.", file=sys.stderr)
+            sys.exit(1)
+        found[name] = files[0]
+    for file_name in found.values():
+        shutil.copy(os.path.join(repo, file_name), options["--downloaddir"])
+elif command == "repoquery":
+    query_format = options.get("--queryformat", "%{name}\n")
+    # Value of --queryformat is the next argument.
+    if "--queryformat" in args:
+        position = args.index("--queryformat")
+        query_format = args[position + 1]
+        names.remove(query_format)
+    printed = set()
+    for name in names:
+        for file_name in match(name, False) + match(name.rsplit(".src", 1)[0], True):
+            if file_name in printed:
+                continue
+            printed.add(file_name)
+            line = query_format
+            for field, value in index[file_name].items():
+                line = line.replace("%{" + field + "}", str(value))
+            line = line.replace("%{downloadsize}", str(index[file_name]["size"]))
+            sys.stdout.write(line if line.endswith("\n") else line + "\n")
+elif command == "repolist":
+    print("baseos-source    BaseOS Source")
+"""
+
+
+class _Server(paramiko.ServerInterface):
+
+    """Server side of one SSH connection."""
+    def __init__(self, instance):
+        self.instance = instance
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED_OPEN_REQUEST
+
+    def get_allowed_auths(self, username):
+        return "publickey"
+
+    def check_auth_publickey(self, username, key):
+        if key == self.instance.client_key:
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=self.instance.execute, args=(channel, command),
+                         daemon=True).start()
+        return True
+
+
+class _SFTPHandle(paramiko.SFTPHandle):
+    def stat(self):
+        return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+
+
+class _SFTPServer(paramiko.SFTPServerInterface):
+
+    """SFTP over the local file system, paths are used as they are."""
+    def list_folder(self, path):
+        try:
+            return [paramiko.SFTPAttributes.from_stat(os.stat(os.path.join(path, name)), name)
+                    for name in os.listdir(path)]
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    lstat = stat
+
+    def open(self, path, flags, attr):
+        try:
+            fd = os.open(path, flags, 0o644)
+            mode = "rb" if not flags & (os.O_WRONLY | os.O_RDWR) else "r+b"
+            handle = _SFTPHandle(flags)
+            handle.readfile = handle.writefile = os.fdopen(fd, mode)
+            return handle
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+
+class FakeInstance:
+    """
+    Class for run SSH server on localhost which answers like an instance.
+
+    Commands run in a local shell with fake sudo, dnf and sed first in
+    PATH. dnf serves synthetic packages of the repository directory,
+    every dnf call sleeps dnf_latency seconds like loading metadata.
+    """
+
+    def __init__(self, repository_dir, dnf_latency=0.0):
+        self.repository_dir = repository_dir
+        self.dnf_latency = dnf_latency
+        self.root = tempfile.mkdtemp(prefix="fake-instance-")
+        self.bin_dir = os.path.join(self.root, "bin")
+        self.key_path = os.path.join(self.root, "id_rsa")
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.client_key = paramiko.RSAKey.generate(2048)
+        self.client_key.write_private_key_file(self.key_path)
+        self.port = None
+        self._socket = None
+        self._transports = []
+        self._stop = threading.Event()
+        self._write_fake_commands()
+
+    def _write_fake_commands(self):
+        os.makedirs(self.bin_dir, exist_ok=True)
+        for name, source in (("sudo", FAKE_SUDO), ("sed", FAKE_SED), ("dnf", FAKE_DNF)):
+            path = os.path.join(self.bin_dir, name)
+            with open(path, "w") as f:
+                f.write(f"#!{sys.executable}\n{source}")
+            os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+
+    def execute(self, channel, command):
+        """
+        Method for run command of the channel and send its output back.
+
+        :param channel: paramiko.Channel
+        :param command: bytes
+        """
+        env = dict(os.environ, PATH=f"{self.bin_dir}:{os.environ.get('PATH', '')}",
+                   FAKE_REPO=self.repository_dir, FAKE_DNF_LATENCY=str(self.dnf_latency))
+        process = subprocess.Popen(["bash", "-c", command.decode()], env=env,
+                                   stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+
+        def pump(pipe, send):
+            for chunk in iter(lambda: pipe.read1(65536), b""):
+                send(chunk)
+
+        stderr_thread = threading.Thread(target=pump,
+                                         args=(process.stderr, channel.sendall_stderr))
+        stderr_thread.start()
+        try:
+            pump(process.stdout, channel.sendall)
+        except (OSError, EOFError):
+            process.kill()
+        stderr_thread.join()
+        channel.send_exit_status(process.wait())
+        channel.close()
+
+    def _serve(self, connection):
+        transport = paramiko.Transport(connection)
+        transport.add_server_key(self.host_key)
+        transport.set_subsystem_handler("sftp", paramiko.SFTPServer, _SFTPServer)
+        self._transports.append(transport)
+        try:
+            transport.start_server(server=_Server(self))
+        except (paramiko.SSHException, EOFError):
+            return
+        # Channels are served by callbacks, accepted ones are kept
+        # referenced until closed, paramiko closes collected channels.
+        channels = []
+        while transport.is_active() and not self._stop.is_set():
+            channel = transport.accept(timeout=1)
+            channels = [channel for channel in channels + [channel]
+                        if channel is not None and not channel.closed]
+
+    def _accept(self):
+        while not self._stop.is_set():
+            try:
+                connection, _ = self._socket.accept()
+            except OSError:
+                break
+            threading.Thread(target=self._serve, args=(connection,), daemon=True).start()
+
+    def start(self):
+        """
+        Method for start listening on a free localhost port.
+
+        :return: int port
+        """
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind(("127.0.0.1", 0))
+        self._socket.listen(100)
+        self.port = self._socket.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+        return self.port
+
+    def stop(self):
+        """Method for stop server and close all connections."""
+        self._stop.set()
+        if self._socket is not None:
+            self._socket.close()
+        for transport in self._transports:
+            transport.close()
+
+
+class FakeInstanceProcess:
+    """
+    Class for run FakeInstance in a separate process.
+
+    Server threads and commands then don't share the GIL, CPU time
+    and memory of the benchmarked process.
+    """
+
+    def __init__(self, repository_dir, dnf_latency=0.0):
+        self.repository_dir = repository_dir
+        self.dnf_latency = dnf_latency
+        self.port = None
+        self.key_path = None
+        self._process = None
+
+    def start(self):
+        """
+        Method for start server process.
+
+        :return: int port
+        """
+        self._process = subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.fake_instance",
+             "--repository", self.repository_dir, "--dnf-latency", str(self.dnf_latency)],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, encoding="utf-8")
+        info = json.loads(self._process.stdout.readline())
+        self.port, self.key_path = info["port"], info["key_path"]
+        return self.port
+
+    def stop(self):
+        """Method for stop server process, it removes its files."""
+        if self._process is not None:
+            self._process.stdin.close()
+            self._process.wait(timeout=30)
+
+
+def write_repository_index(repository_dir, index):
+    """
+    Function for save index of repository packages for fake dnf.
+
+    :param index: dict {file name: record}
+    """
+    with open(os.path.join(repository_dir, "index.json"), "w") as f:
+        json.dump(index, f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake instance SSH server")
+    parser.add_argument("--repository", required=True)
+    parser.add_argument("--dnf-latency", type=float, default=0.0)
+    args = parser.parse_args()
+    # Readiness probes close connections before the SSH banner.
+    logging.getLogger("paramiko").setLevel(logging.CRITICAL)
+    instance = FakeInstance(args.repository, dnf_latency=args.dnf_latency)
+    port = instance.start()
+    print(json.dumps({"port": port, "key_path": instance.key_path}), flush=True)
+    # Runs until the parent closes stdin.
+    sys.stdin.read()
+    instance.stop()
+    shutil.rmtree(instance.root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Check the native RPM header reader against output captured from rpm.
+
+Fixture packages are real .rpm files in benchmarks/fixtures/, next to
+each one a .json file keeps what the rpm cli returned for it (the
+queries of PackageInfo with backend "cli": rpm --queryformat,
+--provides, --requires, --scripts and -ql).
+
+Usage:
+    # on a host with rpm installed, after adding .rpm files
+    python -m benchmarks.rpm_fixtures capture
+    # anywhere
+    python -m benchmarks.rpm_fixtures check
+"""
+
+import argparse
+import glob
+import json
+import logging
+import os
+import sys
+
+from local_functions.package_info import PackageInfo
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# Compared PackageInfo queries, payload checksums don't depend on the backend.
+QUERIES = ["get_rpm_metadata", "get_provides", "get_requires", "get_scripts", "get_files"]
+
+
+def fixture_packages(fixtures_dir):
+    """
+    Function for find fixture packages.
+
+    :param fixtures_dir: str
+    :return: list[str]
+    """
+    return sorted(glob.glob(os.path.join(fixtures_dir, "*.rpm")))
+
+
+def query_all(logger, package_path, backend):
+    """
+    Function for run compared queries with the backend.
+
+    :param package_path: str
+    :param backend: str "cli" or "native"
+    :return: dict {query: list[str]}
+    """
+    package_info = PackageInfo(logger, package_path, backend=backend)
+    return {query: getattr(package_info, query)() for query in QUERIES}
+
+
+def capture(logger, fixtures_dir):
+    """
+    Function for save rpm cli output of every fixture package.
+
+    :param fixtures_dir: str
+    :return: int number of captured packages
+    """
+    packages = fixture_packages(fixtures_dir)
+    for package_path in packages:
+        expected = query_all(logger, package_path, "cli")
+        failed = [query for query, lines in expected.items() if lines is None]
+        if failed:
+            raise RuntimeError(f"rpm failed on {package_path}: {', '.join(failed)}")
+        with open(f"{package_path}.json", "w") as f:
+            json.dump(expected, f, indent=2)
+            f.write("\n")
+        logger.info(f"Captured {os.path.basename(package_path)}")
+    return len(packages)
+
+
+def check(logger, fixtures_dir):
+    """
+    Function for compare native backend with captured rpm cli output.
+
+    :param fixtures_dir: str
+    :return: list of (package file name, query) which differ
+    """
+    packages = fixture_packages(fixtures_dir)
+    if not packages:
+        raise RuntimeError(f"No fixture packages in {fixtures_dir}")
+    mismatches = []
+    for package_path in packages:
+        with open(f"{package_path}.json") as f:
+            expected = json.load(f)
+        actual = query_all(logger, package_path, "native")
+        for query in QUERIES:
+            if actual[query] != expected[query]:
+                name = os.path.basename(package_path)
+                logger.error(f"{name} {query}: expected {expected[query]!r}, "
+                             f"got {actual[query]!r}")
+                mismatches.append((name, query))
+    return mismatches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("command", choices=["capture", "check"])
+    parser.add_argument("--fixtures", default=FIXTURES_DIR,
+                        help="directory of fixture packages")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    logger = logging.getLogger("rpm_fixtures")
+    if args.command == "capture":
+        logger.info(f"Captured {capture(logger, args.fixtures)} packages")
+        return 0
+    mismatches = check(logger, args.fixtures)
+    if mismatches:
+        print(f"{len(mismatches)} queries differ from rpm", file=sys.stderr)
+        return 1
+    print(f"Native backend matches rpm on {len(fixture_packages(args.fixtures))} packages")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
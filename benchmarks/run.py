@@ -0,0 +1,292 @@
+"""
+Benchmark of the whole pipeline against a local fake instance.
+
+Usage:
+    python -m benchmarks.run --packages 100 --size 262144 --iterations 5 \
+        --output results.json [--compare previous.json]
+"""
+
+import argparse
+import functools
+import getpass
+import hashlib
+import json
+import logging
+import math
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+import config.conf as config
+from benchmarks.fake_cloud import FakeEC2Instance, FakeGCPManager
+from benchmarks.fake_instance import FakeInstanceProcess, write_repository_index
+from benchmarks.synthetic_rpm import build_repository
+from local_functions.package_analyzer import PackageAnalyzer
+from modules.ssh_client import SSHClient, SSHConnectionPool
+from remote_functions.check_license import CheckLicense
+from remote_functions.download_package import PackagesDownload, ResolvePackages, UNAVAILABLE
+from remote_functions.enable_repo import EnableRepo
+from remote_functions.sftp_pull import SFTPPull
+from remote_functions.tar_stream import TarStream
+
+STAGES = ["provision", "license_check", "repo_enable", "resolve", "download",
+          "transfer", "analyze"]
+
+
+def percentile(values, percent):
+    """
+    Function for get nearest-rank percentile.
+
+    :param values: list of numbers
+    :param percent: int, e.g. 99
+    :return: number or None
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(math.ceil(percent / 100 * len(ordered)) - 1, 0)]
+
+
+def _commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], encoding="utf-8",
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Benchmark:
+    """
+    Class for run pipeline stages several times and collect timings.
+
+    Every iteration provisions a fake instance, checks license, enables
+    repositories, resolves and downloads all packages, pulls them over
+    sftp and analyzes them locally. Port, user and key of the fake
+    instance are passed to the functions, module config is not changed.
+    """
+
+    def __init__(self, logger, args):
+        self.logger = logger
+        self.args = args
+        self.work_dir = tempfile.mkdtemp(prefix="benchmark-")
+        self.repository_dir = os.path.join(self.work_dir, "repository")
+        self.timings = {stage: [] for stage in STAGES}
+        self.instance = None
+        self.pool = None
+        self.ssh_client = None
+        self.user = getpass.getuser()
+        self.license_path = os.path.join(self.work_dir, "LICENSE")
+        self.license_hash = None
+        self.cloud = None
+        self.packages = []
+        self.total_bytes = 0
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        yield
+        self.timings[name].append(time.perf_counter() - started)
+
+    def setup(self):
+        """Method for build packages and start fake instance."""
+        index = build_repository(self.repository_dir, self.args.packages, self.args.size)
+        self.packages = sorted(index) + [f"missing{number}-1.0-1.el9.x86_64.rpm"
+                                         for number in range(self.args.missing)]
+        self.total_bytes = sum(record["size"] for record in index.values())
+        write_repository_index(self.repository_dir, index)
+        self.instance = FakeInstanceProcess(self.repository_dir,
+                                            dnf_latency=self.args.dnf_latency)
+        port = self.instance.start()
+        self.pool = SSHConnectionPool(port=port)
+        self.ssh_client = SSHClient(self.logger, pool=self.pool)
+
+        with open(self.license_path, "w") as f:
+            f.write("Synthetic license\n")
+        with open(self.license_path, "rb") as f:
+            self.license_hash = hashlib.sha256(f.read()).hexdigest()
+        cloud = FakeEC2Instance if self.args.provider == "ec2" else FakeGCPManager
+        self.cloud = functools.partial(cloud, port=port, user=self.user,
+                                       key_path=self.instance.key_path,
+                                       boot_latency=self.args.boot_latency,
+                                       ssh_client=self.ssh_client)
+
+    def iteration(self, number):
+        """Method for run all stages once."""
+        user, key_path, ssh_client = self.user, self.instance.key_path, self.ssh_client
+        remote_dir = os.path.join(self.work_dir, f"instance{number}")
+        local_dir = os.path.join(self.work_dir, f"local{number}")
+
+        with self.stage("provision"):
+            manager = self.cloud(9, self.logger)
+            if self.args.provider == "gcp":
+                manager.run_instance()
+            ip_address = manager.instance_ip()
+        with self.stage("license_check"):
+            CheckLicense(self.logger, user, key_path, self.license_hash, "license-package",
+                         self.license_path, ssh_client=ssh_client).check_license(ip_address)
+        with self.stage("repo_enable"):
+            EnableRepo(self.logger, user, key_path,
+                       ssh_client=ssh_client).enable_check(ip_address)
+        with self.stage("resolve"):
+            resolver = ResolvePackages(self.logger, user, key_path, ssh_client=ssh_client)
+            resolution = resolver.resolve(ip_address, self.packages)
+        available = [name for name, entry in resolution.items()
+                     if entry["status"] != UNAVAILABLE]
+        with self.stage("download"):
+            PackagesDownload(self.logger, remote_dir, user, key_path, ip_address,
+                             available, batch_size=self.args.batch_size,
+                             ssh_client=ssh_client).download_all()
+        with self.stage("transfer"):
+            if self.args.transfer == "tar":
+                TarStream(self.logger, user, key_path, remote_dir, local_dir,
+                          ssh_client=ssh_client).pull(ip_address)
+            else:
+                SFTPPull(self.logger, user, key_path, remote_dir, local_dir,
+                         concurrency=self.args.sftp_concurrency,
+                         ssh_client=ssh_client).pull(ip_address)
+        with self.stage("analyze"):
+            PackageAnalyzer(self.logger, PackageAnalyzer.find_packages(local_dir),
+                            workers=self.args.workers,
+                            backend=self.args.backend).get_all()
+        manager.terminate()
+        # The next iteration is a new instance, connect again.
+        self.pool.close_all()
+        shutil.rmtree(remote_dir, ignore_errors=True)
+        shutil.rmtree(local_dir, ignore_errors=True)
+
+    def results(self):
+        """
+        Method for summarize timings.
+
+        :return: dict JSON serializable results
+        """
+        stages = {}
+        for stage, values in self.timings.items():
+            stages[stage] = {
+                "count": len(values),
+                "p50": percentile(values, 50),
+                "p99": percentile(values, 99),
+                "mean": sum(values) / len(values) if values else None,
+                "min": min(values, default=None),
+                "max": max(values, default=None),
+            }
+        throughput = {}
+        for stage in ("download", "transfer", "analyze"):
+            median = stages[stage]["p50"]
+            if median:
+                throughput[stage] = {
+                    "packages_per_second": self.args.packages / median,
+                    "bytes_per_second": self.total_bytes / median,
+                }
+        # ru_maxrss is in KiB on Linux, children are analyzer workers.
+        return {
+            "commit": _commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "parameters": {key: value for key, value in vars(self.args).items()
+                           if key not in ("output", "compare", "verbose")},
+            "total_bytes": self.total_bytes,
+            "stages": stages,
+            "throughput": throughput,
+            "peak_rss_bytes": {
+                "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+                "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024,
+            },
+        }
+
+    def run(self):
+        """
+        Method for run all iterations.
+
+        :return: dict results
+        """
+        self.setup()
+        try:
+            for number in range(self.args.iterations):
+                self.iteration(number)
+            return self.results()
+        finally:
+            if self.pool is not None:
+                self.pool.close_all()
+            self.instance.stop()
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+def compare(results, previous, threshold):
+    """
+    Function for print p50 changes against previous results.
+
+    :param threshold: allowed slowdown, e.g. 0.1 is 10%
+    :return: list of regressed stages
+    """
+    regressions = []
+    print(f"{'stage':<15}{'previous p50':>14}{'current p50':>14}{'change':>10}")
+    for stage, current in results["stages"].items():
+        before = previous.get("stages", {}).get(stage, {}).get("p50")
+        if not before or current["p50"] is None:
+            continue
+        change = current["p50"] / before - 1
+        print(f"{stage:<15}{before:>14.4f}{current['p50']:>14.4f}{change:>+10.1%}")
+        if change > threshold:
+            regressions.append(stage)
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--packages", type=int, default=50, help="number of packages")
+    parser.add_argument("--size", type=int, default=256 * 1024,
+                        help="payload bytes per package")
+    parser.add_argument("--missing", type=int, default=0,
+                        help="number of requested packages absent in the repository")
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--provider", choices=["gcp", "ec2"], default="gcp")
+    parser.add_argument("--boot-latency", type=float, default=0.5,
+                        help="seconds the fake instance boots")
+    parser.add_argument("--dnf-latency", type=float, default=0.2,
+                        help="seconds every fake dnf call loads metadata")
+    parser.add_argument("--batch-size", type=int, default=config.download_batch_size)
+    parser.add_argument("--transfer", choices=["sftp", "tar"], default="sftp",
+                        help="transfer of downloaded packages")
+    parser.add_argument("--sftp-concurrency", type=int, default=config.sftp_concurrency)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="analyzer processes, all cores by default")
+    parser.add_argument("--backend", choices=["cli", "native", "auto"], default="auto",
+                        help="PackageInfo backend of the analyzer, auto needs no rpm")
+    parser.add_argument("--output", help="write JSON results to the file")
+    parser.add_argument("--compare", help="JSON results of a previous run")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="p50 slowdown reported as regression")
+    parser.add_argument("--verbose", action="store_true")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format="%(asctime)s [%(levelname)s] %(message)s")
+    logger = logging.getLogger("benchmark")
+    results = Benchmark(logger, args).run()
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print(f"Regressions: {', '.join(regressions)}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
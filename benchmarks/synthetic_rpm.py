@@ -0,0 +1,154 @@
+"""Module for build synthetic rpm packages for benchmarks."""
+
+import gzip
+import io
+import os
+import struct
+
+from local_functions.rpm_header import (ARCH, BASENAMES, BIN, DIRINDEXES, DIRNAMES, EPOCH,
+                                        HEADER_MAGIC, I18NSTRING, INT32, LEAD_MAGIC,
+                                        LICENSE, NAME, POSTIN, POSTINPROG, PROVIDEFLAGS,
+                                        PROVIDENAME, PROVIDEVERSION, RELEASE, REQUIREFLAGS,
+                                        REQUIRENAME, REQUIREVERSION, SENSE_EQUAL,
+                                        SENSE_GREATER, SOURCERPM, STRING, STRING_ARRAY,
+                                        SUMMARY, VERSION)
+
+PAYLOADFORMAT = 1124
+PAYLOADCOMPRESSOR = 1125
+SIGTAG_SIZE = 1000
+
+
+def _header(tags):
+    """
+    Function for build header structure.
+
+    :param tags: dict {tag: (type, value)}
+    :return: bytes
+    """
+    index = b""
+    store = b""
+    for tag, (tag_type, value) in sorted(tags.items()):
+        if tag_type in (STRING, I18NSTRING):
+            data, count = value.encode() + b"\x00", 1
+        elif tag_type == STRING_ARRAY:
+            data, count = b"".join(item.encode() + b"\x00" for item in value), len(value)
+        elif tag_type == INT32:
+            store += b"\x00" * ((4 - len(store) % 4) % 4)
+            data, count = struct.pack(f">{len(value)}I", *value), len(value)
+        elif tag_type == BIN:
+            data, count = value, len(value)
+        else:
+            raise ValueError(f"Unsupported tag type {tag_type}")
+        index += struct.pack(">IIiI", tag, tag_type, len(store), count)
+        store += data
+    return (HEADER_MAGIC + b"\x01" + b"\x00" * 4 +
+            struct.pack(">II", len(tags), len(store)) + index + store)
+
+
+def _cpio(entries):
+    """
+    Function for build newc cpio archive.
+
+    :param entries: list of (path, bytes)
+    :return: bytes
+    """
+    archive = io.BytesIO()
+
+    def add(path, data, mode):
+        name = path.encode() + b"\x00"
+        fields = [1, mode, 0, 0, 1, 0, len(data), 0, 0, 0, 0, len(name), 0]
+        archive.write(b"070701" + b"".join(b"%08X" % field for field in fields) + name)
+        archive.write(b"\x00" * ((4 - archive.tell() % 4) % 4))
+        archive.write(data)
+        archive.write(b"\x00" * ((4 - archive.tell() % 4) % 4))
+
+    for path, data in entries:
+        add(path, data, 0o100644)
+    add("TRAILER!!!", b"", 0)
+    return archive.getvalue()
+
+
+def build_rpm(directory, name, version="1.0", release="1.el9", arch="x86_64",
+              source=False, payload_size=64 * 1024, file_count=4):
+    """
+    Function for write synthetic package readable by RPMHeader and rpm_payload.
+
+    The payload is incompressible data split into file_count files,
+    source packages carry a .tar.gz and a spec file.
+
+    :param directory: str output directory
+    :param source: bool build .src.rpm
+    :param payload_size: int bytes of file data
+    :return: (str path, dict index record for the fake repository)
+    """
+    chunk = max(payload_size // max(file_count, 1), 1)
+    if source:
+        tarball = gzip.compress(os.urandom(payload_size), compresslevel=1)
+        entries = [(f"{name}-{version}.tar.gz", tarball),
+                   (f"{name}.spec", f"Name: {name}\nVersion: {version}\n".encode())]
+        files = [path for path, _ in entries]
+        arch = "src"
+    else:
+        entries = [(f"./usr/share/{name}/file{index}", os.urandom(chunk))
+                   for index in range(file_count)]
+        files = [path[1:] for path, _ in entries]
+    payload = gzip.compress(_cpio(entries), compresslevel=1)
+
+    dir_names = sorted({os.path.dirname(path) + "/" if "/" in path else "" for path in files})
+    tags = {
+        NAME: (STRING, name),
+        VERSION: (STRING, version),
+        RELEASE: (STRING, release),
+        EPOCH: (INT32, [0]),
+        SUMMARY: (I18NSTRING, f"Synthetic package {name}"),
+        LICENSE: (STRING, "MIT"),
+        ARCH: (STRING, "x86_64" if source else arch),
+        REQUIRENAME: (STRING_ARRAY, ["glibc", "bash"]),
+        REQUIREFLAGS: (INT32, [SENSE_GREATER | SENSE_EQUAL, 0]),
+        REQUIREVERSION: (STRING_ARRAY, ["2.34", ""]),
+        PROVIDENAME: (STRING_ARRAY, [name]),
+        PROVIDEFLAGS: (INT32, [SENSE_EQUAL]),
+        PROVIDEVERSION: (STRING_ARRAY, [f"{version}-{release}"]),
+        POSTIN: (STRING, "/sbin/ldconfig"),
+        POSTINPROG: (STRING, "/bin/sh"),
+        BASENAMES: (STRING_ARRAY, [os.path.basename(path) for path in files]),
+        DIRNAMES: (STRING_ARRAY, dir_names),
+        DIRINDEXES: (INT32, [dir_names.index(os.path.dirname(path) + "/" if "/" in path
+                                             else "") for path in files]),
+        PAYLOADFORMAT: (STRING, "cpio"),
+        PAYLOADCOMPRESSOR: (STRING, "gzip"),
+    }
+    if not source:
+        tags[SOURCERPM] = (STRING, f"{name}-{version}-{release}.src.rpm")
+    header = _header(tags)
+    signature = _header({SIGTAG_SIZE: (INT32, [len(header) + len(payload)])})
+    signature += b"\x00" * ((8 - len(signature) % 8) % 8)
+    lead = struct.pack(">4sBBHH66sHH16s", LEAD_MAGIC, 3, 0, 1 if source else 0, 1,
+                       f"{name}-{version}-{release}".encode()[:65], 1, 5, b"")
+
+    file_name = f"{name}-{version}-{release}.{arch}.rpm"
+    path = os.path.join(directory, file_name)
+    with open(path, "wb") as f:
+        f.write(lead + signature + header + payload)
+    record = {"name": name, "epoch": "0", "version": version, "release": release,
+              "arch": arch, "size": os.path.getsize(path)}
+    return path, record
+
+
+def build_repository(directory, count, payload_size, source_ratio=0.5):
+    """
+    Function for write repository of synthetic packages.
+
+    :param count: int number of packages
+    :param payload_size: int bytes of file data per package
+    :param source_ratio: part of source packages
+    :return: dict {file name: index record}
+    """
+    os.makedirs(directory, exist_ok=True)
+    index = {}
+    sources = int(count * source_ratio)
+    for number in range(count):
+        path, record = build_rpm(directory, f"bench{number:05d}",
+                                 source=number < sources, payload_size=payload_size)
+        index[os.path.basename(path)] = record
+    return index
@@ -34,7 +34,49 @@ private_key_path = '<private_ssh_key_path>'
 license_rpm = '<name of the package with license>'
 license_path = '<path to the license file on the instance>'
 
+# Transfer of downloaded packages: "sshfs", "sftp" or "tar"
+transfer_mode = "sshfs"
+sftp_concurrency = 4
 
+# Cache of packages metadata, None disables it
+cache_dir = None
+cache_max_bytes = 1024 ** 3
 
+# Local store of downloaded packages, None disables it
+artifact_store_dir = None
 
+# Analyzer results of pulled packages: .jsonl, .jsonl.zst, .parquet
+# or .arrow files, empty list skips the analysis
+results_paths = []
+# SQLite metadata store which keeps the results of every run, None disables it
+metadata_store_path = None
 
+# Pool of prepared instances, main.py leases them instead of starting
+# and terminating an instance on every run when enabled
+instance_pool_enabled = False
+instance_pool_size = 2
+instance_pool_ttl = 3600
+instance_pool_state = "<local_instance_pool_state_file>"
+
+# File with names of packages to download, one per line, None only
+# pulls what is already in instance_mount_dir
+packages_list_path = None
+
+# Packages per "dnf download" call, 1 downloads one by one
+download_batch_size = 1
+
+# Fleet mode
+fleet_size = 4
+
+# Boot from images with setup steps done, bake them when missing or outdated
+use_baked_images = False
+auto_bake = False
+
+# Seconds to keep resolved image family
+image_cache_ttl = 600
+
+# Log output: "text" or "json", longer messages are truncated,
+# INFO records over the rate are dropped (None is unlimited)
+log_format = "text"
+log_max_message_length = 8192
+log_max_records_per_second = None
@@ -0,0 +1,164 @@
+"""Module with local content store of downloaded rpm packages."""
+
+import glob
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+
+from local_functions.rpm_header import (ARCH, EPOCH, NAME, RELEASE, SOURCERPM,
+                                        VERSION, RPMHeader)
+
+
+def package_nevra(header):
+    """
+    Function for get NEVRA string of the package.
+
+    :param header: RPMHeader
+    :return: str name-[epoch:]version-release.arch
+    """
+    epoch = header.get(EPOCH)
+    epoch = f"{epoch[0]}:" if epoch else ""
+    # Source packages have no SOURCERPM tag.
+    arch = header.get(ARCH) if header.get(SOURCERPM) else "src"
+    return (f"{header.get(NAME)}-{epoch}{header.get(VERSION)}-"
+            f"{header.get(RELEASE)}.{arch}")
+
+
+class ArtifactStore:
+    """
+    Class for keep downloaded packages indexed by NEVRA and sha256.
+
+    Files are stored once per checksum under objects/, the index maps
+    NEVRA and file name to the object. Every run writes a manifest
+    which points into the store. The index connection may be used
+    from several threads, it is guarded by a lock.
+    """
+
+    def __init__(self, logger, root):
+        self.logger = logger
+        self.root = root
+        self.objects_dir = os.path.join(root, "objects")
+        self.manifests_dir = os.path.join(root, "manifests")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.manifests_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(root, "index.sqlite"), timeout=30,
+                                  check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS artifacts ("
+                        "nevra TEXT PRIMARY KEY, file_name TEXT, "
+                        "sha256 TEXT, size INTEGER)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS artifacts_file_name "
+                        "ON artifacts (file_name)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS artifacts_sha256 "
+                        "ON artifacts (sha256)")
+        self.db.commit()
+
+    def object_path(self, sha256):
+        """
+        Method for get path of the stored object.
+
+        :param sha256: str
+        :return: str
+        """
+        return os.path.join(self.objects_dir, sha256[:2], f"{sha256}.rpm")
+
+    def lookup(self, package_name):
+        """
+        Method for find stored package by requested name.
+
+        :param package_name: file name or NEVRA, e.g. "bash-5.1-1.el9.src.rpm"
+        :return: dict {"nevra", "sha256", "path"} or None
+        """
+        key = package_name[:-len(".rpm")] if package_name.endswith(".rpm") else package_name
+        with self._lock:
+            row = self.db.execute("SELECT nevra, sha256 FROM artifacts "
+                                  "WHERE file_name = ? OR nevra = ? LIMIT 1",
+                                  (package_name, key)).fetchone()
+        if row is None:
+            return None
+        nevra, sha256 = row
+        return {"nevra": nevra, "sha256": sha256, "path": self.object_path(sha256)}
+
+    def missing(self, packages):
+        """
+        Method for get packages which are not in the store.
+
+        :param packages: list of requested names
+        :return: list
+        """
+        return [package_name for package_name in packages
+                if self.lookup(package_name) is None]
+
+    def add(self, package_path):
+        """
+        Method for put package file into the store.
+
+        :param package_path: str
+        :return: str NEVRA
+        """
+        nevra = package_nevra(RPMHeader(package_path))
+        checksum = hashlib.sha256()
+        with open(package_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                checksum.update(chunk)
+        sha256 = checksum.hexdigest()
+        object_path = self.object_path(sha256)
+        if not os.path.exists(object_path):
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            temp_path = f"{object_path}.tmp{os.getpid()}"
+            try:
+                os.link(package_path, temp_path)
+            except OSError:
+                shutil.copyfile(package_path, temp_path)
+            os.replace(temp_path, object_path)
+        with self._lock:
+            self.db.execute("INSERT OR REPLACE INTO artifacts "
+                            "(nevra, file_name, sha256, size) VALUES (?, ?, ?, ?)",
+                            (nevra, os.path.basename(package_path), sha256,
+                             os.path.getsize(object_path)))
+            self.db.commit()
+        return nevra
+
+    def ingest(self, directory):
+        """
+        Method for put all packages of the directory into the store.
+
+        :param directory: str, e.g. local_mount_dir
+        :return: int number of added packages
+        """
+        count = 0
+        for package_path in glob.glob(os.path.join(directory, "*.rpm")):
+            try:
+                self.add(package_path)
+                count += 1
+            except (OSError, ValueError) as e:
+                self.logger.error(f"Can't add {package_path} to the store: {e}")
+        self.logger.info(f"Added {count} packages to the store {self.root}")
+        return count
+
+    def write_manifest(self, run_id, packages):
+        """
+        Method for write manifest of the run.
+
+        :param run_id: str
+        :param packages: list of requested names
+        :return: str path of the manifest
+        """
+        manifest = {package_name: self.lookup(package_name)
+                    for package_name in packages}
+        manifest_path = os.path.join(self.manifests_dir, f"{run_id}.json")
+        with open(manifest_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        missing = [name for name, artifact in manifest.items() if artifact is None]
+        if missing:
+            self.logger.error(f"Packages missing in the store: {', '.join(missing)}")
+        self.logger.info(f"Manifest {manifest_path} written.")
+        return manifest_path
+
+    def close(self):
+        """Method for close the index."""
+        with self._lock:
+            self.db.close()
@@ -0,0 +1,164 @@
+"""Module for get metadata from many software packages by one rpm call."""
+
+import subprocess
+
+from local_functions.package_info import PackageInfo
+
+PACKAGE_MARK = "@@PACKAGE@@"
+SECTION_MARK = "@@SECTION {}@@"
+SECTIONS = ["metadata", "requires", "provides", "scripts", "files"]
+
+# (tag, name) in the order of "rpm --scripts" output.
+SCRIPT_TAGS = [
+    ("PRETRANS", "pretrans"),
+    ("PREIN", "preinstall"),
+    ("POSTIN", "postinstall"),
+    ("PREUN", "preuninstall"),
+    ("POSTUN", "postuninstall"),
+    ("POSTTRANS", "posttrans"),
+    ("VERIFYSCRIPT", "verify"),
+]
+
+
+def _scripts_queryformat():
+    """
+    Function for build queryformat which prints scripts like "rpm --scripts".
+
+    :return: str
+    """
+    query = ""
+    for tag, name in SCRIPT_TAGS:
+        prog = f"{tag}PROG"
+        query += (f"%|{tag}?{{{name} scriptlet"
+                  f"%|{prog}?{{ (using %{{{prog}}})}}|:\\n%{{{tag}}}\\n}}:"
+                  f"{{%|{prog}?{{{name} program: %{{{prog}}}\\n}}|}}|")
+    return query
+
+
+QUERYFORMAT = (
+    f"{PACKAGE_MARK}\\n"
+    f"{SECTION_MARK.format('metadata')}\\n"
+    "Name: %{NAME}\\n"
+    "Version: %{VERSION}\\n"
+    "Release: %{RELEASE}\\n"
+    "Summary: %{SUMMARY}\\n"
+    "License: %{LICENSE}\\n"
+    f"{SECTION_MARK.format('requires')}\\n"
+    "[%{REQUIRENEVRS}\\n]"
+    f"{SECTION_MARK.format('provides')}\\n"
+    "[%{PROVIDENEVRS}\\n]"
+    f"{SECTION_MARK.format('scripts')}\\n"
+    f"{_scripts_queryformat()}"
+    f"{SECTION_MARK.format('files')}\\n"
+    "[%{FILENAMES}\\n]"
+)
+
+
+class BatchPackageInfo:
+    """
+    Class for query many rpm packages by one rpm process per chunk.
+
+    All tags of a package are read in one --queryformat pass,
+    records have the same shape as PackageInfo.get_all().
+    """
+
+    def __init__(self, logger, package_paths, chunk_size=200):
+        self.logger = logger
+        self.package_paths = list(package_paths)
+        self.chunk_size = chunk_size
+
+    @staticmethod
+    def parse(output):
+        """
+        Method for split queryformat output into per-package dicts.
+
+        :param output: str stdout of rpm
+        :return: list[dict]
+        """
+        records = []
+        for chunk in output.split(f"{PACKAGE_MARK}\n")[1:]:
+            info = {}
+            section = None
+            for line in chunk.splitlines():
+                for name in SECTIONS:
+                    if line == SECTION_MARK.format(name):
+                        section = name
+                        info[section] = []
+                        break
+                else:
+                    if section is not None:
+                        info[section].append(line)
+            if info.get("files") == []:
+                info["files"] = ["(contains no files)"]
+            records.append(info)
+        return records
+
+    def _query(self, package_paths):
+        """
+        Method for run one rpm process over the packages.
+
+        :param package_paths: list[str]
+        :return: list[dict] or None when rpm failed on any package
+        """
+        query = subprocess.run(
+            ["rpm", "--nosignature", "-qp", "--queryformat", QUERYFORMAT,
+             *package_paths],
+            capture_output=True,
+            text=True,
+        )
+        records = self.parse(query.stdout)
+        if query.returncode != 0 or len(records) != len(package_paths):
+            return None
+        return records
+
+    def _query_chunk(self, package_paths):
+        """
+        Method for query a chunk, bisect it when some package is broken.
+
+        :param package_paths: list[str]
+        :return: generator of (package_path, info or None)
+        """
+        records = self._query(package_paths)
+        if records is not None:
+            yield from zip(package_paths, records)
+        elif len(package_paths) == 1:
+            self.logger.error(f"Error querying RPM file: {package_paths[0]}")
+            yield package_paths[0], None
+        else:
+            middle = len(package_paths) // 2
+            yield from self._query_chunk(package_paths[:middle])
+            yield from self._query_chunk(package_paths[middle:])
+
+    def iter_all(self):
+        """
+        Method for get all data from packages one by one.
+
+        :return: generator of {package_path: info} dicts
+        """
+        for start in range(0, len(self.package_paths), self.chunk_size):
+            chunk = self.package_paths[start:start + self.chunk_size]
+            for package_path, info in self._query_chunk(chunk):
+                if info is None:
+                    info = {section: None for section in SECTIONS}
+                if package_path.endswith(".src.rpm"):
+                    try:
+                        content = \
+                            PackageInfo(self.logger, package_path).get_rpm_content()
+                    except Exception as e:
+                        self.logger.error(f"Can't get content of {package_path}: {e}")
+                        content = None
+                    # Same key order as PackageInfo.get_all()
+                    info = {"metadata": info["metadata"], "content": content,
+                            **{section: info[section] for section in SECTIONS[1:]}}
+                yield {package_path: info}
+
+    def get_all(self):
+        """
+        Method for get all data from all packages.
+
+        :return: {dict} {package_path: info}
+        """
+        rpm_info = {}
+        for record in self.iter_all():
+            rpm_info.update(record)
+        return rpm_info
@@ -0,0 +1,412 @@
+"""Module with local indexed store of packages metadata and diffs between runs."""
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+from local_functions.result_writer import file_rows, package_metadata
+
+# Compared fields, lists whose order has no meaning are sorted first.
+FIELDS = ["version", "summary", "license", "requires", "provides", "scripts",
+          "files", "content"]
+UNORDERED = {"requires", "provides", "files", "content"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY, name TEXT UNIQUE, release TEXT, created REAL);
+CREATE TABLE IF NOT EXISTS packages (
+    id INTEGER PRIMARY KEY,
+    run_id INTEGER REFERENCES runs (id) ON DELETE CASCADE,
+    path TEXT, nevra TEXT, name TEXT, arch TEXT, info TEXT,
+    {digests},
+    UNIQUE (run_id, path));
+CREATE INDEX IF NOT EXISTS packages_run_name ON packages (run_id, name, arch);
+CREATE INDEX IF NOT EXISTS packages_nevra ON packages (nevra);
+CREATE INDEX IF NOT EXISTS packages_name ON packages (name);
+CREATE TABLE IF NOT EXISTS dependencies (
+    package_id INTEGER REFERENCES packages (id) ON DELETE CASCADE,
+    kind TEXT, name TEXT, entry TEXT);
+CREATE INDEX IF NOT EXISTS dependencies_name ON dependencies (kind, name);
+CREATE INDEX IF NOT EXISTS dependencies_package ON dependencies (package_id);
+CREATE TABLE IF NOT EXISTS files (
+    package_id INTEGER REFERENCES packages (id) ON DELETE CASCADE,
+    path TEXT, sha256 TEXT);
+CREATE INDEX IF NOT EXISTS files_path ON files (path);
+CREATE INDEX IF NOT EXISTS files_sha256 ON files (sha256);
+CREATE INDEX IF NOT EXISTS files_package ON files (package_id);
+""".format(digests=", ".join(f"{field}_digest TEXT" for field in FIELDS))
+
+
+def _nevra_arch(package_path):
+    """
+    Function for get NEVRA and arch from the package file name.
+
+    :param package_path: str, e.g. ".../bash-5.1.8-6.el9.x86_64.rpm"
+    :return: (str nevra, str arch)
+    """
+    nevra = os.path.basename(package_path)
+    if nevra.endswith(".rpm"):
+        nevra = nevra[:-len(".rpm")]
+    return nevra, nevra.rsplit(".", 1)[-1] if "." in nevra else ""
+
+
+def _fields(info):
+    """
+    Function for get compared fields of the package.
+
+    :param info: dict PackageInfo.get_all() value
+    :return: dict {field: value}
+    """
+    metadata = package_metadata(info)
+    fields = {
+        "version": f"{metadata.get('version')}-{metadata.get('release')}",
+        "summary": metadata.get("summary"),
+        "license": metadata.get("license"),
+    }
+    for field in ("requires", "provides", "scripts", "files", "content"):
+        value = info.get(field) or []
+        fields[field] = sorted(value) if field in UNORDERED else value
+    return fields
+
+
+def _digest(value):
+    return hashlib.sha1(json.dumps(value, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+
+def _change(field, old, new):
+    """
+    Function for describe change of one field.
+
+    :return: dict {"added", "removed"} for lists, {"old", "new"} otherwise
+    """
+    if field in UNORDERED:
+        old, new = set(old), set(new)
+        return {"added": sorted(new - old), "removed": sorted(old - new)}
+    return {"old": old, "new": new}
+
+
+class MetadataStore:
+    """
+    Class for keep PackageInfo.get_all() results of runs in SQLite.
+
+    Every run is a named set of packages (e.g. "el9-2024-05-01"),
+    optionally labelled with its release. Packages are indexed by NEVRA
+    and name, requires/provides by dependency name, files by path and
+    content sha256. Every compared field is stored with its digest,
+    so diff compares digests in SQL and decodes only changed packages.
+    """
+
+    def __init__(self, logger, path):
+        self.logger = logger
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=30)
+        self.db.execute("PRAGMA foreign_keys = ON")
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        self.db.executescript(SCHEMA)
+        self.db.commit()
+
+    def run_id(self, run, release=None, create=False):
+        """
+        Method for get id of the run.
+
+        :param run: str run name
+        :param release: str, e.g. "el9", saved when the run is created
+        :param create: bool create missing run
+        :return: int or None
+        """
+        row = self.db.execute("SELECT id FROM runs WHERE name = ?", (run,)).fetchone()
+        if row is not None:
+            return row[0]
+        if not create:
+            return None
+        cursor = self.db.execute("INSERT INTO runs (name, release, created) VALUES (?, ?, ?)",
+                                 (run, release, time.time()))
+        return cursor.lastrowid
+
+    def runs(self, release=None):
+        """
+        Method for list runs, the newest last.
+
+        :param release: str filter by release
+        :return: list of dicts {"name", "release", "created", "packages"}
+        """
+        query = ("SELECT runs.name, runs.release, runs.created, COUNT(packages.id) "
+                 "FROM runs LEFT JOIN packages ON packages.run_id = runs.id ")
+        query += "WHERE runs.release = ? " if release is not None else ""
+        query += "GROUP BY runs.id ORDER BY runs.created"
+        rows = self.db.execute(query, (release,) if release is not None else ())
+        return [{"name": name, "release": run_release, "created": created, "packages": count}
+                for name, run_release, created, count in rows]
+
+    def ingest(self, run, records, release=None):
+        """
+        Method for save results into the run.
+
+        Packages already saved in the run under the same path are replaced.
+
+        :param run: str run name
+        :param records: dict {package_path: info} or iterable of such dicts,
+                        e.g. PackageAnalyzer.iter_results()
+        :param release: str, e.g. "el9"
+        :return: int number of saved packages
+        """
+        if isinstance(records, dict):
+            records = [records]
+        with self.writer(run, release=release) as writer:
+            for record in records:
+                writer.write(record)
+        return writer.count
+
+    def writer(self, run, release=None):
+        """
+        Method for get writer which saves results into the run.
+
+        It has the interface of result_writer writers, so it may be
+        passed to PackageAnalyzer.write_all() next to them.
+
+        :param run: str run name
+        :param release: str, e.g. "el9"
+        :return: RunWriter
+        """
+        return RunWriter(self, run, release=release)
+
+    def _insert(self, run_id, package_path, info, replace=True):
+        """Method for save one package, the caller commits."""
+        fields = _fields(info)
+        nevra, arch = _nevra_arch(package_path)
+        name = package_metadata(info).get("name") or nevra
+        if replace:
+            self.db.execute("DELETE FROM packages WHERE run_id = ? AND path = ?",
+                            (run_id, package_path))
+        cursor = self.db.execute(
+            f"INSERT INTO packages (run_id, path, nevra, name, arch, info, "
+            f"{', '.join(f'{field}_digest' for field in FIELDS)}) "
+            f"VALUES (?, ?, ?, ?, ?, ?, {', '.join('?' * len(FIELDS))})",
+            [run_id, package_path, nevra, name, arch,
+             json.dumps(info, separators=(",", ":"))] +
+            [_digest(fields[field]) for field in FIELDS])
+        package_id = cursor.lastrowid
+        self.db.executemany(
+            "INSERT INTO dependencies (package_id, kind, name, entry) VALUES (?, ?, ?, ?)",
+            [(package_id, kind, entry.split(" ", 1)[0], entry)
+             for kind in ("requires", "provides") for entry in fields[kind]])
+        self.db.executemany(
+            "INSERT INTO files (package_id, path, sha256) VALUES (?, ?, ?)",
+            [(package_id, row["file"], row["sha256"])
+             for row in file_rows(package_path, info) if row["file"] is not None])
+
+    def _packages(self, where, parameters):
+        rows = self.db.execute(
+            "SELECT runs.name, packages.nevra, packages.path FROM packages "
+            f"JOIN runs ON runs.id = packages.run_id WHERE {where} "
+            "ORDER BY runs.created, packages.nevra", parameters)
+        return [{"run": run, "nevra": nevra, "path": path} for run, nevra, path in rows]
+
+    def find(self, nevra=None, name=None):
+        """
+        Method for find packages by NEVRA or name in all runs.
+
+        :param nevra: str, e.g. "bash-5.1.8-6.el9.x86_64"
+        :param name: str, e.g. "bash"
+        :return: list of dicts {"run", "nevra", "path"}
+        """
+        if nevra is not None:
+            return self._packages("packages.nevra = ?", (nevra,))
+        return self._packages("packages.name = ?", (name,))
+
+    def what_provides(self, dependency):
+        """
+        Method for find packages which provide the name.
+
+        :param dependency: str, e.g. "libc.so.6()(64bit)"
+        :return: list of dicts {"run", "nevra", "path"}
+        """
+        return self._packages("packages.id IN (SELECT package_id FROM dependencies "
+                              "WHERE kind = 'provides' AND name = ?)", (dependency,))
+
+    def what_requires(self, dependency):
+        """
+        Method for find packages which require the name.
+
+        :param dependency: str, e.g. "glibc"
+        :return: list of dicts {"run", "nevra", "path"}
+        """
+        return self._packages("packages.id IN (SELECT package_id FROM dependencies "
+                              "WHERE kind = 'requires' AND name = ?)", (dependency,))
+
+    def file_owners(self, path=None, sha256=None):
+        """
+        Method for find packages by file path or content checksum.
+
+        :param path: str, e.g. "/usr/bin/bash"
+        :param sha256: str
+        :return: list of dicts {"run", "nevra", "path"}
+        """
+        if path is not None:
+            return self._packages("packages.id IN (SELECT package_id FROM files "
+                                  "WHERE path = ?)", (path,))
+        return self._packages("packages.id IN (SELECT package_id FROM files "
+                              "WHERE sha256 = ?)", (sha256,))
+
+    def _digest_rows(self, run_id):
+        """
+        Method for get packages of the run with their digests.
+
+        :return: list of (id, nevra, name, arch, tuple of digests)
+        """
+        digests = ", ".join(f"{field}_digest" for field in FIELDS)
+        rows = self.db.execute(f"SELECT id, nevra, name, arch, {digests} FROM packages "
+                               "WHERE run_id = ? ORDER BY nevra, id", (run_id,))
+        return [(package_id, nevra, name, arch, tuple(digests))
+                for package_id, nevra, name, arch, *digests in rows]
+
+    @staticmethod
+    def _match(old_rows, new_rows):
+        """
+        Method for pair packages of two runs.
+
+        Same NEVRAs are paired first, the rest is paired by name and
+        arch when both runs have exactly one package left of it.
+
+        :return: (list of (old row, new row), list of added rows, list of removed rows)
+        """
+        def group(rows, key):
+            groups = {}
+            for row in rows:
+                groups.setdefault(key(row), []).append(row)
+            return groups
+
+        pairs, added, removed = [], [], []
+        old_left, new_left = [], []
+        old_by_nevra = group(old_rows, lambda row: row[1])
+        for nevra, new_group in group(new_rows, lambda row: row[1]).items():
+            old_group = old_by_nevra.pop(nevra, [])
+            pairs.extend(zip(old_group, new_group))
+            old_left.extend(old_group[len(new_group):])
+            new_left.extend(new_group[len(old_group):])
+        for old_group in old_by_nevra.values():
+            old_left.extend(old_group)
+
+        old_by_name = group(old_left, lambda row: (row[2], row[3]))
+        for key, new_group in group(new_left, lambda row: (row[2], row[3])).items():
+            old_group = old_by_name.pop(key, [])
+            if len(old_group) == 1 and len(new_group) == 1:
+                pairs.append((old_group[0], new_group[0]))
+            else:
+                # Several versions of one name, e.g. kernels, are
+                # reported as sets of added and removed NEVRAs.
+                added.extend(new_group)
+                removed.extend(old_group)
+        for old_group in old_by_name.values():
+            removed.extend(old_group)
+        return pairs, added, removed
+
+    def _info(self, package_id):
+        row = self.db.execute("SELECT info FROM packages WHERE id = ?", (package_id,)).fetchone()
+        return json.loads(row[0])
+
+    def diff(self, old_run, new_run):
+        """
+        Method for compare two runs.
+
+        Packages with the same NEVRA are compared first, the rest is
+        matched by name and arch (src for sources), so runs of different
+        releases are compared too. Names with several versions left on
+        either side are reported as added and removed NEVRAs.
+
+        :param old_run: str run name
+        :param new_run: str run name
+        :return: dict {"added": [nevra], "removed": [nevra],
+                       "changed": [{"name", "arch", "old", "new", "fields"}]}
+        """
+        old_id, new_id = self.run_id(old_run), self.run_id(new_run)
+        if old_id is None or new_id is None:
+            raise ValueError(f"Unknown run {old_run if old_id is None else new_run}")
+        pairs, added, removed = self._match(self._digest_rows(old_id),
+                                            self._digest_rows(new_id))
+        changed = []
+        for old, new in pairs:
+            if old[4] == new[4]:
+                continue
+            old_fields = _fields(self._info(old[0]))
+            new_fields = _fields(self._info(new[0]))
+            changed.append({
+                "name": old[2],
+                "arch": old[3],
+                "old": old[1],
+                "new": new[1],
+                "fields": {field: _change(field, old_fields[field], new_fields[field])
+                           for field, old_digest, new_digest in zip(FIELDS, old[4], new[4])
+                           if old_digest != new_digest},
+            })
+        changed.sort(key=lambda change: (change["name"], change["arch"], change["old"]))
+        added = sorted(row[1] for row in added)
+        removed = sorted(row[1] for row in removed)
+        self.logger.info(f"Diff {old_run} -> {new_run}: {len(added)} added, "
+                         f"{len(removed)} removed, {len(changed)} changed")
+        return {"added": added, "removed": removed, "changed": changed}
+
+    def diff_releases(self, old_release, new_release):
+        """
+        Method for compare the newest runs of two releases, e.g. el8 and el9.
+
+        :param old_release: str
+        :param new_release: str
+        :return: dict, see diff
+        """
+        latest = {}
+        for release in (old_release, new_release):
+            runs = self.runs(release=release)
+            if not runs:
+                raise ValueError(f"No runs of release {release}")
+            latest[release] = runs[-1]["name"]
+        return self.diff(latest[old_release], latest[new_release])
+
+    def close(self):
+        """Method for close the database."""
+        self.db.close()
+
+
+class RunWriter:
+    """
+    Class for save results into a run of MetadataStore as they are produced.
+
+    Packages are committed together on close, nothing is saved when
+    the writer is left by an exception.
+    """
+
+    def __init__(self, store, run, release=None):
+        self.store = store
+        self.run = run
+        self.count = 0
+        # Nothing to replace in a new run.
+        self._replace = store.run_id(run) is not None
+        self._run_id = store.run_id(run, release=release, create=True)
+
+    def write(self, record):
+        """
+        Method for save results of packages.
+
+        :param record: dict {package_path: info}
+        """
+        for package_path, info in record.items():
+            self.store._insert(self._run_id, package_path, info, replace=self._replace)
+            self.count += 1
+
+    def close(self):
+        """Method for commit saved packages."""
+        self.store.db.commit()
+        self.store.logger.info(f"Saved {self.count} packages of run {self.run} "
+                               f"to {self.store.path}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is not None:
+            self.store.db.rollback()
+            return
+        self.close()
@@ -0,0 +1,235 @@
+"""Module for analyze many software packages in parallel processes."""
+
+import contextlib
+import glob
+import logging
+import os
+import resource
+import signal
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import config.conf as config
+from local_functions.package_cache import PackageCache
+from local_functions.package_info import PackageInfo
+from local_functions.result_writer import open_writer
+from logger.metrics import metrics
+
+_worker_logger = None
+_worker_cache = None
+_worker_backend = "cli"
+
+
+class _AnalyzeError(Exception):
+    """Failure of a worker, carries its metrics to the parent."""
+
+    def __init__(self, message, collected):
+        super().__init__(message, collected)
+        self.message = message
+        self.collected = collected
+
+    def __str__(self):
+        return self.message
+
+
+def _init_worker(logger_name, memory_limit, cache_dir, cache_max_bytes, backend):
+    """
+    Function for setup worker process.
+
+    Ctrl-C is handled by the parent only, memory_limit (bytes) caps
+    the address space of the worker.
+    """
+    global _worker_logger, _worker_cache, _worker_backend
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if memory_limit:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+    _worker_logger = logging.getLogger(logger_name)
+    _worker_backend = backend
+    if cache_dir:
+        _worker_cache = PackageCache(cache_dir, max_bytes=cache_max_bytes)
+
+
+def _analyze(package_path):
+    """
+    Function for get all data of one package in the worker.
+
+    Metrics of the worker are returned with the result, only the parent
+    process reports them.
+
+    :param package_path: str
+    :return: ({dict} PackageInfo.get_all(), metrics.collect())
+    """
+    try:
+        result = PackageInfo(_worker_logger, package_path, cache=_worker_cache,
+                             backend=_worker_backend).get_all()
+    except Exception as e:
+        raise _AnalyzeError(repr(e), metrics.collect()) from e
+    return result, metrics.collect()
+
+
+class PackageAnalyzer:
+    """
+    Class for run PackageInfo.get_all() over many packages on all cores.
+
+    Source packages and big packages are scheduled first, results are
+    yielded as soon as each package is done. Results are cached in
+    config.cache_dir unless another cache_dir is passed. backend is
+    passed to PackageInfo.
+    """
+
+    def __init__(self, logger, package_paths, workers=None, memory_limit=None,
+                 cache_dir=None, cache_max_bytes=None, backend="cli"):
+        self.logger = logger
+        self.package_paths = list(package_paths)
+        self.workers = workers or os.cpu_count() or 1
+        self.memory_limit = memory_limit
+        self.cache_dir = cache_dir or config.cache_dir
+        self.cache_max_bytes = cache_max_bytes or config.cache_max_bytes
+        self.backend = backend
+
+    @staticmethod
+    def find_packages(pattern):
+        """
+        Method for find packages by directory or glob pattern.
+
+        :param pattern: directory (searched recursively) or glob
+        :return: list[str]
+        """
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, "**", "*.rpm")
+        return sorted(glob.glob(pattern, recursive=True))
+
+    def _schedule(self):
+        """
+        Method for order packages, biggest work first.
+
+        :return: list[str]
+        """
+        def weight(package_path):
+            try:
+                size = os.path.getsize(package_path)
+            except OSError:
+                size = 0
+            return package_path.endswith(".src.rpm"), size
+        return sorted(self.package_paths, key=weight, reverse=True)
+
+    @staticmethod
+    def _terminate_workers(executor):
+        """
+        Method for cancel queued packages and kill busy workers at once.
+
+        Executors older than Python 3.14 have no terminate_workers(),
+        their processes are terminated directly.
+
+        :param executor: ProcessPoolExecutor
+        """
+        terminate_workers = getattr(executor, "terminate_workers", None)
+        if terminate_workers is not None:
+            terminate_workers()
+            return
+        processes = list((executor._processes or {}).values())
+        executor.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+
+    def iter_results(self):
+        """
+        Method for analyze packages and yield results as they finish.
+
+        :return: generator of {package_path: info} dicts
+        """
+        pending_paths = iter(self._schedule())
+        executor = ProcessPoolExecutor(max_workers=self.workers,
+                                       initializer=_init_worker,
+                                       initargs=(self.logger.name, self.memory_limit,
+                                                 self.cache_dir, self.cache_max_bytes,
+                                                 self.backend))
+        running = {}
+
+        def submit(count):
+            for package_path in pending_paths:
+                running[executor.submit(_analyze, package_path)] = package_path
+                count -= 1
+                if count == 0:
+                    break
+
+        try:
+            # Keep only a window of tasks queued, results are not piled up.
+            submit(self.workers * 2)
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    package_path = running.pop(future)
+                    try:
+                        result, collected = future.result()
+                    except _AnalyzeError as e:
+                        metrics.merge(e.collected)
+                        self.logger.error(f"Can't analyze {package_path}: {e}")
+                        metrics.count("packages_analyzed_total", status="failed")
+                    except Exception as e:
+                        self.logger.error(f"Can't analyze {package_path}: {e!r}")
+                        metrics.count("packages_analyzed_total", status="failed")
+                    else:
+                        metrics.merge(collected)
+                        metrics.count("packages_analyzed_total", status="ok")
+                        metrics.count("package_bytes_analyzed_total",
+                                      os.path.getsize(package_path))
+                        yield result
+                submit(len(done))
+        except KeyboardInterrupt:
+            self.logger.error("Analysis interrupted, cancelling workers.")
+            # Workers ignore SIGINT, queued packages are cancelled and
+            # busy workers are killed, not waited for.
+            self._terminate_workers(executor)
+            raise
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def get_all(self):
+        """
+        Method for get all data from all packages.
+
+        :return: {dict} {package_path: info}
+        """
+        rpm_info = {}
+        for record in self.iter_results():
+            rpm_info.update(record)
+        return rpm_info
+
+    def write_all(self, *writers):
+        """
+        Method for write results to writers as each package is done.
+
+        Results are not collected, see result_writer.
+
+        :param writers: JsonLinesWriter, ColumnarWriter, ...
+        :return: int number of written packages
+        """
+        count = 0
+        for record in self.iter_results():
+            for writer in writers:
+                writer.write(record)
+            count += len(record)
+        return count
+
+    def write_files(self, *paths, writers=()):
+        """
+        Method for write results to files as each package is done.
+
+        Writers are chosen by extension, see result_writer.open_writer().
+        They are closed also when analysis fails, so Parquet and Arrow
+        files written so far keep a valid footer.
+
+        :param paths: str, e.g. "results.jsonl.zst", "results.parquet"
+        :param writers: other writers, e.g. MetadataStore.writer(),
+                        they are left by the same way
+        :return: int number of written packages
+        """
+        with contextlib.ExitStack() as stack:
+            all_writers = [stack.enter_context(open_writer(path)) for path in paths]
+            all_writers += [stack.enter_context(writer) for writer in writers]
+            count = self.write_all(*all_writers)
+        self.logger.info(f"Results of {count} packages written to "
+                         f"{', '.join(paths) or 'writers'}")
+        return count
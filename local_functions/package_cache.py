@@ -0,0 +1,191 @@
+"""Module with persistent cache of software packages metadata."""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Increase when the format of PackageInfo.get_all() or of keys changes.
+SCHEMA_VERSION = 2
+
+
+class PackageCache:
+    """
+    Class for store PackageInfo.get_all() results on disk.
+
+    Entries are keyed by PackageInfo backend and sha256 of the package
+    file, so renamed or re-downloaded packages hit the same entry. The
+    cache is a SQLite database in WAL mode, every process opens its own
+    connection, so it may be shared by parallel workers. The stored size
+    is kept as a running total in the stats table, least recently used
+    entries are evicted when it grows over max_bytes.
+    """
+
+    def __init__(self, cache_dir, max_bytes=1024 ** 3, schema_version=SCHEMA_VERSION):
+        self.cache_dir = cache_dir
+        self.path = os.path.join(cache_dir, "package_cache.sqlite")
+        self.max_bytes = max_bytes
+        self.schema_version = schema_version
+        self.hits = 0
+        self.misses = 0
+        self._connection = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _db(self):
+        """
+        Method for get connection of the current process.
+
+        :return: sqlite3.Connection
+        """
+        if self._connection is None or self._pid != os.getpid():
+            os.makedirs(self.cache_dir, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30,
+                                         check_same_thread=False,
+                                         isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS entries ("
+                               "key TEXT PRIMARY KEY, schema INTEGER, "
+                               "value TEXT, size INTEGER, last_access REAL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS entries_last_access "
+                               "ON entries (last_access)")
+            connection.execute("CREATE TABLE IF NOT EXISTS stats ("
+                               "name TEXT PRIMARY KEY, value INTEGER)")
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                deleted = connection.execute("DELETE FROM entries WHERE schema != ?",
+                                             (self.schema_version,)).rowcount
+                if deleted or self._stored_bytes(connection) is None:
+                    # Counted once, inserts and evictions keep it up to date.
+                    connection.execute("INSERT OR REPLACE INTO stats (name, value) "
+                                       "SELECT 'bytes', COALESCE(SUM(size), 0) FROM entries")
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+    @staticmethod
+    def digest(package_path, chunk_size=1024 * 1024):
+        """
+        Method for get cache key of the package file.
+
+        :param package_path: str
+        :return: str sha256
+        """
+        checksum = hashlib.sha256()
+        with open(package_path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                checksum.update(chunk)
+        return checksum.hexdigest()
+
+    @classmethod
+    def key(cls, package_path, backend):
+        """
+        Method for get cache key of the package analyzed by the backend.
+
+        Results of native and rpm cli backends differ in details, so
+        they are stored apart.
+
+        :param package_path: str
+        :param backend: str PackageInfo backend
+        :return: str
+        """
+        return f"{backend}:{cls.digest(package_path)}"
+
+    @staticmethod
+    def _stored_bytes(db):
+        row = db.execute("SELECT value FROM stats WHERE name = 'bytes'").fetchone()
+        return None if row is None else row[0]
+
+    def _count(self, name):
+        self._db().execute("INSERT INTO stats (name, value) VALUES (?, 1) "
+                           "ON CONFLICT(name) DO UPDATE SET value = value + 1",
+                           (name,))
+
+    def get(self, key):
+        """
+        Method for get stored value.
+
+        :param key: str, see key()
+        :return: stored value or None
+        """
+        with self._lock:
+            db = self._db()
+            row = db.execute("SELECT value FROM entries WHERE key = ? AND schema = ?",
+                             (key, self.schema_version)).fetchone()
+            if row is None:
+                self.misses += 1
+                self._count("misses")
+                return None
+            db.execute("UPDATE entries SET last_access = ? WHERE key = ?",
+                       (time.time(), key))
+            self.hits += 1
+            self._count("hits")
+            return json.loads(row[0])
+
+    def put(self, key, value):
+        """
+        Method for store value and evict old entries.
+
+        :param key: str, see key()
+        :param value: JSON serializable value
+        """
+        data = json.dumps(value, separators=(",", ":"))
+        with self._lock:
+            db = self._db()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+                db.execute("INSERT OR REPLACE INTO entries "
+                           "(key, schema, value, size, last_access) VALUES (?, ?, ?, ?, ?)",
+                           (key, self.schema_version, data, len(data), time.time()))
+                db.execute("UPDATE stats SET value = value + ? WHERE name = 'bytes'",
+                           (len(data) - (row[0] if row else 0),))
+                self._evict(db)
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+
+    def _evict(self, db):
+        """Method for delete least recently used entries over max_bytes."""
+        total = self._stored_bytes(db)
+        if total <= self.max_bytes:
+            return
+        for key, size in db.execute("SELECT key, size FROM entries "
+                                    "ORDER BY last_access").fetchall():
+            if total <= self.max_bytes:
+                break
+            db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+        db.execute("UPDATE stats SET value = ? WHERE name = 'bytes'", (total,))
+
+    def stats(self):
+        """
+        Method for get hit/miss counters and stored size.
+
+        :return: dict with counters of this process and of all processes
+        """
+        with self._lock:
+            totals = dict(self._db().execute("SELECT name, value FROM stats").fetchall())
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "total_hits": totals.get("hits", 0),
+            "total_misses": totals.get("misses", 0),
+            "bytes": totals.get("bytes", 0),
+        }
+
+    def clear(self):
+        """Method for delete all entries."""
+        with self._lock:
+            db = self._db()
+            db.execute("BEGIN IMMEDIATE")
+            db.execute("DELETE FROM entries")
+            db.execute("UPDATE stats SET value = 0 WHERE name = 'bytes'")
+            db.execute("COMMIT")
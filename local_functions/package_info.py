@@ -1,19 +1,50 @@
 """Module for get metadata from software package."""
 
 import os
-import shutil
-import glob
-import hashlib
+import struct
 import subprocess
-import tempfile
 
+from local_functions.rpm_header import RPMHeader
+from local_functions.rpm_payload import payload_checksums
+from logger.metrics import instrument, metrics
 
+
+@instrument
 class PackageInfo:
-    """Class for run query requests to rpm package."""
+    """
+    Class for run query requests to rpm package.
+
+    backend "native" reads the header with RPMHeader, "cli" runs rpm,
+    "auto" uses RPMHeader and falls back to rpm when it can't be parsed.
+    "cli" stays the default until "python -m benchmarks.rpm_fixtures check"
+    passes on fixtures captured from rpm.
+    """
 
-    def __init__(self, logger, package_path):
+    def __init__(self, logger, package_path, cache=None, backend="cli"):
         self.package_path = package_path
         self.logger = logger
+        self.cache = cache
+        self.backend = backend
+        self._header = None
+
+    def _native_header(self):
+        """
+        Method for get parsed header when native backend is used.
+
+        :return: RPMHeader or None for rpm cli
+        """
+        if self.backend == "cli":
+            return None
+        if self._header is None:
+            try:
+                self._header = RPMHeader(self.package_path)
+            except (OSError, ValueError, struct.error) as e:
+                if self.backend == "native":
+                    raise
+                self.logger.error(f"Can't read RPM header, using rpm: {e}")
+                self.backend = "cli"
+                return None
+        return self._header
 
     def get_rpm_metadata(self):
         """
@@ -21,6 +52,9 @@ class PackageInfo:
 
         :return (str)
         """
+        header = self._native_header()
+        if header is not None:
+            return header.metadata()
         try:
             query = subprocess.run(
                 [
@@ -47,43 +81,11 @@ class PackageInfo:
         """
         Method for get content sha256sums of the rpm package.
 
+        The payload is hashed as a stream, see rpm_payload.
+
         :return: list[str] = []
         """
-        results = []
-        try:
-            # Create temporary directory.
-            temp_dir = tempfile.mkdtemp()
-            # Extract contents of src.rpm
-            cpio_file = os.path.join(temp_dir, "files.cpio")
-            with open(cpio_file, "wb") as f:
-                subprocess.run(["rpm2cpio", self.package_path],
-                               check=True, stdout=f)
-
-            # Unpack cpio archive to temp directory.
-            unpack_dir = os.path.join(temp_dir, "unpacked")
-            os.makedirs(unpack_dir)
-            subprocess.run(["cpio", "-id", "--quiet"], check=True,
-                           cwd=unpack_dir, stdin=open(cpio_file, "rb"))
-
-            # Extract gz files.
-            gz_files = glob.glob(os.path.join(unpack_dir, "*.gz"))
-            for gz_file in gz_files:
-                subprocess.run(["gzip", "-d", "-q", gz_file], check=True)
-            # Extract bz files.
-            bz2_files = glob.glob(os.path.join(unpack_dir, "*.bz2"))
-            for bz2_file in bz2_files:
-                subprocess.run(["bzip2", "-d", "-q", bz2_file], check=True)
-
-            # Get checksums.
-            for root, dirs, files in os.walk(unpack_dir):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    file_checksum = \
-                        hashlib.sha256(open(file_path, "rb").read()).hexdigest()
-                    results.append(f'{file}: {file_checksum}')
-        finally:
-            shutil.rmtree(temp_dir)
-        return results
+        return payload_checksums(self.logger, self.package_path)
 
     def get_provides(self):
         """
@@ -91,6 +93,9 @@ class PackageInfo:
 
         :return: (str)
         """
+        header = self._native_header()
+        if header is not None:
+            return header.provides()
         provides_cmd = [
             "rpm", "--nosignature",
             "-qp", "--provides",
@@ -108,6 +113,9 @@ class PackageInfo:
 
         :return: (str)
         """
+        header = self._native_header()
+        if header is not None:
+            return header.requires()
         requires_cmd = [
             "rpm",
             "--nosignature",
@@ -127,6 +135,9 @@ class PackageInfo:
 
         :return: (str)
         """
+        header = self._native_header()
+        if header is not None:
+            return header.scripts()
         scripts_cmd = [
             "rpm",
             "--nosignature",
@@ -146,6 +157,9 @@ class PackageInfo:
 
         :return: (str)
         """
+        header = self._native_header()
+        if header is not None:
+            return header.files()
         try:
             files_cmd = ["rpm", "-qpl", "--nosignature", self.package_path]
             output = subprocess.check_output(files_cmd, encoding="utf-8")
@@ -160,6 +174,15 @@ class PackageInfo:
         :return: {dict}
         """
         rpm_info = {}
+        metrics.annotate(package=self.package_path,
+                         bytes=os.path.getsize(self.package_path))
+        if self.cache is not None:
+            key = self.cache.key(self.package_path, self.backend)
+            info = self.cache.get(key)
+            if info is not None:
+                metrics.annotate(cached=True)
+                rpm_info[self.package_path] = info
+                return rpm_info
         info = {}
         if self.package_path.endswith(".src.rpm"):
             info["metadata"] = self.get_rpm_metadata()
@@ -176,6 +199,9 @@ class PackageInfo:
             info["scripts"] = self.get_scripts()
             info["files"] = self.get_files()
 
+        # Failed queries are not cached.
+        if self.cache is not None and None not in info.values():
+            self.cache.put(key, info)
         rpm_info[self.package_path] = info
         return rpm_info
 
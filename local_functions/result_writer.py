@@ -0,0 +1,193 @@
+"""Module for write PackageInfo.get_all() results as they are produced."""
+
+import json
+import os
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+NO_FILES = "(contains no files)"
+
+
+def package_metadata(info):
+    """
+    Function for parse "Key: value" metadata lines.
+
+    :param info: dict PackageInfo.get_all() value
+    :return: dict {"name": ..., "version": ..., ...}
+    """
+    metadata = {}
+    for line in info.get("metadata") or []:
+        key, _, value = line.partition(": ")
+        metadata[key.lower()] = value
+    return metadata
+
+
+def file_rows(package_path, info):
+    """
+    Function for flatten one package to one row per file entry.
+
+    Checksums of source packages are matched to files by base name,
+    checksums without a file (e.g. decompressed tarballs) get own rows.
+
+    :param package_path: str
+    :param info: dict PackageInfo.get_all() value
+    :return: generator of dicts
+    """
+    metadata = package_metadata(info)
+    package = {"package": package_path,
+               "name": metadata.get("name"),
+               "version": metadata.get("version"),
+               "release": metadata.get("release"),
+               "license": metadata.get("license"),
+               "source": package_path.endswith(".src.rpm")}
+    checksums = {}
+    for line in info.get("content") or []:
+        file_name, _, checksum = line.rpartition(": ")
+        checksums[file_name] = checksum
+    files = [path for path in info.get("files") or [] if path != NO_FILES]
+    for path in files:
+        yield dict(package, file=path, sha256=checksums.pop(os.path.basename(path), None))
+    for file_name, checksum in checksums.items():
+        yield dict(package, file=file_name, sha256=checksum)
+    if not files and not checksums:
+        yield dict(package, file=None, sha256=None)
+
+
+class JsonLinesWriter:
+    """
+    Class for write one JSON line per package, optionally zstd compressed.
+
+    Lines have the {package_path: info} shape of PackageInfo.get_all(),
+    every record is written when it is passed, nothing is kept.
+    """
+
+    def __init__(self, path, compress=None):
+        self.path = path
+        self.compress = path.endswith(".zst") if compress is None else compress
+        if self.compress and zstandard is None:
+            raise RuntimeError("zstandard is required for compressed JSON lines")
+        self.count = 0
+        self._file = open(path, "wb")
+        self._stream = self._file
+        if self.compress:
+            self._stream = zstandard.ZstdCompressor().stream_writer(self._file)
+
+    def write(self, record):
+        """
+        Method for write results of packages.
+
+        :param record: dict {package_path: info}
+        """
+        for package_path, info in record.items():
+            line = json.dumps({package_path: info}, separators=(",", ":"))
+            self._stream.write(line.encode("utf-8") + b"\n")
+            self.count += 1
+
+    def close(self):
+        """Method for finish the file."""
+        self._stream.close()
+        if not self._file.closed:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ColumnarWriter:
+    """
+    Class for write one row per file entry to Parquet or Arrow IPC.
+
+    Rows are buffered up to row_group_size and written as one row group
+    (record batch), so memory does not grow with the number of packages.
+    Requires pyarrow.
+    """
+
+    def __init__(self, path, file_format=None, row_group_size=65536):
+        if pyarrow is None:
+            raise RuntimeError("pyarrow is required for Parquet and Arrow output")
+        self.path = path
+        self.file_format = file_format or ("arrow" if path.endswith((".arrow", ".feather"))
+                                           else "parquet")
+        self.row_group_size = row_group_size
+        self.count = 0
+        self.schema = pyarrow.schema([
+            ("package", pyarrow.string()),
+            ("name", pyarrow.string()),
+            ("version", pyarrow.string()),
+            ("release", pyarrow.string()),
+            ("license", pyarrow.string()),
+            ("source", pyarrow.bool_()),
+            ("file", pyarrow.string()),
+            ("sha256", pyarrow.string()),
+        ])
+        self._columns = {name: [] for name in self.schema.names}
+        if self.file_format == "arrow":
+            self._writer = pyarrow.ipc.new_file(path, self.schema)
+        else:
+            self._writer = pyarrow.parquet.ParquetWriter(path, self.schema,
+                                                         compression="zstd")
+
+    def _flush(self):
+        """Method for write buffered rows."""
+        if not self._columns["package"]:
+            return
+        batch = pyarrow.record_batch([self._columns[name] for name in self.schema.names],
+                                     schema=self.schema)
+        if self.file_format == "arrow":
+            self._writer.write_batch(batch)
+        else:
+            self._writer.write_table(pyarrow.Table.from_batches([batch]))
+        self._columns = {name: [] for name in self.schema.names}
+
+    def write(self, record):
+        """
+        Method for write results of packages.
+
+        :param record: dict {package_path: info}
+        """
+        for package_path, info in record.items():
+            for row in file_rows(package_path, info):
+                for name, values in self._columns.items():
+                    values.append(row[name])
+            self.count += 1
+            if len(self._columns["package"]) >= self.row_group_size:
+                self._flush()
+
+    def close(self):
+        """Method for write rest of rows and finish the file."""
+        self._flush()
+        self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_writer(path):
+    """
+    Function for open writer by file extension.
+
+    .jsonl and .jsonl.zst are JSON lines, .parquet, .arrow and
+    .feather are columnar.
+
+    :param path: str
+    :return: JsonLinesWriter or ColumnarWriter
+    """
+    if path.endswith((".parquet", ".arrow", ".feather")):
+        return ColumnarWriter(path)
+    return JsonLinesWriter(path)
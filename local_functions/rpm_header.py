@@ -0,0 +1,232 @@
+"""Module for read rpm package header without rpm tools."""
+
+import mmap
+import struct
+
+LEAD_SIZE = 96
+LEAD_MAGIC = b"\xed\xab\xee\xdb"
+HEADER_MAGIC = b"\x8e\xad\xe8"
+HEADER_INTRO_SIZE = 16
+INDEX_ENTRY_SIZE = 16
+
+# Tag data types
+NULL, CHAR, INT8, INT16, INT32, INT64, STRING, BIN, STRING_ARRAY, I18NSTRING = range(10)
+INT_FORMATS = {CHAR: "B", INT8: "B", INT16: "H", INT32: "I", INT64: "Q"}
+
+# Tags
+NAME = 1000
+VERSION = 1001
+RELEASE = 1002
+EPOCH = 1003
+SUMMARY = 1004
+LICENSE = 1014
+ARCH = 1022
+PREIN = 1023
+POSTIN = 1024
+PREUN = 1025
+POSTUN = 1026
+OLDFILENAMES = 1027
+SOURCERPM = 1044
+PROVIDENAME = 1047
+REQUIREFLAGS = 1048
+REQUIRENAME = 1049
+REQUIREVERSION = 1050
+VERIFYSCRIPT = 1079
+PREINPROG = 1085
+POSTINPROG = 1086
+PREUNPROG = 1087
+POSTUNPROG = 1088
+VERIFYSCRIPTPROG = 1091
+PROVIDEFLAGS = 1112
+PROVIDEVERSION = 1113
+DIRINDEXES = 1116
+BASENAMES = 1117
+DIRNAMES = 1118
+PRETRANS = 1151
+POSTTRANS = 1152
+PRETRANSPROG = 1153
+POSTTRANSPROG = 1154
+
+# (script tag, program tag, name) in the order of "rpm --scripts" output.
+SCRIPTS = [
+    (PRETRANS, PRETRANSPROG, "pretrans"),
+    (PREIN, PREINPROG, "preinstall"),
+    (POSTIN, POSTINPROG, "postinstall"),
+    (PREUN, PREUNPROG, "preuninstall"),
+    (POSTUN, POSTUNPROG, "postuninstall"),
+    (POSTTRANS, POSTTRANSPROG, "posttrans"),
+    (VERIFYSCRIPT, VERIFYSCRIPTPROG, "verify"),
+]
+
+SENSE_LESS = 0x02
+SENSE_GREATER = 0x04
+SENSE_EQUAL = 0x08
+
+
+def _parse_header(data, offset):
+    """
+    Function for parse header structure at offset.
+
+    :param data: bytes-like object with the file start
+    :param offset: int start of the header
+    :return: (dict {tag: (type, count, data offset)}, store, end offset)
+    """
+    intro = data[offset:offset + HEADER_INTRO_SIZE]
+    if len(intro) != HEADER_INTRO_SIZE or bytes(intro[:3]) != HEADER_MAGIC:
+        raise ValueError("Bad rpm header magic")
+    index_count, store_size = struct.unpack(">II", intro[8:16])
+    index_start = offset + HEADER_INTRO_SIZE
+    store_start = index_start + index_count * INDEX_ENTRY_SIZE
+    end = store_start + store_size
+    if end > len(data):
+        raise ValueError("Truncated rpm header")
+    entries = {}
+    for position in range(index_start, store_start, INDEX_ENTRY_SIZE):
+        tag, tag_type, tag_offset, count = \
+            struct.unpack(">IIiI", data[position:position + INDEX_ENTRY_SIZE])
+        entries[tag] = (tag_type, count, tag_offset)
+    return entries, bytes(data[store_start:end]), end
+
+
+def _depflags(flags):
+    operator = ""
+    if flags & SENSE_LESS:
+        operator += "<"
+    if flags & SENSE_GREATER:
+        operator += ">"
+    if flags & SENSE_EQUAL:
+        operator += "="
+    return operator
+
+
+class RPMHeader:
+    """
+    Class for read tags of the rpm package main header.
+
+    The file is mapped with mmap and only lead and header bytes
+    are read, the payload is not touched.
+    """
+
+    def __init__(self, package_path):
+        self.package_path = package_path
+        with open(package_path, "rb") as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if len(data) < LEAD_SIZE or data[:4] != LEAD_MAGIC:
+                raise ValueError("Not an rpm package")
+            _, _, signature_end = _parse_header(data, LEAD_SIZE)
+            # Signature header is padded to 8 bytes.
+            header_start = signature_end + (8 - signature_end % 8) % 8
+            self.entries, self.store, self.payload_offset = \
+                _parse_header(data, header_start)
+
+    def get(self, tag, default=None):
+        """
+        Method for get tag value.
+
+        :param tag: int tag number
+        :return: str, list[str], list[int], bytes or default
+        """
+        if tag not in self.entries:
+            return default
+        tag_type, count, offset = self.entries[tag]
+        store = self.store
+        if tag_type in (STRING, I18NSTRING, STRING_ARRAY):
+            values = []
+            for _ in range(count):
+                end = store.index(b"\x00", offset)
+                values.append(store[offset:end].decode("utf-8", errors="replace"))
+                offset = end + 1
+            # Only the first (C locale) translation is used.
+            return values if tag_type == STRING_ARRAY else values[0]
+        if tag_type in INT_FORMATS:
+            item_format = INT_FORMATS[tag_type]
+            size = struct.calcsize(item_format)
+            return list(struct.unpack(f">{count}{item_format}",
+                                      store[offset:offset + size * count]))
+        if tag_type == BIN:
+            return store[offset:offset + count]
+        return default
+
+    def _string(self, tag):
+        value = self.get(tag)
+        if isinstance(value, list):
+            value = " ".join(value)
+        return "(none)" if value is None else value
+
+    def metadata(self):
+        """
+        Method for get metadata in "rpm -qp --queryformat" format.
+
+        :return: list[str]
+        """
+        return [
+            f"Name: {self._string(NAME)}",
+            f"Version: {self._string(VERSION)}",
+            f"Release: {self._string(RELEASE)}",
+            f"Summary: {self._string(SUMMARY)}",
+            f"License: {self._string(LICENSE)}",
+        ]
+
+    def _dependencies(self, name_tag, flags_tag, version_tag):
+        names = self.get(name_tag, [])
+        flags = self.get(flags_tag, [0] * len(names))
+        versions = self.get(version_tag, [""] * len(names))
+        dependencies = []
+        for name, flag, version in zip(names, flags, versions):
+            operator = _depflags(flag)
+            if operator and version:
+                dependencies.append(f"{name} {operator} {version}")
+            else:
+                dependencies.append(name)
+        return dependencies
+
+    def requires(self):
+        """
+        Method for get requires in "rpm -qp --requires" format.
+
+        :return: list[str]
+        """
+        return self._dependencies(REQUIRENAME, REQUIREFLAGS, REQUIREVERSION)
+
+    def provides(self):
+        """
+        Method for get provides in "rpm -qp --provides" format.
+
+        :return: list[str]
+        """
+        return self._dependencies(PROVIDENAME, PROVIDEFLAGS, PROVIDEVERSION)
+
+    def scripts(self):
+        """
+        Method for get scripts in "rpm -qp --scripts" format.
+
+        :return: list[str]
+        """
+        output = ""
+        for script_tag, program_tag, name in SCRIPTS:
+            script = self.get(script_tag)
+            program = self.get(program_tag)
+            if isinstance(program, list):
+                program = " ".join(program)
+            if script is not None:
+                using = f" (using {program})" if program else ""
+                output += f"{name} scriptlet{using}:\n{script}\n"
+            elif program:
+                output += f"{name} program: {program}\n"
+        return output.splitlines()
+
+    def files(self):
+        """
+        Method for get file list in "rpm -qpl" format.
+
+        :return: list[str]
+        """
+        base_names = self.get(BASENAMES)
+        if base_names is not None:
+            dir_names = self.get(DIRNAMES, [])
+            dir_indexes = self.get(DIRINDEXES, [])
+            files = [dir_names[index] + base_name
+                     for index, base_name in zip(dir_indexes, base_names)]
+        else:
+            files = self.get(OLDFILENAMES, [])
+        return files or ["(contains no files)"]
@@ -0,0 +1,188 @@
+"""Module for read rpm payload as a stream without unpacking it to disk."""
+
+import bz2
+import gzip
+import hashlib
+import lzma
+import os
+import subprocess
+
+from local_functions.rpm_header import RPMHeader
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CPIO_MAGICS = (b"070701", b"070702")
+CPIO_HEADER_SIZE = 110
+CPIO_TRAILER = "TRAILER!!!"
+CHUNK_SIZE = 1024 * 1024
+
+
+def open_payload(f):
+    """
+    Function for open decompressed cpio stream of the payload.
+
+    The compressor is detected by magic bytes.
+
+    :param f: binary file object positioned at the payload
+    :return: file object or None if compressor is not supported
+    """
+    magic = f.read(6)
+    f.seek(-len(magic), os.SEEK_CUR)
+    if magic.startswith(b"\x1f\x8b"):
+        return gzip.GzipFile(fileobj=f)
+    if magic.startswith(b"\xfd7zXZ\x00") or magic.startswith(b"\x5d\x00\x00"):
+        return lzma.LZMAFile(f)
+    if magic.startswith(b"BZh"):
+        return bz2.BZ2File(f)
+    if magic.startswith(b"\x28\xb5\x2f\xfd") and zstandard is not None:
+        return zstandard.ZstdDecompressor().stream_reader(f)
+    if magic in CPIO_MAGICS:
+        return f
+    return None
+
+
+def _read_exact(stream, size):
+    data = b""
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            raise ValueError("Unexpected end of cpio archive")
+        data += chunk
+    return data
+
+
+class EntryReader:
+    """
+    Class for read data of one cpio entry from the shared stream.
+
+    Optionally updates a hash with every byte read.
+    """
+
+    def __init__(self, stream, size, checksum=None):
+        self.stream = stream
+        self.remaining = size
+        self.checksum = checksum
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        if size == 0:
+            return b""
+        data = self.stream.read(size)
+        if not data:
+            raise ValueError("Unexpected end of cpio archive")
+        self.remaining -= len(data)
+        if self.checksum is not None:
+            self.checksum.update(data)
+        return data
+
+    def drain(self):
+        """Method for read the rest of the entry."""
+        while self.read(CHUNK_SIZE):
+            pass
+
+
+def iter_cpio(stream):
+    """
+    Function for walk newc cpio archive entries.
+
+    Entry data must be consumed before the next entry is requested,
+    otherwise it is skipped.
+
+    :param stream: binary file object of the cpio archive
+    :return: generator of (name, mode, EntryReader)
+    """
+    position = 0
+    while True:
+        header = _read_exact(stream, CPIO_HEADER_SIZE)
+        if header[:6] not in CPIO_MAGICS:
+            raise ValueError("Bad cpio entry magic")
+        fields = [int(header[6 + i * 8:14 + i * 8], 16) for i in range(13)]
+        mode, file_size, name_size = fields[1], fields[6], fields[11]
+        name = _read_exact(stream, name_size)[:-1].decode("utf-8", errors="replace")
+        position += CPIO_HEADER_SIZE + name_size
+        _read_exact(stream, (4 - position % 4) % 4)
+        position += (4 - position % 4) % 4
+        if name == CPIO_TRAILER:
+            return
+        reader = EntryReader(stream, file_size)
+        yield name, mode, reader
+        reader.drain()
+        position += file_size
+        _read_exact(stream, (4 - position % 4) % 4)
+        position += (4 - position % 4) % 4
+
+
+def _hash_reader(reader):
+    checksum = hashlib.sha256()
+    for chunk in iter(lambda: reader.read(CHUNK_SIZE), b""):
+        checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+DECOMPRESSORS = {
+    ".gz": lambda reader: gzip.GzipFile(fileobj=reader, mode="rb"),
+    ".bz2": bz2.BZ2File,
+}
+
+
+def entry_checksum(logger, name, reader):
+    """
+    Function for get sha256 of the cpio entry.
+
+    Top level *.gz and *.bz2 files are hashed decompressed, like
+    "gzip -d" / "bzip2 -d" would leave them on disk.
+
+    :return: (file name, sha256)
+    """
+    base_name = os.path.basename(name)
+    if "/" not in (name[2:] if name.startswith("./") else name):
+        for extension, decompressor in DECOMPRESSORS.items():
+            if not base_name.endswith(extension):
+                continue
+            reader.checksum = hashlib.sha256()
+            try:
+                return base_name[:-len(extension)], \
+                    _hash_reader(decompressor(reader))
+            except (OSError, EOFError, ValueError) as e:
+                logger.error(f"Can't decompress {base_name}: {e}")
+                reader.drain()
+                return base_name, reader.checksum.hexdigest()
+    return base_name, _hash_reader(reader)
+
+
+def payload_checksums(logger, package_path):
+    """
+    Function for get sha256 sums of all files of the rpm payload.
+
+    The payload is decompressed and walked in memory by chunks,
+    nothing is written to disk. When the compressor is not supported
+    the cpio stream of rpm2cpio is read instead.
+
+    :param package_path: path to the rpm package
+    :return: list[str] = ["file: sha256", ...]
+    """
+    results = []
+    process = None
+    payload_offset = RPMHeader(package_path).payload_offset
+    with open(package_path, "rb") as f:
+        f.seek(payload_offset)
+        stream = open_payload(f)
+        if stream is None:
+            process = subprocess.Popen(["rpm2cpio", package_path],
+                                       stdout=subprocess.PIPE)
+            stream = process.stdout
+        try:
+            for name, mode, reader in iter_cpio(stream):
+                if mode & 0o170000 != 0o100000:
+                    continue
+                file_name, checksum = entry_checksum(logger, name, reader)
+                results.append(f'{file_name}: {checksum}')
+        finally:
+            if process is not None:
+                process.stdout.close()
+                process.wait()
+    return results
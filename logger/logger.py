@@ -1,15 +1,109 @@
 """Module with logger"""
 
+import atexit
+import json
 import logging
-import sys
+import logging.handlers
 import os
+import queue
+import sys
+import threading
+import time
 import datetime
 
+import config.conf as config
+from logger.metrics import metrics
+
+_lock = threading.Lock()
+_listener = None
+
+
+class TruncateFilter(logging.Filter):
+    """
+    Filter for cut long messages, e.g. whole output of a command.
+
+    :param max_length: int characters of message, None is unlimited
+    """
+
+    def __init__(self, max_length=None):
+        super().__init__()
+        self.max_length = max_length
+
+    def filter(self, record):
+        if self.max_length is None:
+            return True
+        message = record.getMessage()
+        if len(message) > self.max_length:
+            record.msg = (f"{message[:self.max_length]}... "
+                          f"[{len(message) - self.max_length} characters truncated]")
+            record.args = None
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Filter for drop INFO and lower records over the budget of a second.
+
+    Warnings and errors always pass, number of dropped records is
+    logged when the next second starts.
+
+    :param per_second: int records, None is unlimited
+    """
+
+    def __init__(self, per_second=None):
+        super().__init__()
+        self.per_second = per_second
+        self._window = 0
+        self._passed = 0
+        self._dropped = 0
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if self.per_second is None:
+            return True
+        window = int(time.monotonic())
+        with self._lock:
+            if window != self._window:
+                dropped, self._dropped = self._dropped, 0
+                self._window, self._passed = window, 0
+                if dropped:
+                    record.msg = f"[{dropped} log records dropped] {record.getMessage()}"
+                    record.args = None
+            self._passed += 1
+            if self._passed <= self.per_second or record.levelno > logging.INFO:
+                return True
+            self._dropped += 1
+            return False
+
+
+class JsonFormatter(logging.Formatter):
+    """Formatter for one JSON object per record."""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created).isoformat(),
+            "level": record.levelname,
+            "message": record.getMessage(),
+            "process": record.process,
+            "thread": record.threadName,
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
 
 class Logger:
     """
     Logging in cmd and in the log file (by date).
 
+    Records are put in a queue and written by one background thread,
+    so threads running commands don't wait for disk and terminal.
+    Handlers are set up once per process, the queue is flushed at exit.
+
+    Spans and counters of the run go to a JSON lines trace next to
+    the log file and to a Prometheus textfile, the slowest phases
+    are logged at exit.
+
     :return: logging
     """
 
@@ -17,20 +111,55 @@ class Logger:
         self.path_to_logs = \
             os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs')
         self.logger = self._setup_logger()
+        self.metrics = metrics
+        self.metrics.configure(
+            self.logger,
+            trace_path=f'{self.path_to_logs}/{datetime.date.today()}.trace.jsonl',
+            textfile_path=f'{self.path_to_logs}/metrics.prom')
 
-    def _setup_logger(self):
-        """Method for setup logger."""
-        logger = logging.getLogger(__name__)
-        logger.setLevel(logging.INFO)
-        formatter = \
-            logging.Formatter("%(asctime)s [%(levelname)s] %(message)s",
-                              datefmt='%d-%b-%y %H:%M:%S')
+    def _handlers(self):
+        """Method for create handlers written by the listener thread."""
+        if config.log_format == "json":
+            formatter = JsonFormatter()
+        else:
+            formatter = \
+                logging.Formatter("%(asctime)s [%(levelname)s] %(message)s",
+                                  datefmt='%d-%b-%y %H:%M:%S')
         file_handler = \
             logging.FileHandler(f'{self.path_to_logs}/{datetime.date.today()}.log',
                                 mode="a")
         file_handler.setFormatter(formatter)
         stream_handler = logging.StreamHandler(sys.stdout)
         stream_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
-        logger.addHandler(stream_handler)
+        return [file_handler, stream_handler]
+
+    def _setup_logger(self):
+        """Method for setup logger, next calls return the same logger."""
+        global _listener
+        logger = logging.getLogger(__name__)
+        with _lock:
+            if _listener is not None:
+                return logger
+            logger.setLevel(logging.INFO)
+            handlers = self._handlers()
+            queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+            queue_handler.addFilter(TruncateFilter(config.log_max_message_length))
+            queue_handler.addFilter(RateLimitFilter(config.log_max_records_per_second))
+            logger.addHandler(queue_handler)
+            _listener = logging.handlers.QueueListener(queue_handler.queue, *handlers,
+                                                       respect_handler_level=True)
+            _listener.start()
+            atexit.register(_listener.stop)
+
+            def after_fork():
+                # The listener thread is not copied to child processes,
+                # they write directly.
+                logger.removeHandler(queue_handler)
+                for handler in handlers:
+                    for log_filter in queue_handler.filters:
+                        handler.addFilter(log_filter)
+                    logger.addHandler(handler)
+
+            if hasattr(os, "register_at_fork"):
+                os.register_at_fork(after_in_child=after_fork)
         return logger
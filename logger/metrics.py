@@ -0,0 +1,300 @@
+"""Module with timing spans and counters of the run."""
+
+import atexit
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+PREFIX = "aws_downloader"
+
+
+class Metrics:
+    """
+    Class for collect spans and counters of the process.
+
+    Every finished span is written as one JSON line to the trace file
+    (when configured) and added to per-name totals. At exit totals and
+    counters are written to a Prometheus textfile and the slowest
+    phases are logged as a table.
+    """
+
+    def __init__(self):
+        self.trace_path = None
+        self.textfile_path = None
+        self.logger = None
+        self._trace = None
+        self._pid = None
+        self._totals = {}
+        self._counters = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._owner_pid = None
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        """Method for start clean state in forked worker, the lock may be held."""
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._totals = {}
+        self._counters = {}
+        self._trace = None
+
+    def configure(self, logger=None, trace_path=None, textfile_path=None):
+        """
+        Method for set outputs, the report is written at exit.
+
+        :param logger: logging.Logger for the summary table
+        :param trace_path: str JSON lines file of spans
+        :param textfile_path: str Prometheus textfile
+        """
+        with self._lock:
+            self.logger = logger or self.logger
+            self.trace_path = trace_path or self.trace_path
+            self.textfile_path = textfile_path or self.textfile_path
+            if self._owner_pid is None:
+                atexit.register(self.report)
+                self._owner_pid = os.getpid()
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _write_trace(self, record):
+        if self.trace_path is None:
+            return
+        line = json.dumps(record, separators=(",", ":"), default=str) + "\n"
+        with self._lock:
+            # Forked workers open their own handle in append mode.
+            if self._trace is None or self._pid != os.getpid():
+                self._trace = open(self.trace_path, "a", buffering=1)
+                self._pid = os.getpid()
+            self._trace.write(line)
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """
+        Context manager for measure one phase.
+
+        :param name: str, e.g. "GCPManager.run_instance"
+        :param attributes: values saved with the span
+        """
+        stack = self._stack()
+        record = {"name": name, "parent": stack[-1]["name"] if stack else None,
+                  "start": time.time(), "pid": os.getpid(),
+                  "thread": threading.current_thread().name, "status": "ok"}
+        record.update(attributes)
+        stack.append(record)
+        started = time.perf_counter()
+        try:
+            yield record
+        except BaseException as e:
+            record["status"] = "error"
+            record["error"] = repr(e)
+            raise
+        finally:
+            record["duration"] = time.perf_counter() - started
+            # Generators may resume in another thread or after other
+            # spans started, remove this record, not the top one.
+            self._detach(record)
+            with self._lock:
+                totals = self._totals.setdefault(name, [0, 0.0, 0.0, 0])
+                totals[0] += 1
+                totals[1] += record["duration"]
+                totals[2] = max(totals[2], record["duration"])
+                totals[3] += record["status"] == "error"
+            self._write_trace(record)
+
+    def _detach(self, record):
+        """Method for remove the record from the span stack of the thread."""
+        stack = self._stack()
+        for index in range(len(stack) - 1, -1, -1):
+            if stack[index] is record:
+                del stack[index]
+                return
+
+    def _timed_generator(self, span_name, generator):
+        """
+        Method for run generator inside a span.
+
+        The span is on the stack only while the generator runs, spans
+        started by the consumer between items don't get it as parent.
+        """
+        try:
+            with self.span(span_name) as record:
+                while True:
+                    try:
+                        item = next(generator)
+                    except StopIteration as stop:
+                        return stop.value
+                    self._detach(record)
+                    try:
+                        yield item
+                    finally:
+                        self._stack().append(record)
+        finally:
+            generator.close()
+
+    def annotate(self, **attributes):
+        """Method for add attributes to the current span of the thread."""
+        stack = self._stack()
+        if stack:
+            stack[-1].update(attributes)
+
+    def timed(self, name=None):
+        """
+        Decorator for run function inside a span.
+
+        Generator functions are measured until they are exhausted.
+
+        :param name: span name, qualified function name by default
+        """
+        def decorator(function):
+            span_name = name or function.__qualname__
+            if inspect.isgeneratorfunction(function):
+                @functools.wraps(function)
+                def generator_wrapper(*args, **kwargs):
+                    return (yield from self._timed_generator(span_name,
+                                                             function(*args, **kwargs)))
+                return generator_wrapper
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(span_name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def count(self, name, value=1, **labels):
+        """
+        Method for increase counter.
+
+        :param name: str, e.g. "bytes_transferred_total"
+        :param value: number
+        :param labels: Prometheus labels
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def collect(self):
+        """
+        Method for take totals and counters gathered since the last call.
+
+        Used in worker processes, which don't report, to send their
+        metrics to the parent with each result.
+
+        :return: dict {"totals": ..., "counters": ...}
+        """
+        with self._lock:
+            collected = {"totals": self._totals, "counters": self._counters}
+            self._totals = {}
+            self._counters = {}
+        return collected
+
+    def merge(self, collected):
+        """
+        Method for add metrics of a worker process.
+
+        :param collected: dict returned by collect()
+        """
+        with self._lock:
+            for name, (calls, total, longest, errors) in collected["totals"].items():
+                totals = self._totals.setdefault(name, [0, 0.0, 0.0, 0])
+                totals[0] += calls
+                totals[1] += total
+                totals[2] = max(totals[2], longest)
+                totals[3] += errors
+            for key, value in collected["counters"].items():
+                self._counters[key] = self._counters.get(key, 0) + value
+
+    def summary(self, limit=10):
+        """
+        Method for get the slowest phases.
+
+        :param limit: int number of rows
+        :return: list[str] table lines
+        """
+        with self._lock:
+            rows = sorted(self._totals.items(), key=lambda item: item[1][1], reverse=True)
+        lines = [f"{'phase':<45}{'calls':>7}{'total s':>11}{'mean s':>10}{'max s':>10}{'errors':>8}"]
+        for name, (calls, total, longest, errors) in rows[:limit]:
+            lines.append(f"{name:<45}{calls:>7}{total:>11.3f}{total / calls:>10.3f}"
+                         f"{longest:>10.3f}{errors:>8}")
+        return lines
+
+    def prometheus(self):
+        """
+        Method for format totals and counters in Prometheus text format.
+
+        :return: str
+        """
+        with self._lock:
+            totals = dict(self._totals)
+            counters = dict(self._counters)
+        lines = [f"# TYPE {PREFIX}_span_seconds summary"]
+        for name, (calls, total, _, _) in sorted(totals.items()):
+            lines.append(f'{PREFIX}_span_seconds_count{{span="{name}"}} {calls}')
+            lines.append(f'{PREFIX}_span_seconds_sum{{span="{name}"}} {total:.6f}')
+        lines.append(f"# TYPE {PREFIX}_span_errors_total counter")
+        for name, (_, _, _, errors) in sorted(totals.items()):
+            lines.append(f'{PREFIX}_span_errors_total{{span="{name}"}} {errors}')
+        typed = set()
+        for (name, labels), value in sorted(counters.items()):
+            if name not in typed:
+                lines.append(f"# TYPE {PREFIX}_{name} counter")
+                typed.add(name)
+            label_text = ",".join(f'{key}="{label}"' for key, label in labels)
+            label_text = f"{{{label_text}}}" if label_text else ""
+            lines.append(f"{PREFIX}_{name}{label_text} {value}")
+        return "\n".join(lines) + "\n"
+
+    def report(self):
+        """Method for write Prometheus textfile and log the slowest phases."""
+        if self._owner_pid != os.getpid():
+            return
+        if self.textfile_path is not None:
+            temp_path = f"{self.textfile_path}.{os.getpid()}.tmp"
+            with open(temp_path, "w") as f:
+                f.write(self.prometheus())
+            # Textfile collectors must never see a partial file.
+            os.replace(temp_path, self.textfile_path)
+        if self.logger is not None and self._totals:
+            self.logger.info("Slowest phases:")
+            for line in self.summary():
+                self.logger.info(line)
+        with self._lock:
+            if self._trace is not None:
+                self._trace.flush()
+
+
+def instrument(cls):
+    """
+    Class decorator for run every public method inside a span.
+
+    Spans are named "<class>.<method>".
+
+    :param cls: class
+    :return: the same class
+    """
+    for attribute, value in list(vars(cls).items()):
+        if attribute.startswith("_"):
+            continue
+        name = f"{cls.__name__}.{attribute}"
+        if isinstance(value, staticmethod):
+            setattr(cls, attribute, staticmethod(metrics.timed(name)(value.__func__)))
+        elif isinstance(value, classmethod):
+            setattr(cls, attribute, classmethod(metrics.timed(name)(value.__func__)))
+        elif inspect.isfunction(value):
+            setattr(cls, attribute, metrics.timed(name)(value))
+    return cls
+
+
+# Metrics shared by the whole process.
+metrics = Metrics()
@@ -1,10 +1,20 @@
 """Main script"""
+import os
+import sys
+
 import config.conf as config
+from local_functions.artifact_store import ArtifactStore
+from local_functions.metadata_store import MetadataStore
+from local_functions.package_analyzer import PackageAnalyzer
 from logger.logger import Logger
 from modules.ec2_manager import EC2Manager
-from modules.ssh_client import SSHClient
+from modules.instance_pool import InstancePool
+from modules.ssh_client import SSHClient, ssh_pool
 from remote_functions.check_license import CheckLicense
+from remote_functions.download_package import PackagesDownload, UNAVAILABLE
 from remote_functions.sshfs import SSHFS
+from remote_functions.sftp_pull import SFTPPull
+from remote_functions.tar_stream import TarStream
 from remote_functions.enable_repo import EnableRepo
 
 # from modules.ec2_manager import Instance
@@ -14,6 +24,10 @@ from modules.gcp_manager import GCPManager
 if __name__ == "__main__":
   logger_instance = Logger()
   logger = logger_instance.logger
+  # "python main.py bake" only bakes the image of the release.
+  if sys.argv[1:] == ["bake"]:
+    GCPManager(9, logger).bake()
+    sys.exit(0)
   check_license = CheckLicense(logger,
                             config.instance_user,
                             config.private_key_path,
@@ -22,21 +36,87 @@ if __name__ == "__main__":
                             config.license_path)
   sshfs = SSHFS(logger, config.instance_user, config.private_key_path,
                 config.instance_mount_dir, config.local_mount_dir)
+  sftp_pull = SFTPPull(logger, config.instance_user, config.private_key_path,
+                       config.instance_mount_dir, config.local_mount_dir,
+                       concurrency=config.sftp_concurrency)
+  tar_stream = TarStream(logger, config.instance_user, config.private_key_path,
+                         config.instance_mount_dir, config.local_mount_dir)
   enable_repo = EnableRepo(logger, config.instance_user, config.private_key_path)
 
 # INSTANCE MANAGER START
-  instance_9 = GCPManager(9, logger)
-  instance_9.run_instance()
-  instance_ip = instance_9.instance_ip()
+  release = 9
+  pool = None
+  instance_9 = None
+  if config.instance_pool_enabled:
+    # Pool instances are prepared or booted from baked images.
+    pool = InstancePool(logger, release)
+    instance_id, instance_ip = pool.lease()
+    run_name = instance_id
+    prepared = True
+  else:
+    instance_9 = GCPManager(release, logger)
+    instance_9.run_instance()
+    instance_ip = instance_9.instance_ip()
+    run_name = instance_9.instance_name
+    # Baked images have the license checked and repositories enabled.
+    prepared = instance_9.baked
 
 # NEW REMOTE FUNCTIONS START
+  # One store for downloads and the manifest, closed in finally.
+  store = ArtifactStore(logger, config.artifact_store_dir) if config.artifact_store_dir else None
   try:
-    check_license.check_license(instance_ip)
-    enable_repo.enable_check(instance_ip)
-    sshfs.mount(instance_ip)
+    if not prepared:
+      check_license.check_license(instance_ip)
+      enable_repo.enable_check(instance_ip)
+    requested = None
+    if config.packages_list_path:
+      with open(config.packages_list_path) as f:
+        packages = [line.strip() for line in f if line.strip()]
+      # Packages already in the store are not downloaded again.
+      resolution = PackagesDownload(logger, config.instance_mount_dir, config.instance_user,
+                                    config.private_key_path, instance_ip, packages,
+                                    store=store).resolve_and_download()["resolution"]
+      requested = [package_name for package_name in packages
+                   if resolution.get(package_name, {}).get("status") != UNAVAILABLE]
+    if config.transfer_mode == "sftp":
+      sftp_pull.pull(instance_ip)
+    elif config.transfer_mode == "tar":
+      tar_stream.pull(instance_ip)
+    else:
+      sshfs.mount(instance_ip)
+    if store is not None:
+      # Keep pulled packages in the store, the manifest points into it.
+      store.ingest(config.local_mount_dir)
+      if requested is None:
+        requested = sorted(name for name in os.listdir(config.local_mount_dir)
+                           if name.endswith(".rpm"))
+      store.write_manifest(run_name, requested)
+    if config.results_paths or config.metadata_store_path:
+      analyzer = PackageAnalyzer(logger,
+                                 PackageAnalyzer.find_packages(config.local_mount_dir))
+      metadata_store = None
+      writers = []
+      if config.metadata_store_path:
+        metadata_store = MetadataStore(logger, config.metadata_store_path)
+        writers.append(metadata_store.writer(run_name, release=f"el{release}"))
+      try:
+        analyzer.write_files(*config.results_paths, writers=writers)
+      finally:
+        if metadata_store is not None:
+          metadata_store.close()
   except:
-    instance_9.terminate()
+    if pool is not None:
+      pool.release(instance_id, healthy=False)
+    else:
+      instance_9.terminate()
     print("INSTANCE DOWN")
-
-
-
+  else:
+    if pool is not None:
+      pool.release(instance_id)
+  finally:
+    if store is not None:
+      store.close()
+    if pool is not None:
+      # Wait for instances replenishing the pool.
+      pool.stop()
+    ssh_pool.close_all()
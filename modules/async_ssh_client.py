@@ -0,0 +1,162 @@
+"""Asyncio SSH client module"""
+
+import asyncio
+import threading
+
+import asyncssh
+
+
+class AsyncSSHClient:
+
+    """
+    Class for run commands on instances via asyncssh on one event loop.
+
+    One connection is kept per (user, ip_address, key_path) and
+    concurrent commands on a host are limited by per_host_limit.
+    """
+    def __init__(self, logger, per_host_limit=10, keepalive_interval=30):
+        self.logger = logger
+        self.per_host_limit = per_host_limit
+        self.keepalive_interval = keepalive_interval
+        self._connections = {}
+        self._connect_locks = {}
+        self._semaphores = {}
+
+    async def _connection(self, user, ip_address, key_path):
+        """
+        Method for get connection to the host, connect once.
+
+        :return: asyncssh.SSHClientConnection
+        """
+        key = (user, ip_address, key_path)
+        lock = self._connect_locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            connection = self._connections.get(key)
+            if connection is None:
+                connection = await asyncssh.connect(
+                    ip_address,
+                    username=user,
+                    client_keys=[key_path],
+                    known_hosts=None,
+                    keepalive_interval=self.keepalive_interval)
+                self._connections[key] = connection
+            return connection
+
+    def _semaphore(self, ip_address):
+        return self._semaphores.setdefault(
+            ip_address, asyncio.Semaphore(self.per_host_limit))
+
+    async def _discard(self, user, ip_address, key_path):
+        connection = self._connections.pop((user, ip_address, key_path), None)
+        if connection is not None:
+            connection.close()
+
+    def _log_line(self, stream_name, line):
+        if stream_name == "stderr":
+            self.logger.warning(line)
+        else:
+            self.logger.info(line)
+
+    async def stream_command(self, connection, command, on_line):
+        """
+        Method for run command and pass its output to callback line by line.
+
+        stdout and stderr are read concurrently.
+
+        :param connection: asyncssh.SSHClientConnection
+        :param command: str
+        :param on_line: callable(stream_name, line)
+        :return: int exit status
+        """
+        async with connection.create_process(command) as process:
+            async def read(stream_name, stream):
+                async for line in stream:
+                    on_line(stream_name, line.rstrip("\n"))
+            await asyncio.gather(read("stdout", process.stdout),
+                                 read("stderr", process.stderr))
+            await process.wait()
+            return process.exit_status
+
+    async def execute_ssh_command(self, user, command, ip_address, key_path,
+                                  attempts=5, wait=1.0):
+        """
+        Method for execute command on the instance.
+
+        Same contract as SSHClient.execute_ssh_command: returns 0 or
+        raises after all attempts failed.
+
+        :param command: str
+        :param ip_address: str
+        :param key_path: str
+        :return: int
+        """
+        for attempt in range(1, attempts + 1):
+            try:
+                async with self._semaphore(ip_address):
+                    connection = await self._connection(user, ip_address, key_path)
+                    exit_status = await self.stream_command(connection, command,
+                                                            self._log_line)
+                if exit_status == 0:
+                    return exit_status
+                self.logger.error(f"Error: Can't execute \"{command}\" by AsyncSSHClient. Trying...")
+            except (OSError, asyncssh.Error) as e:
+                self.logger.error(f"Error: {e}")
+                await self._discard(user, ip_address, key_path)
+            if attempt < attempts:
+                await asyncio.sleep(wait)
+        raise Exception(f"Can't execute \"{command}\" on {ip_address}")
+
+    async def close_all(self):
+        """Method for close all connections."""
+        connections = list(self._connections.values())
+        self._connections.clear()
+        for connection in connections:
+            connection.close()
+            await connection.wait_closed()
+
+
+class EventLoopThread:
+
+    """
+    Class for run coroutines from sync code on one background event loop.
+
+    Connections of AsyncSSHClient are bound to the loop, so all sync
+    calls go to the same loop instead of asyncio.run per call.
+    """
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever,
+                                        daemon=True)
+        self._thread.start()
+
+    def run(self, coroutine):
+        """
+        Method for run coroutine and wait for its result.
+
+        :param coroutine: coroutine object
+        :return: result of the coroutine
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def stop(self):
+        """Method for stop the loop."""
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+
+
+_event_loop = None
+_event_loop_lock = threading.Lock()
+
+
+def run_sync(coroutine):
+    """
+    Function for run coroutine from sync code on the shared event loop.
+
+    :param coroutine: coroutine object
+    :return: result of the coroutine
+    """
+    global _event_loop
+    with _event_loop_lock:
+        if _event_loop is None:
+            _event_loop = EventLoopThread()
+    return _event_loop.run(coroutine)
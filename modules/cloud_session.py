@@ -0,0 +1,134 @@
+"""Module with cloud credentials and API clients shared by the process."""
+
+import os
+import threading
+import time
+
+import boto3
+from google.cloud import compute_v1
+from google.oauth2 import service_account
+
+import config.conf as config
+
+# Setup default creds environment variables
+credentials_path = "config/credentials.json"
+os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = credentials_path
+
+_lock = threading.Lock()
+_clients = {}
+_pid = None
+_image_cache = {}
+
+
+def _shared(name, factory):
+    """
+    Function for create client once per process.
+
+    Clients are thread safe and keep their connection pools, they are
+    created again in forked processes.
+
+    :param name: str
+    :param factory: callable creating the client
+    :return: client
+    """
+    global _pid
+    with _lock:
+        if _pid != os.getpid():
+            _clients.clear()
+            _image_cache.clear()
+            _pid = os.getpid()
+        if name not in _clients:
+            _clients[name] = factory()
+        return _clients[name]
+
+
+def gcp_credentials():
+    """
+    Function for get GCP service account credentials.
+
+    :return: service_account.Credentials
+    """
+    return _shared("gcp_credentials",
+                   lambda: service_account.Credentials.from_service_account_file(
+                       credentials_path))
+
+
+def gcp_instances():
+    """
+    Function for get GCP instances client.
+
+    :return: compute_v1.InstancesClient
+    """
+    return _shared("gcp_instances",
+                   lambda: compute_v1.InstancesClient(credentials=gcp_credentials()))
+
+
+def gcp_images():
+    """
+    Function for get GCP images client.
+
+    :return: compute_v1.ImagesClient
+    """
+    return _shared("gcp_images",
+                   lambda: compute_v1.ImagesClient(credentials=gcp_credentials()))
+
+
+def ec2_client():
+    """
+    Function for get Boto3 EC2 client.
+
+    :return: class 'botocore.client.EC2'
+    """
+    return _shared("ec2",
+                   lambda: boto3.client('ec2',
+                                        aws_access_key_id=config.aws_access_key_id,
+                                        aws_secret_access_key=config.aws_secret_access_key,
+                                        aws_session_token=config.aws_token,
+                                        region_name=config.aws_region))
+
+
+def family_image(project, family, ttl=None):
+    """
+    Function for get the newest image of the family.
+
+    Results are kept for ttl seconds, so parallel instances of one
+    release resolve the family once.
+
+    :param project: str image project
+    :param family: str image family
+    :param ttl: seconds, config.image_cache_ttl by default
+    :return: compute_v1.Image
+    """
+    ttl = config.image_cache_ttl if ttl is None else ttl
+    images = gcp_images()
+    with _lock:
+        cached = _image_cache.get((project, family))
+    if cached is not None and time.monotonic() - cached[1] < ttl:
+        return cached[0]
+    image = images.get_from_family(project=project, family=family)
+    with _lock:
+        _image_cache[(project, family)] = (image, time.monotonic())
+    return image
+
+
+def image_from_family(project, family, ttl=None):
+    """
+    Function for get name of the newest image of the family.
+
+    :param project: str image project
+    :param family: str image family
+    :param ttl: seconds, config.image_cache_ttl by default
+    :return: str image name
+    """
+    return family_image(project, family, ttl=ttl).name
+
+
+def forget_family(project, family):
+    """
+    Function for drop cached image of the family, e.g. after a new image.
+
+    :param project: str image project
+    :param family: str image family
+    """
+    with _lock:
+        _image_cache.pop((project, family), None)
@@ -1,39 +1,123 @@
 """EC2 Manager module"""
 
-import boto3
+import threading
 import time
+
 from retrying import retry
 import config.conf as config
+from logger.metrics import instrument
+from modules import cloud_session
+from modules.readiness import Readiness
+from remote_functions.prepare_instance import PrepareInstance
 
 
+@instrument
 class EC2Manager:
     """Class for manage aws ec2 instance."""
-    def __init__(self, release, logger):
+
+    # One bake per release at a time in the process.
+    _bake_locks = {}
+    _bake_locks_lock = threading.Lock()
+
+    def __init__(self, release, logger, use_baked=None):
         self.release = release
         self.config = config
-        self.client = self._create_ec2_client()
+        self.client = cloud_session.ec2_client()
         self.logger = logger
+        self.readiness = Readiness(self.logger)
+        self.use_baked = config.use_baked_images if use_baked is None else use_baked
+        self.baked = False
+        self.instance_ips = {}
+
+    def source_ami(self):
+        """
+        Method for get configured AMI of the release.
+
+        :return: str
+        """
+        ami_id_attr_name = f"ami_id_{self.release}"
+        return getattr(self.config, ami_id_attr_name, None)
+
+    def baked_ami(self):
+        """
+        Method for get the newest AMI baked from the configured AMI.
+
+        :return: str AMI id or None
+        """
+        images = self.client.describe_images(
+            Owners=["self"],
+            Filters=[{"Name": "tag:BakedFrom", "Values": [self.source_ami()]},
+                     {"Name": "tag:Release", "Values": [str(self.release)]},
+                     {"Name": "state", "Values": ["available"]}])["Images"]
+        if not images:
+            self.logger.info(f"No AMI baked from {self.source_ami()}.")
+            return None
+        return max(images, key=lambda image: image["CreationDate"])["ImageId"]
+
+    def image_id(self):
+        """
+        Method for choose AMI of the instance.
+
+        The newest AMI baked from the configured one is used, it is
+        baked when missing and config.auto_bake is set. self.baked tells
+        whether setup steps are already done on the chosen AMI.
+
+        :return: str AMI id
+        """
+        self.baked = False
+        if self.use_baked:
+            with self._bake_locks_lock:
+                bake_lock = self._bake_locks.setdefault(self.release, threading.Lock())
+            with bake_lock:
+                ami_id = self.baked_ami()
+                if ami_id is None and config.auto_bake:
+                    ami_id = self.bake()
+            if ami_id is not None:
+                self.logger.info(f"Using baked AMI {ami_id}")
+                self.baked = True
+                return ami_id
+        return self.source_ami()
 
-    def _create_ec2_client(self):
+    def bake(self):
         """
-        Method for creating a Boto3 EC2 client.
+        Method for make baked AMI of the release.
+
+        Boots the configured AMI once, runs PrepareInstance.bake() on it
+        and creates AMI tagged with the source AMI and date.
 
-        :return: class 'botocore.client.EC2'
+        :return: str AMI id
         """
-        return boto3.client('ec2',
-                            aws_access_key_id=self.config.aws_access_key_id,
-                            aws_secret_access_key=self.config.aws_secret_access_key,
-                            aws_session_token=self.config.aws_token,
-                            region_name=self.config.aws_region)
+        source_ami = self.source_ami()
+        ec2_id = self.get_instance_id(self.run_instance(image_id=source_ami))
+        try:
+            self.wait_running(ec2_id)
+            ip_address = self.get_instance_ip(ec2_id)
+            self.readiness.wait_ssh(config.instance_user, ip_address,
+                                    config.private_key_path)
+            PrepareInstance(self.logger).bake(ip_address)
+            date = time.strftime("%Y-%m-%d")
+            ami_id = self.client.create_image(
+                InstanceId=ec2_id,
+                Name=f"baked-el{self.release}-{time.strftime('%Y%m%d%H%M%S')}",
+                TagSpecifications=[{"ResourceType": "image", "Tags": [
+                    {"Key": "BakedFrom", "Value": source_ami},
+                    {"Key": "Release", "Value": str(self.release)},
+                    {"Key": "BakedOn", "Value": date}]}])["ImageId"]
+            self.client.get_waiter("image_available").wait(
+                ImageIds=[ami_id], WaiterConfig={"Delay": 15, "MaxAttempts": 120})
+        finally:
+            self.terminate_instance(ec2_id)
+        self.logger.info(f"Baked AMI {ami_id} from {source_ami}.")
+        return ami_id
 
-    def run_instance(self):
+    def run_instance(self, image_id=None):
         """
         Method for running instance.
 
+        :param image_id: AMI id, chosen by image_id() by default
         :return: dict
         """
-        ami_id_attr_name = f"ami_id_{self.release}"
-        ami_id = getattr(self.config, ami_id_attr_name, None)
+        ami_id = image_id or self.image_id()
         return self.client.run_instances(
             ImageId=ami_id,
             InstanceType=self.config.instance_type,
@@ -53,10 +137,38 @@ class EC2Manager:
         ec2_id = instance_dict['Instances'][0]['InstanceId']
         return ec2_id
 
+    def describe_instance(self, ec2_id):
+        """
+        Method for describe instance.
+
+        The public ip address of the answer is kept for get_instance_ip().
+
+        :param ec2_id: str
+        :return: dict
+        """
+        instance = self.client.describe_instances(
+            InstanceIds=[ec2_id])["Reservations"][0]["Instances"][0]
+        if instance.get("PublicIpAddress"):
+            self.instance_ips[ec2_id] = instance["PublicIpAddress"]
+        return instance
+
     def get_instance_ip(self, ec2_id):
-        ec2_ip = self.client.describe_instances(
-            InstanceIds=[ec2_id])["Reservations"][0]["Instances"][0]["PublicIpAddress"]
-        return ec2_ip
+        if ec2_id not in self.instance_ips:
+            self.describe_instance(ec2_id)
+        return self.instance_ips[ec2_id]
+
+    def _running_instance(self, ec2_id):
+        instance = self.describe_instance(ec2_id)
+        return instance if instance["State"]["Name"] == "running" else None
+
+    def wait_running(self, ec2_id):
+        """
+        Method for wait until instance state is running.
+
+        :param ec2_id: str
+        :return: dict
+        """
+        return self.readiness.wait_for("running", lambda: self._running_instance(ec2_id))
 
     def terminate_instance(self, ec2_id):
         """
@@ -65,11 +177,13 @@ class EC2Manager:
         :param ec2_id: str
         """
         instance = self.client.terminate_instances(InstanceIds=[ec2_id])
+        self.instance_ips.pop(ec2_id, None)
         self.logger.info(f"Terminating instance {ec2_id} - "
                          f"Current state: {instance}")
         return ec2_id
 
 
+@instrument
 class InstanceService:
     """Class for get info certain instance."""
 
@@ -121,6 +235,7 @@ class InstanceService:
             self.logger.error(error_message)
 
 
+@instrument
 class Instance:
     """
     Class for manage certain instance without additional parameters.
@@ -138,9 +253,14 @@ class Instance:
 
         :return: instance ip (str)
         """
-        time.sleep(10)
+        ec2_manager = self.instance.ec2_manager
+        ec2_manager.wait_running(self.instance_id)
         print(self.instance_id)
         instance_ip = self.instance.instance_ip_address(self.instance_id)
+        ec2_manager.readiness.wait_ssh(config.instance_user, instance_ip,
+                                       config.private_key_path)
+        self.logger.info(f"Instance {self.instance_id} is ready: "
+                         f"{ec2_manager.readiness.timings}")
         return instance_ip
 
     def terminate(self):
@@ -1,33 +1,45 @@
-from googleapiclient import discovery
-from google.oauth2 import service_account
 from google.cloud import compute_v1
+from google.api_core.exceptions import NotFound
 from google.api_core.extended_operation import ExtendedOperation
-import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
 import time
+import uuid
 from retrying import retry
 
 import config.conf as config
+from logger.metrics import instrument
+from modules import cloud_session
+from modules.readiness import Readiness
+from remote_functions.prepare_instance import PrepareInstance
 
-# Setup default creds environment variables
-credentials_path = "config/credentials.json"
-os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = credentials_path
-
+# Names of GCP resources are 1-63 characters long.
+NAME_MAX_LENGTH = 63
 
+@instrument
 class GCPManager:
 
     """Class for managing Google Cloud Project instances."""
 
-    def __init__(self, release, logger):
+    # One bake per release at a time in the process.
+    _bake_locks = {}
+    _bake_locks_lock = threading.Lock()
+
+    def __init__(self, release, logger, instance_name=None, use_baked=None):
         self.release = release
         self.logger = logger
         self.project_id = config.project_id
         self.zone = config.zone
         self.region = config.region
-        self.instance_name = config.instance_name
+        self.instance_name = instance_name or self.generate_instance_name(release)
         self.machine_type = config.machine_type
         self.family = config.family
         self.image_project = config.project
         self.subnetwork = config.subnetwork
+        self.readiness = Readiness(self.logger)
+        self.use_baked = config.use_baked_images if use_baked is None else use_baked
+        self.baked = False
+        self._instance_ip = None
 
     def get_image_from_family(self):
         """
@@ -39,17 +51,15 @@ class GCPManager:
             family: name of the image family you want to get image from.
 
         Returns:
-            An Image object.
+            Name of the image, cached for config.image_cache_ttl seconds.
         """
 
-        image_client = compute_v1.ImagesClient()
         family_name = f"{self.family}{self.release}"
-        newest_image = image_client.get_from_family(project=self.image_project,
-                                                    family=family_name)
-        info_message = f"Newest image is {newest_image.name}"
+        image_name = cloud_session.image_from_family(self.image_project, family_name)
+        info_message = f"Newest image is {image_name}"
         self.logger.info(info_message)
 
-        return newest_image.name
+        return image_name
 
     def wait_for_extended_operation(self,
                                     operation: ExtendedOperation,
@@ -100,13 +110,28 @@ class GCPManager:
 
         return result
 
-    @retry(stop_max_attempt_number=5, wait_fixed=1000)
-    def run_instance(self):
+    @staticmethod
+    def generate_instance_name(release):
         """
-        Method for running GCP instance.
+        Method for generate unique instance name for the release.
+
+        The configured prefix is shortened, names of GCP resources
+        are limited to 63 characters.
+
+        :param release: int
+        :return: str
         """
-        compute_client = compute_v1.InstancesClient()
-        image_name = self.get_image_from_family()
+        suffix = f"-el{release}-{uuid.uuid4().hex[:8]}"
+        prefix = config.instance_name.lower()[:NAME_MAX_LENGTH - len(suffix)].rstrip("-")
+        return f"{prefix}{suffix}"
+
+    def insert_request(self):
+        """
+        Method for build insert request of the instance.
+
+        :return: compute_v1.InsertInstanceRequest
+        """
+        source_image = self.source_image()
         # Create request body for instance
         instance_config = {
             "name": self.instance_name,
@@ -123,8 +148,7 @@ class GCPManager:
                 {
                     "boot": True,
                     "initialize_params": {
-                        "source_image":
-                            f"projects/{self.image_project}/global/images/{image_name}"
+                        "source_image": source_image
                     },
                 }
             ],
@@ -147,58 +171,243 @@ class GCPManager:
         request.zone = self.zone
         request.project = self.project_id
         request.instance_resource = instance_config
+        return request
+
+    def insert(self):
+        """
+        Method for send insert request without waiting for the instance.
+
+        :return: ExtendedOperation
+        """
+        return cloud_session.gcp_instances().insert(request=self.insert_request())
+
+    def baked_family(self):
+        """
+        Method for get family of baked images of the release.
+
+        :return: str
+        """
+        return f"{self.family}{self.release}-baked"
+
+    def baked_image(self):
+        """
+        Method for get the newest baked image made from the current family image.
+
+        :return: str image name or None when missing or outdated
+        """
+        source_image = self.get_image_from_family()
+        try:
+            image = cloud_session.family_image(self.project_id, self.baked_family())
+        except NotFound:
+            self.logger.info(f"No baked images in family {self.baked_family()}.")
+            return None
+        if image.labels.get("source-image") != source_image:
+            self.logger.info(f"Baked image {image.name} is outdated, "
+                             f"family image is {source_image}.")
+            return None
+        return image.name
+
+    def source_image(self):
+        """
+        Method for choose boot image of the instance.
+
+        The newest baked image is used when it is made from the current
+        family image, a missing or outdated one is baked again when
+        config.auto_bake is set. self.baked tells whether setup steps
+        are already done on the chosen image.
+
+        :return: str image link
+        """
+        self.baked = False
+        if self.use_baked:
+            with self._bake_locks_lock:
+                bake_lock = self._bake_locks.setdefault(self.release, threading.Lock())
+            with bake_lock:
+                image_name = self.baked_image()
+                if image_name is None and config.auto_bake:
+                    image_name = self.bake()
+            if image_name is not None:
+                self.logger.info(f"Using baked image {image_name}")
+                self.baked = True
+                return f"projects/{self.project_id}/global/images/{image_name}"
+        image_name = self.get_image_from_family()
+        return f"projects/{self.image_project}/global/images/{image_name}"
+
+    def bake(self):
+        """
+        Method for make baked image of the release.
 
+        Boots the family image once, runs PrepareInstance.bake() on it and
+        saves its disk into the baked family, labelled with the source
+        image and date.
+
+        :return: str name of the baked image
+        """
+        source_image = self.get_image_from_family()
+        image_name = f"{self.baked_family()}-{time.strftime('%Y%m%d%H%M%S')}"
+        builder = GCPManager(self.release, self.logger,
+                             instance_name=self.generate_instance_name(self.release),
+                             use_baked=False)
+        try:
+            builder.run_instance()
+            PrepareInstance(self.logger).bake(builder.instance_ip())
+            operation = cloud_session.gcp_instances().stop(project=self.project_id,
+                                                           zone=self.zone,
+                                                           instance=builder.instance_name)
+            self.wait_for_extended_operation(operation, "instance stop")
+            image_resource = {
+                "name": image_name,
+                "family": self.baked_family(),
+                "source_disk": f"projects/{self.project_id}/zones/{self.zone}/"
+                               f"disks/{builder.instance_name}",
+                "labels": {"source-image": source_image,
+                           "baked-on": time.strftime("%Y-%m-%d")},
+            }
+            operation = cloud_session.gcp_images().insert(project=self.project_id,
+                                                          image_resource=image_resource)
+            self.wait_for_extended_operation(operation, "image creation", timeout=1800)
+        finally:
+            builder.terminate()
+        cloud_session.forget_family(self.project_id, self.baked_family())
+        self.logger.info(f"Baked image {image_name} from {source_image}.")
+        return image_name
+
+    @retry(stop_max_attempt_number=5, wait_fixed=1000)
+    def run_instance(self):
+        """
+        Method for running GCP instance.
+        """
         try:
-            operation = compute_client.insert(request=request)
+            started = time.monotonic()
+            operation = self.insert()
             self.wait_for_extended_operation(operation, "instance creation")
-            # service pause
-            time.sleep(10)
+            self.readiness.timings["insert"] = round(time.monotonic() - started, 3)
             info_message = f"Instance {self.instance_name} created."
             self.logger.info(info_message)
+            # Not ready instance is deleted too, before retry inserts it again.
+            self.wait_ready()
         except Exception as e:
-            self.terminate()
-            error_message = f"Instance {self.instance_name} exists. Deleting..."
+            error_message = (f"Instance {self.instance_name} failed to start: {e}. "
+                             f"Deleting...")
             self.logger.error(error_message)
-            # service pause
-            time.sleep(60)
+            self.terminate(wait=True)
             raise e
 
+    def get_instance(self):
+        """
+        Method for get instance resource.
+
+        The ip address of the answer is kept for instance_ip().
+
+        return: compute_v1.Instance
+        """
+        instance = cloud_session.gcp_instances().get(project=self.project_id,
+                                                     zone=self.zone,
+                                                     instance=self.instance_name)
+        access_configs = instance.network_interfaces[0].access_configs \
+            if instance.network_interfaces else []
+        if access_configs and access_configs[0].nat_i_p:
+            self._instance_ip = access_configs[0].nat_i_p
+        return instance
+
+    def _running_instance(self):
+        """Method for get instance resource once its status is RUNNING."""
+        instance = self.get_instance()
+        return instance if instance.status == "RUNNING" else None
+
+    def wait_ready(self):
+        """
+        Method for wait until the instance runs and accepts ssh commands.
+
+        return: dict of seconds spent in every phase
+        """
+        self.readiness.wait_for("running", self._running_instance)
+        self.readiness.wait_ssh(config.instance_user, self.instance_ip(),
+                                config.private_key_path)
+        self.logger.info(f"Instance {self.instance_name} is ready: "
+                         f"{self.readiness.timings}")
+        return self.readiness.timings
+
     def instance_ip(self):
         """
         Method for return GCP instance ip address.
 
         return: str
         """
-        # Create GCP client
-        credentials = \
-            service_account.Credentials.from_service_account_file(credentials_path)
-        compute_client = discovery.build('compute', 'v1', credentials=credentials)
-        instance = compute_client.instances().get(project=self.project_id,
-                                                  zone=self.zone,
-                                                  instance=self.instance_name).execute()
-        instance_ip = instance["networkInterfaces"][0]["accessConfigs"][0]["natIP"]
+        if self._instance_ip is None:
+            self.get_instance()
+        instance_ip = self._instance_ip
         # Logger message
         info_message = f"Instance {self.instance_name} ip address = {instance_ip}"
         self.logger.info(info_message)
 
         return instance_ip
 
-    def terminate(self):
+    def terminate(self, wait=False):
         """
         Method for delete GCP instance.
 
-        return: dict
+        :param wait: wait until the instance is deleted
+        return: ExtendedOperation
         """
-        # Create GCP client
-        credentials = \
-            service_account.Credentials.from_service_account_file(credentials_path)
-        compute_client = discovery.build('compute', 'v1', credentials=credentials)
-        request = compute_client.instances().delete(project=self.project_id,
-                                                    zone=self.zone,
-                                                    instance=self.instance_name)
-        response = request.execute()
+        operation = cloud_session.gcp_instances().delete(project=self.project_id,
+                                                         zone=self.zone,
+                                                         instance=self.instance_name)
+        if wait:
+            self.wait_for_extended_operation(operation, "instance deletion")
+        self._instance_ip = None
         # Logger message
         info_message = f"Instance {self.instance_name} deleted."
         self.logger.info(info_message)
 
-        return response
+        return operation
+
+    def _create(self):
+        """
+        Method for insert the instance and wait until it is ready.
+
+        :return: GCPManager
+        """
+        operation = self.insert()
+        self.wait_for_extended_operation(operation, f"{self.instance_name} creation")
+        self.logger.info(f"Instance {self.instance_name} created.")
+        self.wait_ready()
+        return self
+
+    @classmethod
+    def provision_many(cls, logger, releases, replicas=1):
+        """
+        Method for create instances of several releases at the same time.
+
+        Every instance gets a unique name and inserts are issued in
+        parallel. Instances which failed are deleted and skipped, when
+        waiting is interrupted all instances are deleted.
+
+        :param releases: list of releases, e.g. [8, 9]
+        :param replicas: number of instances per release
+        :return: list of created GCPManager
+        """
+        managers = [cls(release, logger) for release in releases for _ in range(replicas)]
+        created = []
+        try:
+            with ThreadPoolExecutor(max_workers=len(managers) or 1) as executor:
+                futures = {executor.submit(manager._create): manager for manager in managers}
+                for future in as_completed(futures):
+                    manager = futures[future]
+                    try:
+                        created.append(future.result())
+                    except Exception as e:
+                        logger.error(f"Can't create instance {manager.instance_name}: {e}")
+                        manager._terminate_quietly()
+        except BaseException:
+            for manager in managers:
+                manager._terminate_quietly()
+            raise
+        return created
+
+    def _terminate_quietly(self):
+        """Method for delete the instance, errors are only logged."""
+        try:
+            self.terminate()
+        except Exception as error:
+            self.logger.error(f"Can't delete instance {self.instance_name}: {error}")
@@ -0,0 +1,310 @@
+"""Module with pool of prepared instances."""
+
+import contextlib
+import fcntl
+import json
+import os
+import threading
+import time
+import uuid
+
+import config.conf as config
+from modules.ec2_manager import Instance, InstanceService
+from modules.gcp_manager import GCPManager
+from remote_functions.prepare_instance import PrepareInstance
+
+READY = "ready"
+LEASED = "leased"
+PROVISIONING = "provisioning"
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class InstancePool:
+    """
+    Class for keep prepared instances of one release ready for jobs.
+
+    Jobs lease an instance and release it back. The pool keeps `size`
+    instances ready (or provisioning) in the background and terminates
+    ready instances idle longer than `ttl` seconds. The state is kept
+    in a JSON file, so instances of a crashed process are found and
+    reused or terminated by the next one.
+    """
+
+    def __init__(self, logger, release, provider="gcp", size=None, ttl=None,
+                 state_path=None, interval=30):
+        self.logger = logger
+        self.release_number = release
+        self.provider = provider
+        self.size = config.instance_pool_size if size is None else size
+        self.ttl = config.instance_pool_ttl if ttl is None else ttl
+        self.state_path = state_path or config.instance_pool_state
+        self.interval = interval
+        self.prepare_instance = PrepareInstance(self.logger)
+        self._stop = threading.Event()
+        self._thread = None
+        self._provisioning = []
+        self._ready = threading.Condition()
+
+    @contextlib.contextmanager
+    def _state(self):
+        """
+        Context manager for read and update the state file under a lock.
+
+        :return: list of instance records of the pool
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(self.state_path)), exist_ok=True)
+        with open(f"{self.state_path}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(self.state_path) as f:
+                    state = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                state = {"instances": []}
+            yield state["instances"]
+            temp_path = f"{self.state_path}.tmp"
+            with open(temp_path, "w") as f:
+                json.dump(state, f, indent=2)
+            os.replace(temp_path, self.state_path)
+
+    def _own(self, record):
+        return record["provider"] == self.provider and \
+            record["release"] == self.release_number
+
+    def _update(self, placeholder, **fields):
+        """Method for update the record of the placeholder in the state file."""
+        placeholder.update(fields)
+        with self._state() as instances:
+            for record in instances:
+                if record.get("token") == placeholder["token"]:
+                    record.update(fields)
+
+    def _start(self, placeholder):
+        """
+        Method for start new instance.
+
+        The id is written to the record as soon as it is known, so the
+        instance is terminated when waiting for it fails. The record
+        also tells whether the instance booted from a baked image.
+
+        :param placeholder: record of the instance
+        :return: ip address
+        """
+        if self.provider == "gcp":
+            instance_id = GCPManager.generate_instance_name(self.release_number)
+            self._update(placeholder, id=instance_id)
+            instance = GCPManager(self.release_number, self.logger, instance_name=instance_id)
+            instance.run_instance()
+            baked = instance.baked
+        else:
+            instance = Instance(self.release_number, self.logger)
+            self._update(placeholder, id=instance.instance_id)
+            baked = instance.instance.ec2_manager.baked
+        ip_address = instance.instance_ip()
+        self._update(placeholder, ip=ip_address, baked=baked)
+        return ip_address
+
+    def _terminate(self, instance_id):
+        """Method for terminate the instance of the pool."""
+        try:
+            if self.provider == "gcp":
+                GCPManager(self.release_number, self.logger,
+                           instance_name=instance_id).terminate()
+            else:
+                InstanceService(self.release_number, self.logger).instance_terminate(instance_id)
+        except Exception as e:
+            self.logger.error(f"Can't terminate pool instance {instance_id}: {e}")
+
+    def _placeholder(self):
+        return {"id": None, "provider": self.provider, "release": self.release_number,
+                "ip": None, "status": PROVISIONING, "pid": os.getpid(),
+                "token": uuid.uuid4().hex, "last_used": time.time()}
+
+    def _provision(self, placeholder=None, leased=False):
+        """
+        Method for start and prepare one instance.
+
+        Setup steps are skipped on baked images, they are done there.
+
+        :param placeholder: record already in the state file, a new one by default
+        :param leased: bool, the instance is leased by the caller
+                       instead of becoming ready
+        :return: instance record or None
+        """
+        if placeholder is None:
+            placeholder = self._placeholder()
+            with self._state() as instances:
+                instances.append(placeholder)
+        try:
+            ip_address = self._start(placeholder)
+            if not placeholder.get("baked"):
+                self.prepare_instance.prepare(ip_address)
+        except Exception as e:
+            self.logger.error(f"Can't provision pool instance: {e}")
+            if placeholder["id"] is not None:
+                self._terminate(placeholder["id"])
+            with self._state() as instances:
+                instances[:] = [record for record in instances
+                                if record.get("token") != placeholder["token"]]
+            return None
+        instance_id = placeholder["id"]
+        with self._state() as instances:
+            for record in instances:
+                if record.get("token") == placeholder["token"]:
+                    record.update(status=LEASED if leased else READY,
+                                  last_used=time.time())
+                    placeholder = record
+        if not leased:
+            with self._ready:
+                self._ready.notify_all()
+        self.logger.info(f"Pool instance {instance_id} ({ip_address}) is ready.")
+        return placeholder
+
+    def lease(self, timeout=None):
+        """
+        Method for take ready instance from the pool.
+
+        Waits for a replenishing instance or provisions a new one.
+
+        :param timeout: seconds to wait for background provisioning
+        :return: (instance id, ip address)
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            leased = None
+            with self._state() as instances:
+                for record in instances:
+                    if self._own(record) and record["status"] == READY:
+                        record.update(status=LEASED, pid=os.getpid(),
+                                      last_used=time.time())
+                        leased = record
+                        break
+                provisioning = any(self._own(record) and record["status"] == PROVISIONING
+                                   for record in instances)
+            if leased is not None:
+                self.replenish()
+                return leased["id"], leased["ip"]
+            if not provisioning or (deadline and time.monotonic() > deadline):
+                break
+            with self._ready:
+                self._ready.wait(timeout=5)
+        # Provisioned for this caller, other processes can't take it.
+        record = self._provision(leased=True)
+        if record is None:
+            raise Exception(f"Can't lease instance for release {self.release_number}")
+        self.replenish()
+        return record["id"], record["ip"]
+
+    def release(self, instance_id, healthy=True):
+        """
+        Method for return leased instance to the pool.
+
+        :param instance_id: str
+        :param healthy: False terminates the instance instead
+        """
+        with self._state() as instances:
+            for record in instances:
+                if record["id"] == instance_id:
+                    record.update(status=READY, last_used=time.time())
+                    break
+            if not healthy:
+                instances[:] = [record for record in instances
+                                if record["id"] != instance_id]
+        if not healthy:
+            self._terminate(instance_id)
+        with self._ready:
+            self._ready.notify_all()
+
+    def replenish(self):
+        """Method for start provisioning up to `size` ready instances."""
+        # Placeholders are added under the same lock, so concurrent
+        # calls see each other's instances.
+        with self._state() as instances:
+            available = sum(1 for record in instances if self._own(record)
+                            and record["status"] in (READY, PROVISIONING))
+            placeholders = [self._placeholder() for _ in range(self.size - available)]
+            instances.extend(placeholders)
+        for placeholder in placeholders:
+            thread = threading.Thread(target=self._provision, args=(placeholder,),
+                                      daemon=True)
+            thread.start()
+            self._provisioning.append(thread)
+
+    def reap(self):
+        """Method for terminate ready instances idle longer than ttl."""
+        now = time.time()
+        with self._state() as instances:
+            expired = [record for record in instances if self._own(record)
+                       and record["status"] == READY
+                       and now - record["last_used"] > self.ttl]
+            instances[:] = [record for record in instances if record not in expired]
+        for record in expired:
+            self.logger.info(f"Pool instance {record['id']} idle too long, terminating.")
+            self._terminate(record["id"])
+
+    def recover(self):
+        """
+        Method for handle instances left by crashed processes.
+
+        Leased instances return to the pool, half provisioned
+        instances are terminated.
+        """
+        with self._state() as instances:
+            orphaned = [record for record in instances if self._own(record)
+                        and record["status"] != READY
+                        and not _process_alive(record["pid"])]
+            for record in orphaned:
+                if record["status"] == LEASED:
+                    record.update(status=READY, last_used=time.time())
+            broken = [record for record in orphaned if record["status"] == PROVISIONING]
+            instances[:] = [record for record in instances if record not in broken]
+        for record in broken:
+            if record["id"] is not None:
+                self.logger.info(f"Terminating unfinished pool instance {record['id']}.")
+                self._terminate(record["id"])
+
+    def _run(self):
+        self.recover()
+        while not self._stop.is_set():
+            try:
+                self.reap()
+                self.replenish()
+            except Exception as e:
+                self.logger.error(f"Instance pool maintenance failed: {e}")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        """Method for start background replenishing and reaping."""
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self, terminate=False):
+        """
+        Method for stop background thread.
+
+        Instances still provisioning are waited for, so they are left
+        ready for the next process instead of half prepared.
+
+        :param terminate: terminate all ready instances of the pool too
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        for thread in self._provisioning:
+            thread.join()
+        self._provisioning = []
+        if terminate:
+            with self._state() as instances:
+                ready = [record for record in instances
+                         if self._own(record) and record["status"] == READY]
+                instances[:] = [record for record in instances if record not in ready]
+            for record in ready:
+                self._terminate(record["id"])
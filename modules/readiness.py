@@ -0,0 +1,93 @@
+"""Module for detect when a new instance accepts commands."""
+
+import random
+import socket
+import time
+
+from modules.ssh_client import SSHClient
+
+
+class Readiness:
+    """
+    Class for wait until instance is ready, phase by phase.
+
+    Every phase is polled with exponential backoff and jitter, the time
+    spent in every phase is kept in `timings` (seconds).
+    """
+
+    def __init__(self, logger, timeout=300, initial_delay=0.5, max_delay=10, port=22,
+                 ssh_client=None):
+        self.logger = logger
+        self.ssh_client = ssh_client or SSHClient(self.logger)
+        self.timeout = timeout
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.port = port
+        self.timings = {}
+
+    def _delays(self):
+        delay = self.initial_delay
+        while True:
+            yield random.uniform(delay / 2, delay)
+            delay = min(delay * 2, self.max_delay)
+
+    def wait_for(self, phase, check):
+        """
+        Method for poll check() until it returns a true value.
+
+        Exceptions of check() count as "not ready yet".
+
+        :param phase: name of the phase for timings
+        :param check: callable
+        :return: value returned by check()
+        """
+        started = time.monotonic()
+        deadline = started + self.timeout
+        last_error = None
+        for delay in self._delays():
+            try:
+                result = check()
+                if result:
+                    self.timings[phase] = round(time.monotonic() - started, 3)
+                    self.logger.info(f"Phase {phase} done in {self.timings[phase]} s.")
+                    return result
+            except Exception as e:
+                last_error = e
+            if time.monotonic() + delay > deadline:
+                break
+            time.sleep(delay)
+        raise TimeoutError(f"Phase {phase} not done in {self.timeout} s: {last_error}")
+
+    def _tcp_open(self, ip_address):
+        with socket.create_connection((ip_address, self.port), timeout=3):
+            return True
+
+    def _ssh_banner(self, ip_address):
+        with socket.create_connection((ip_address, self.port), timeout=3) as connection:
+            connection.settimeout(5)
+            return connection.recv(64).startswith(b"SSH-")
+
+    def _ssh_command(self, ssh_client, user, ip_address, key_path):
+        try:
+            stream = ssh_client.stream_ssh_command(user, "true", ip_address, key_path)
+            return stream.consume(lambda stream_name, line: None) == 0
+        except Exception:
+            # Keys may be not installed yet, don't keep the failed transport.
+            ssh_client.pool.discard(user, ip_address, key_path)
+            raise
+
+    def wait_ssh(self, user, ip_address, key_path):
+        """
+        Method for wait until ssh on the instance runs commands.
+
+        :param user: str
+        :param ip_address: str
+        :param key_path: str
+        :return: dict timings
+        """
+        ssh_client = self.ssh_client
+        self.wait_for("tcp", lambda: self._tcp_open(ip_address))
+        self.wait_for("ssh_banner", lambda: self._ssh_banner(ip_address))
+        self.wait_for("ssh_command",
+                      lambda: self._ssh_command(ssh_client, user, ip_address, key_path))
+        return self.timings
@@ -1,43 +1,371 @@
 """SSH client module"""
 
+import threading
+import time
+from concurrent.futures import Future
+
 import paramiko
 from retrying import retry
 
+from logger.metrics import instrument, metrics
+
+
+class SSHConnectionPool:
+
+    """
+    Class for keep authenticated SSH connections alive between commands.
+
+    One transport is kept per (user, ip_address, key_path) and every
+    command opens a new channel on it instead of a new TCP connection.
+    Every get() must be paired with release(), connections in use are
+    never closed as idle or discarded under a running command.
+    """
+    def __init__(self, keepalive_interval=30, idle_timeout=300, port=22):
+        self.keepalive_interval = keepalive_interval
+        self.idle_timeout = idle_timeout
+        self.port = port
+        self._connections = {}
+        self._last_used = {}
+        self._in_use = {}
+        self._keys = {}
+        self._host_locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, user, ip_address, key_path):
+        """
+        Method for get connected paramiko client for the host.
+
+        The client is counted as in use until release() is called.
+
+        :param user: str
+        :param ip_address: str
+        :param key_path: str
+        :return: paramiko.SSHClient
+        """
+        key = (user, ip_address, key_path)
+        with self._lock:
+            self._evict_idle()
+            host_lock = self._host_locks.setdefault(key, threading.Lock())
+        # Handshake under the host lock only, other hosts are not blocked.
+        with host_lock:
+            with self._lock:
+                ssh_client = self._connections.get(key)
+            if ssh_client is not None and not self._is_active(ssh_client):
+                ssh_client.close()
+                ssh_client = None
+            if ssh_client is None:
+                ssh_client = self._connect(user, ip_address, key_path)
+            with self._lock:
+                self._connections[key] = ssh_client
+                self._last_used[key] = time.monotonic()
+                self._in_use[ssh_client] = self._in_use.get(ssh_client, 0) + 1
+                self._keys[ssh_client] = key
+            return ssh_client
+
+    def release(self, ssh_client):
+        """
+        Method for return client got by get().
+
+        Discarded clients are closed when the last user releases them.
+
+        :param ssh_client: paramiko.SSHClient
+        """
+        with self._lock:
+            count = self._in_use.get(ssh_client, 0) - 1
+            key = self._keys.get(ssh_client)
+            if count > 0:
+                self._in_use[ssh_client] = count
+                return
+            self._in_use.pop(ssh_client, None)
+            if self._connections.get(key) is ssh_client:
+                self._last_used[key] = time.monotonic()
+                return
+            self._keys.pop(ssh_client, None)
+        ssh_client.close()
+
+    def discard(self, user, ip_address, key_path):
+        """
+        Method for drop connection of the host (e.g. after an error).
+
+        The next get() connects again, a connection still used by
+        other threads is closed when they release it.
+
+        :param user: str
+        :param ip_address: str
+        :param key_path: str
+        """
+        key = (user, ip_address, key_path)
+        with self._lock:
+            ssh_client = self._connections.get(key)
+            if ssh_client is not None and ssh_client in self._in_use:
+                self._connections.pop(key)
+                self._last_used.pop(key, None)
+                return
+            self._close(key)
+
+    def close_all(self):
+        """Method for close all pooled connections, also the ones in use."""
+        with self._lock:
+            for key in list(self._connections):
+                self._close(key)
+            for ssh_client in list(self._in_use):
+                ssh_client.close()
+            self._in_use.clear()
+            self._keys.clear()
+
+    def _connect(self, user, ip_address, key_path):
+        """
+        Method for open new authenticated connection.
+
+        :return: paramiko.SSHClient
+        """
+        ssh_client = paramiko.SSHClient()
+        ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        ssh_client.connect(hostname=ip_address,
+                           port=self.port,
+                           username=user,
+                           key_filename=key_path)
+        ssh_client.get_transport().set_keepalive(self.keepalive_interval)
+        return ssh_client
+
+    def _evict_idle(self):
+        """Method for close connections unused longer than idle_timeout."""
+        now = time.monotonic()
+        for key, last_used in list(self._last_used.items()):
+            if now - last_used > self.idle_timeout and \
+                    self._connections.get(key) not in self._in_use:
+                self._close(key)
+
+    def _close(self, key):
+        """Method for close and forget a single connection."""
+        ssh_client = self._connections.pop(key, None)
+        self._last_used.pop(key, None)
+        if ssh_client is not None:
+            self._keys.pop(ssh_client, None)
+            ssh_client.close()
+
+    @staticmethod
+    def _is_active(ssh_client):
+        transport = ssh_client.get_transport()
+        return transport is not None and transport.is_active()
+
+
+# Pool shared by all remote functions of the process.
+ssh_pool = SSHConnectionPool()
+
+
+class CommandStream:
+
+    """
+    Class for read output of remote command line by line while it runs.
+
+    Iteration yields ("stdout" | "stderr", line) tuples, both streams are
+    drained together so the remote side never stalls on a full pipe.
+    Output after max_output bytes is drained but not yielded, lines
+    longer than max_line_length are split. exit_status is a Future which
+    is resolved when the output is read to the end, it fails when
+    iteration is abandoned before. on_close is called once when
+    iteration ends, also when it is abandoned.
+    """
+    def __init__(self, channel, max_output=None, max_line_length=65536,
+                 chunk_size=32768, on_close=None, poll_interval=0.1):
+        self.channel = channel
+        self.poll_interval = poll_interval
+        self.on_close = on_close
+        self.max_output = max_output
+        self.max_line_length = max_line_length
+        self.chunk_size = chunk_size
+        self.received = 0
+        self.truncated = False
+        self.exit_status = Future()
+
+    def _read(self, name, data, buffers):
+        """Method for split received chunk to complete lines."""
+        self.received += len(data)
+        if self.max_output is not None and self.received > self.max_output:
+            self.truncated = True
+            # Keep the part of the chunk up to the limit.
+            data = data[:len(data) - (self.received - self.max_output)]
+            if not data:
+                return
+        buffers[name] += data
+        *lines, buffers[name] = buffers[name].split(b"\n")
+        if self.max_line_length and len(buffers[name]) > self.max_line_length:
+            lines.append(buffers[name])
+            buffers[name] = b""
+        for line in lines:
+            yield name, line.decode('utf-8', errors='replace')
+
+    def close(self):
+        """Method for call on_close once."""
+        if not self.exit_status.done():
+            self.exit_status.set_exception(
+                RuntimeError("Output of the command was not read to the end"))
+        on_close, self.on_close = self.on_close, None
+        if on_close is not None:
+            on_close()
+
+    def __iter__(self):
+        try:
+            yield from self._lines()
+        finally:
+            self.close()
+
+    def chunks(self):
+        """
+        Method for read raw output until the command exits.
+
+        Both streams are drained together, for binary output which
+        is not split to lines.
+
+        :return: generator of ("stdout" | "stderr", bytes)
+        """
+        channel = self.channel
+        # Set by paramiko when data or EOF arrives on either stream.
+        # Reading one stream empty clears it, so the wait is limited
+        # by poll_interval in case the other stream got data meanwhile.
+        ready = threading.Event()
+        channel.in_buffer.set_event(ready)
+        channel.in_stderr_buffer.set_event(ready)
+        while True:
+            idle = True
+            if channel.recv_ready():
+                idle = False
+                yield "stdout", channel.recv(self.chunk_size)
+            if channel.recv_stderr_ready():
+                idle = False
+                yield "stderr", channel.recv_stderr(self.chunk_size)
+            if idle:
+                if channel.exit_status_ready() and channel.eof_received:
+                    break
+                if channel.eof_received:
+                    # Output is over, only the exit status is left.
+                    channel.status_event.wait(self.poll_interval)
+                else:
+                    ready.wait(self.poll_interval)
+        # The status is already received, this does not block.
+        if not self.exit_status.done():
+            self.exit_status.set_result(channel.recv_exit_status())
+
+    def _lines(self):
+        buffers = {"stdout": b"", "stderr": b""}
+        for name, data in self.chunks():
+            yield from self._read(name, data, buffers)
+        for name, rest in buffers.items():
+            if rest:
+                yield name, rest.decode('utf-8', errors='replace')
+
+    def consume(self, on_line):
+        """
+        Method for pass every line to callback and wait for exit status.
+
+        :param on_line: callable(stream_name, line)
+        :return: int exit status
+        """
+        for name, line in self:
+            on_line(name, line)
+        return self.exit_status.result()
+
 
+@instrument
 class SSHClient:
 
     """Class for connect to instance via ssh."""
-    def __init__(self, logger):
+    def __init__(self, logger, pool=None):
         self.logger = logger
+        self.pool = pool or ssh_pool
+
+    def stream_ssh_command(self, user, command, ip_address, key_path,
+                           max_output=None, max_line_length=65536):
+        """
+        Method for start command on EC2 instance and stream its output.
+
+        :param command:: str
+        :param ip_address:: str
+        :param key_path:: str
+        :param max_output:: int, bytes of output to keep, None is unlimited
+        :param max_line_length:: int, longer lines are split, None is unlimited
+        :return: CommandStream
+        """
+        ssh_client = self.pool.get(user, ip_address, key_path)
+        try:
+            channel = ssh_client.get_transport().open_session()
+            channel.exec_command(command)
+        except Exception:
+            self.pool.release(ssh_client)
+            raise
+        # The connection stays in use until the output is read.
+        return CommandStream(channel, max_output=max_output,
+                             max_line_length=max_line_length,
+                             on_close=lambda: self.pool.release(ssh_client))
+
+    def _log_line(self, stream_name, line):
+        if stream_name == "stderr":
+            self.logger.warning(line)
+        else:
+            self.logger.info(line)
 
     @retry(stop_max_attempt_number=5, wait_fixed=1000)
-    def execute_ssh_command(self, user, command, ip_address, key_path):
+    def execute_ssh_command(self, user, command, ip_address, key_path,
+                            max_output=None):
         """
-        Method for SSH connect to EC2 instance.
+        Method for execute command on EC2 instance via pooled SSH connection.
+
+        Output is logged line by line while the command runs.
 
         :param command:: str
         :param ip_address:: str
         :param key_path:: str
+        :param max_output:: int, bytes of output to log, None is unlimited
         :return: None
         """
-        ssh_client = paramiko.SSHClient()
-        ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
         try:
-            ssh_client.connect(hostname=ip_address,
-                               username=user,
-                               key_filename=key_path)
-            stdin, stdout, stderr = ssh_client.exec_command(command)
-            output = stdout.read().decode('utf-8')
-            self.logger.info(output)
-            status_code = stdout.channel.recv_exit_status()
-            if status_code != 0:
-                self.logger.error(f"Error: Can't execute \"{command}\" by SSHClient. Trying...")
-                raise Exception
-            return status_code
+            stream = self.stream_ssh_command(user, command, ip_address,
+                                             key_path, max_output=max_output)
+            status_code = stream.consume(self._log_line)
+            if stream.truncated:
+                self.logger.info(f"Output of \"{command}\" truncated "
+                                 f"at {max_output} bytes.")
         except Exception as error:
+            # Broken transport, reconnect on the next attempt.
+            self.pool.discard(user, ip_address, key_path)
+            metrics.count("ssh_command_failures_total", reason="transport")
             raise error
-        finally:
-            ssh_client.close()
+        if status_code != 0:
+            self.logger.error(f"Error: Can't execute \"{command}\" by SSHClient. Trying...")
+            metrics.count("ssh_command_failures_total", reason="status")
+            raise Exception
+        return status_code
+
+    def capture_ssh_command(self, user, command, ip_address, key_path,
+                            max_output=None):
+        """
+        Method for execute command once and collect its stdout lines.
+
+        Stderr is logged as warnings, nonzero exit status is returned, not raised.
+
+        :param command:: str
+        :param ip_address:: str
+        :param key_path:: str
+        :param max_output:: int, bytes of output to keep, None is unlimited
+        :return: (status code, list of stdout lines)
+        """
+        lines = []
+
+        def on_line(stream_name, line):
+            if stream_name == "stdout":
+                lines.append(line)
+            else:
+                self.logger.warning(line)
+
+        try:
+            stream = self.stream_ssh_command(user, command, ip_address,
+                                             key_path, max_output=max_output)
+            status_code = stream.consume(on_line)
+        except Exception as error:
+            self.pool.discard(user, ip_address, key_path)
+            raise error
+        return status_code, lines
 
     def copy_file_from_ec2_to_local(self, user, ip_address,
                                     key_path, source_path,
@@ -52,17 +380,16 @@ class SSHClient:
         :param: destination_path: str
         :return: None
         """
-        ssh_client = paramiko.SSHClient()
-        ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-
+        ssh_client = None
+        sftp_client = None
         try:
-            ssh_client.connect(hostname=ip_address,
-                               username=user,
-                               key_filename=key_path)
+            ssh_client = self.pool.get(user, ip_address, key_path)
             sftp_client = ssh_client.open_sftp()
             sftp_client.get(source_path, destination_path)
         except Exception as e:
             self.logger.error(f"Error: {e}")
         finally:
-            sftp_client.close()
-            ssh_client.close()
+            if sftp_client is not None:
+                sftp_client.close()
+            if ssh_client is not None:
+                self.pool.release(ssh_client)
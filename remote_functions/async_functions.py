@@ -0,0 +1,93 @@
+"""
+Asyncio counterparts of the remote instance functions.
+
+AsyncCheckLicense, AsyncEnableRepo and AsyncDownloadPackage live next
+to their sync classes, which run the same commands by SSHClient.
+"""
+
+import asyncio
+import functools
+import inspect
+
+from modules.async_ssh_client import AsyncSSHClient, run_sync
+from remote_functions.check_license import AsyncCheckLicense, LicenseMismatch
+from remote_functions.download_package import AsyncDownloadPackage
+from remote_functions.enable_repo import AsyncEnableRepo
+
+
+class AsyncPackagesDownload:
+    """
+    Class for download all packages from list on one or many instances.
+
+    Packages are taken from one shared queue, so a host which is
+    faster takes more packages. Every host runs per_host_limit
+    downloads at the same time.
+    """
+
+    def __init__(self, logger, path_to_download, user, key_path, ip_address,
+                 packages, per_host_limit=4, ssh_client=None):
+        self.logger = logger
+        self.packages = packages
+        self.path_to_download = path_to_download
+        self.user = user
+        self.key_path = key_path
+        if isinstance(ip_address, str):
+            ip_address = [ip_address]
+        self.ip_addresses = ip_address
+        self.per_host_limit = per_host_limit
+        self.ssh_client = ssh_client or AsyncSSHClient(self.logger,
+                                                       per_host_limit=per_host_limit)
+
+    async def _worker(self, download_package, ip_address, queue, results):
+        while True:
+            try:
+                package_name = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            results[package_name] = \
+                await download_package.download_package(ip_address, package_name)
+
+    async def download_all(self):
+        """
+        Method for download all packages to the instances.
+
+        :return: dict {package_name: status}
+        """
+        download_package = AsyncDownloadPackage(self.logger, self.path_to_download,
+                                                self.user, self.key_path,
+                                                ssh_client=self.ssh_client)
+        await asyncio.gather(*(download_package.create_path(ip_address)
+                               for ip_address in self.ip_addresses))
+        queue = asyncio.Queue()
+        for package_name in self.packages:
+            queue.put_nowait(package_name)
+        results = {}
+        await asyncio.gather(*(self._worker(download_package, ip_address,
+                                            queue, results)
+                               for ip_address in self.ip_addresses
+                               for _ in range(self.per_host_limit)))
+        self.logger.info(f"All packages were downloaded.")
+        return {package_name: results.get(package_name)
+                for package_name in self.packages}
+
+
+class SyncWrapper:
+    """
+    Class for call coroutine methods of async remote functions from sync code.
+
+    SyncWrapper(AsyncCheckLicense(...)).check_license(ip) has the same
+    signature as CheckLicense(...).check_license(ip).
+    """
+
+    def __init__(self, async_object):
+        self._async_object = async_object
+
+    def __getattr__(self, name):
+        attribute = getattr(self._async_object, name)
+        if not inspect.iscoroutinefunction(attribute):
+            return attribute
+
+        @functools.wraps(attribute)
+        def wrapper(*args, **kwargs):
+            return run_sync(attribute(*args, **kwargs))
+        return wrapper
@@ -1,52 +1,90 @@
 """Check license module."""
 
+from logger.metrics import instrument
 from modules.ssh_client import SSHClient
-import sys
+from remote_functions.remote_command import execute, run_inline
 
 
-class CheckLicense:
+class LicenseMismatch(Exception):
+    """License on the instance differs from the expected one."""
+
+
+class AsyncCheckLicense:
     """
     Class for comparison stable license file with possible new.
+
+    Commands are run by AsyncSSHClient or by SSHClient of CheckLicense.
     """
 
-    def __init__(self, logger, user, key_path, expected_license_hash, license_rpm, license_path):
+    def __init__(self, logger, user, key_path, expected_license_hash,
+                 license_rpm, license_path, ssh_client=None):
         self.logger = logger
-        self.ssh_client = SSHClient(self.logger)
+        if ssh_client is None:
+            from modules.async_ssh_client import AsyncSSHClient
+            ssh_client = AsyncSSHClient(self.logger)
+        self.ssh_client = ssh_client
         self.user = user
         self.expected_license_hash = expected_license_hash
         self.key_path = key_path
         self.license_rpm = license_rpm
         self.license_path = license_path
 
-    def update_license(self, ip_address):
+    async def update_license(self, ip_address):
         """
         Method for update rpm package with license on the instance.
 
         :param ip_address: address of the instance
         """
-        command = f'sudo dnf -y update {license_rpm}>>'
-        self.logger.info(f"Updating {license_rpm} package.")
-        self.ssh_client.execute_ssh_command(self.user,
-                                            command, ip_address,
-                                            self.key_path)
+        command = f'sudo dnf -y update {self.license_rpm}'
+        self.logger.info(f"Updating {self.license_rpm} package.")
+        await execute(self.ssh_client, self.user, command, ip_address, self.key_path)
 
-    def check_license(self, ip_address):
+    async def check_license(self, ip_address):
         """
         Method for comparison sha256 sums of license's.
 
         :param ip_address: address of the instance
+        :raises LicenseMismatch: when the checksum differs
         """
-        self.update_license(ip_address)
+        await self.update_license(ip_address)
         self.logger.info("Checking sha256sum of actual license")
-        command = (f'sudo sha256sum P{self.license_path} |'
+        command = (f'sudo sha256sum {self.license_path} |'
                    f' grep -q {self.expected_license_hash}')
-        result = self.ssh_client.execute_ssh_command(self.user,
-                                                     command, ip_address,
-                                                     self.key_path)
-        if result == 0:
-            self.logger.info("License match to expected.")
-        else:
+        try:
+            await execute(self.ssh_client, self.user, command, ip_address, self.key_path)
+        except Exception as e:
             self.logger.error("WARNING!!! "
                               "License checksums do not match and was changed")
-            sys.exit(1)
+            raise LicenseMismatch(f"License on {ip_address} was changed") from e
+        self.logger.info("License match to expected.")
+
+
+@instrument
+class CheckLicense:
+    """
+    Class for comparison stable license file with possible new.
+    """
+
+    def __init__(self, logger, user, key_path, expected_license_hash, license_rpm, license_path,
+                 ssh_client=None):
+        self.logger = logger
+        self.ssh_client = ssh_client or SSHClient(self.logger)
+        self.commands = AsyncCheckLicense(logger, user, key_path, expected_license_hash,
+                                          license_rpm, license_path, ssh_client=self.ssh_client)
 
+    def update_license(self, ip_address):
+        """
+        Method for update rpm package with license on the instance.
+
+        :param ip_address: address of the instance
+        """
+        run_inline(self.commands.update_license(ip_address))
+
+    def check_license(self, ip_address):
+        """
+        Method for comparison sha256 sums of license's.
+
+        :param ip_address: address of the instance
+        :raises LicenseMismatch: when the checksum differs
+        """
+        run_inline(self.commands.check_license(ip_address))
@@ -1,20 +1,86 @@
 """Download package module"""
 
 import re
+import shlex
+
+import config.conf as config
+from logger.metrics import instrument, metrics
 from modules.ssh_client import SSHClient
+from remote_functions.remote_command import execute, run_inline
 
+AVAILABLE = "available"
+UNAVAILABLE = "unavailable"
+AMBIGUOUS = "ambiguous"
 
-class DownloadPackage:
-    """Class for downloading rpm on the instance."""
+QUERY_FORMAT = "%{name}|%{epoch}|%{version}|%{release}|%{arch}|%{downloadsize}"
+
+
+def split_sources(package_names):
+    """
+    Function for split package names into source and binary groups.
+
+    :param package_names: list of names, e.g. "bash-5.1-1.el9.src.rpm"
+    :return: (list of source names, list of binary names)
+    """
+    sources = [name for name in package_names if name.endswith(".src.rpm")]
+    binaries = [name for name in package_names if not name.endswith(".src.rpm")]
+    return sources, binaries
+
+
+def _downloadable_name(package_name):
+    if package_name.endswith(".src.rpm"):
+        return package_name[:-len(".src.rpm")]
+    return package_name.replace(".rpm", "")
+
+
+def _spec_keys(name, epoch, version, release, arch):
+    """
+    Function for get all specs which select the package.
 
-    def __init__(self, logger, path_to_download, user, key_path):
+    :return: set of str, e.g. "bash", "bash-5.1-1.el9.x86_64"
+    """
+    keys = {name, f"{name}.{arch}", f"{name}-{version}",
+            f"{name}-{version}-{release}", f"{name}-{version}-{release}.{arch}"}
+    keys |= {f"{name}-{epoch}:{version}-{release}",
+             f"{name}-{epoch}:{version}-{release}.{arch}"}
+    return keys
+
+
+def _file_keys(file_name):
+    """
+    Function for get specs which select the package of the downloaded file.
+
+    :param file_name: str, e.g. "bash-5.1-1.el9.x86_64.rpm"
+    :return: (set of spec keys, bool source) or None for other files
+    """
+    if not file_name.endswith(".rpm"):
+        return None
+    nevr, _, arch = file_name[:-len(".rpm")].rpartition(".")
+    name_version, _, release = nevr.rpartition("-")
+    name, _, version = name_version.rpartition("-")
+    if not (name and version and release and arch):
+        return None
+    return _spec_keys(name, "0", version, release, arch), arch == "src"
+
+
+class AsyncDownloadPackage:
+    """
+    Class for downloading rpm on the instance.
+
+    Commands are run by AsyncSSHClient or by SSHClient of DownloadPackage.
+    """
+
+    def __init__(self, logger, path_to_download, user, key_path, ssh_client=None):
         self.logger = logger
         self.path_to_download = path_to_download
         self.user = user
         self.key_path = key_path
-        self.ssh_client = SSHClient(self.logger)
+        if ssh_client is None:
+            from modules.async_ssh_client import AsyncSSHClient
+            ssh_client = AsyncSSHClient(self.logger)
+        self.ssh_client = ssh_client
 
-    def create_path(self, ip_address):
+    async def create_path(self, ip_address):
         """
         Method for create directory for download rpm's.
 
@@ -23,18 +89,66 @@ class DownloadPackage:
         :return: status
         """
         try:
-            command = (f'sudo mkdir {self.path_to_download}')
+            command = (f'sudo mkdir -p {self.path_to_download}')
             self.logger.info("Trying to create directory for download packages:")
-            result = self.ssh_client.execute_ssh_command(self.user, command, ip_address, self.key_path)
+            result = await execute(self.ssh_client, self.user, command, ip_address, self.key_path)
             if result == 0:
                 self.logger.info(f"Directory {self.path_to_download} created.")
-            #else:
-            #    self.logger.error(f"Can't create directory {self.path_to_download}. Trying...")
             return result
         except Exception as e:
             self.logger.error(f"Can't create directory {self.path_to_download}")
             raise e
 
+    async def download_package(self, ip_address, package_name):
+        """
+        Method for download rpm package to the instance.
+
+        :param ip_address: address of the instance
+        :param package_name: name of the rpm package
+        :return: status, None when the package can't be downloaded
+        """
+        # create downloadable name of the package
+        if package_name.endswith(".src.rpm"):
+            package_name_cut = package_name.replace('.src.rpm', '')
+            command = (
+                f"sudo dnf download {package_name_cut} --source --downloaddir={self.path_to_download} --setopt=*.module_hotfixes=1")
+        else:
+            package_name_cut = package_name.replace('.rpm', '')
+            command = (
+                f"sudo dnf download {package_name_cut} --downloaddir={self.path_to_download} --setopt=*.module_hotfixes=1")
+        try:
+            result = await execute(self.ssh_client, self.user, command, ip_address, self.key_path)
+        except Exception:
+            self.logger.error(f"Can't download {package_name}")
+            return None
+        if result == 0:
+            self.logger.info(f"Successfully downloaded {package_name} ...")
+        return result
+
+
+@instrument
+class DownloadPackage:
+    """Class for downloading rpm on the instance."""
+
+    def __init__(self, logger, path_to_download, user, key_path, ssh_client=None):
+        self.logger = logger
+        self.path_to_download = path_to_download
+        self.user = user
+        self.key_path = key_path
+        self.ssh_client = ssh_client or SSHClient(self.logger)
+        self.commands = AsyncDownloadPackage(logger, path_to_download, user, key_path,
+                                             ssh_client=self.ssh_client)
+
+    def create_path(self, ip_address):
+        """
+        Method for create directory for download rpm's.
+
+        self.path_to_download = instance_mount_dir in config.
+        :param ip_address: address of the instance
+        :return: status
+        """
+        return run_inline(self.commands.create_path(ip_address))
+
     def check_directory(self, ip_address):
         """
         Method for check directory on the instance.
@@ -57,52 +171,257 @@ class DownloadPackage:
 
         :param ip_address: address of the instance
         :param package_name: name of the rpm package
-        :return: status
+        :return: status, None when the package can't be downloaded
+        """
+        metrics.annotate(package=package_name)
+        result = run_inline(self.commands.download_package(ip_address, package_name))
+        if result is None:
+            metrics.count("packages_downloaded_total", status="failed")
+        elif result == 0:
+            metrics.count("packages_downloaded_total", status="ok")
+        return result
+
+    def downloaded_files(self, ip_address):
+        """
+        Method for list files in the download directory.
+
+        :param ip_address: address of the instance
+        :return: set of file names
+        """
+        status, lines = self.ssh_client.capture_ssh_command(
+            self.user, f"sudo ls -1 {self.path_to_download}", ip_address, self.key_path)
+        return set(line.strip() for line in lines) if status == 0 else set()
+
+    def download_batch(self, ip_address, package_names):
+        """
+        Method for download several packages of one kind by one dnf call.
+
+        dnf fails the whole call when one package is not available, so the
+        packages which have no file created by this call are split in
+        halves right away and tried until every failed package is tried
+        alone. Files are matched to the requested names by name, version,
+        release and arch.
+
+        :param ip_address: address of the instance
+        :param package_names: list of only source or only binary names
+        :return: dict {package_name: status}
         """
+        if len(package_names) == 1:
+            return {package_names[0]: self.download_package(ip_address, package_names[0])}
+        metrics.annotate(packages=len(package_names))
+        source = " --source" if package_names[0].endswith(".src.rpm") else ""
+        names = " ".join(shlex.quote(_downloadable_name(name)) for name in package_names)
+        command = (f"sudo dnf download {names}{source} "
+                   f"--downloaddir={self.path_to_download} --setopt=*.module_hotfixes=1")
+        before = self.downloaded_files(ip_address)
         try:
-            # create downloadable name of the package
-            if package_name.endswith(".src.rpm"):
-                package_name_cut = package_name.replace('.src.rpm', '')
-                command = (
-                    f"sudo dnf download {package_name_cut} --source --downloaddir={self.path_to_download} --setopt=*.module_hotfixes=1")
-                result = self.ssh_client.execute_ssh_command(self.user, command, ip_address, self.key_path)
-            else:
-                package_name_cut = package_name.replace('.rpm', '')
-                command = (
-                    f"sudo dnf download {package_name_cut} --downloaddir={self.path_to_download} --setopt=*.module_hotfixes=1")
-                result = self.ssh_client.execute_ssh_command(self.user, command, ip_address, self.key_path)
+            status, _ = self.ssh_client.capture_ssh_command(
+                self.user, command, ip_address, self.key_path)
+        except Exception as e:
+            self.logger.error(f"Can't run batch download: {e}")
+            status = None
+        if status == 0:
+            self.logger.info(f"Successfully downloaded {len(package_names)} packages ...")
+            metrics.count("packages_downloaded_total", len(package_names), status="ok")
+            return {package_name: 0 for package_name in package_names}
+        metrics.count("download_batch_failures_total")
+        created = set()
+        for file_name in self.downloaded_files(ip_address) - before:
+            file_keys = _file_keys(file_name)
+            if file_keys is not None:
+                keys, is_source = file_keys
+                created |= {(key, is_source) for key in keys}
+        results = {package_name: 0 for package_name in package_names
+                   if (_downloadable_name(package_name),
+                       package_name.endswith(".src.rpm")) in created}
+        metrics.count("packages_downloaded_total", len(results), status="ok")
+        failed = [package_name for package_name in package_names
+                  if package_name not in results]
+        self.logger.info(f"Batch download failed, {len(failed)} of "
+                         f"{len(package_names)} packages left.")
+        if failed:
+            middle = len(failed) // 2
+            results.update(self.download_batch(ip_address, failed[:middle]))
+            results.update(self.download_batch(ip_address, failed[middle:]))
+        return results
 
-            if result == 0:
-                self.logger.info(f"Successfully downloaded {package_name} ...")
-            return result
-        except:
-            self.logger.error(f"Can't download {package_name}")
 
+@instrument
+class ResolvePackages:
+    """
+    Class for check which packages of the list can be downloaded.
+
+    The whole list is queried by one "dnf repoquery" call and every
+    entry is classified as available, unavailable or ambiguous. Ambiguous
+    entries (a name matching several versions or arches) are left to
+    dnf download, which picks the best candidate as before.
+    """
+
+    def __init__(self, logger, user, key_path, ssh_client=None):
+        self.logger = logger
+        self.user = user
+        self.key_path = key_path
+        self.ssh_client = ssh_client or SSHClient(self.logger)
 
+    def command(self, package_names):
+        """
+        Method for build repoquery command.
+
+        Source repositories are enabled when source packages are asked.
+
+        :param package_names: list of names, e.g. "bash-5.1-1.el9.src.rpm"
+        :return: str
+        """
+        sources, binaries = split_sources(package_names)
+        specs = [f"{_downloadable_name(name)}.src" for name in sources] + \
+            [_downloadable_name(name) for name in binaries]
+        enable_sources = " --enablerepo='*-source*'" if sources else ""
+        return (f"sudo dnf repoquery -q --setopt=*.module_hotfixes=1{enable_sources} "
+                f"--queryformat {shlex.quote(QUERY_FORMAT + chr(10))} "
+                f"{' '.join(shlex.quote(spec) for spec in specs)}")
+
+    def _query(self, ip_address, package_names):
+        """
+        Method for run repoquery.
+
+        :return: dict {NEVRA: (set of spec keys, arch, size)}
+        """
+        status, lines = self.ssh_client.capture_ssh_command(
+            self.user, self.command(package_names), ip_address, self.key_path)
+        if status != 0:
+            raise Exception(f"dnf repoquery failed with status {status}")
+        found = {}
+        for line in lines:
+            fields = line.strip().split("|")
+            if len(fields) != 6:
+                continue
+            name, epoch, version, release, arch, size = fields
+            epoch_prefix = f"{epoch}:" if epoch not in ("", "0", "(none)") else ""
+            nevra = f"{name}-{epoch_prefix}{version}-{release}.{arch}"
+            found[nevra] = (_spec_keys(name, epoch, version, release, arch), arch,
+                            int(size) if size.isdigit() else None)
+        return found
+
+    def resolve(self, ip_address, package_names):
+        """
+        Method for classify packages of the list.
+
+        :param ip_address: address of the instance
+        :param package_names: list of names
+        :return: dict {package_name: {"status", "nevra", "size", "candidates"}}
+        """
+        found = self._query(ip_address, package_names)
+        index = {}
+        for nevra, (keys, arch, _) in found.items():
+            for key in keys:
+                index.setdefault((key, arch == "src"), set()).add(nevra)
+        resolution = {}
+        for package_name in package_names:
+            is_source = package_name.endswith(".src.rpm")
+            candidates = sorted(index.get((_downloadable_name(package_name), is_source), ()))
+            if len(candidates) == 1:
+                resolution[package_name] = {"status": AVAILABLE, "nevra": candidates[0],
+                                            "size": found[candidates[0]][2],
+                                            "candidates": candidates}
+            else:
+                status = AMBIGUOUS if candidates else UNAVAILABLE
+                resolution[package_name] = {"status": status, "nevra": None,
+                                            "size": None, "candidates": candidates}
+        counts = {status: sum(1 for entry in resolution.values() if entry["status"] == status)
+                  for status in (AVAILABLE, UNAVAILABLE, AMBIGUOUS)}
+        self.logger.info(f"Resolved {len(package_names)} packages: {counts}")
+        for package_name, entry in resolution.items():
+            if entry["status"] == UNAVAILABLE:
+                self.logger.error(f"Package {package_name} is unavailable.")
+            elif entry["status"] == AMBIGUOUS:
+                self.logger.info(f"Package {package_name} matches {entry['candidates']}")
+        return resolution
+
+
+@instrument
 class PackagesDownload:
     """
     Class for download all packages from list
     """
-    def __init__(self, logger, path_to_download, user, key_path, ip_address, packages):
+    def __init__(self, logger, path_to_download, user, key_path, ip_address, packages,
+                 store=None, batch_size=None, ssh_client=None):
         self.logger = logger
         self.packages = packages
         self.path_to_download = path_to_download
         self.user = user
         self.key_path = key_path
         self.ip_address = ip_address
-        self.ssh_client = SSHClient(self.logger)
+        # ArtifactStore opened and closed by the caller, None downloads all
+        self.store = store
+        self.batch_size = config.download_batch_size if batch_size is None else batch_size
+        self.ssh_client = ssh_client or SSHClient(self.logger)
 
-    def download_all(self):
+    def download_all(self, packages=None):
         """
         Method for download all packages to the instance.
+
+        Packages already present in the artifact store are skipped.
+        With batch_size > 1 source and binary packages are downloaded
+        by chunks of batch_size names per dnf call.
+
+        :param packages: list of names, self.packages by default
+        :return: dict {package_name: status}
         """
-        download_package = DownloadPackage(self.logger, self.path_to_download, self.user, self.key_path)
+        download_package = DownloadPackage(self.logger, self.path_to_download, self.user, self.key_path,
+                                           ssh_client=self.ssh_client)
         download_package.create_path(self.ip_address)
         download_package.check_directory(self.ip_address)
-        for package_name in self.packages:
+        results = {}
+        requested = self.packages if packages is None else packages
+        packages = requested
+        if self.store is not None:
+            packages = self.store.missing(requested)
+            for package_name in requested:
+                results[package_name] = 0
+            self.logger.info(f"{len(requested) - len(packages)} packages are "
+                             f"already in the store, downloading {len(packages)}.")
+        if self.batch_size > 1:
+            for group in split_sources(packages):
+                for start in range(0, len(group), self.batch_size):
+                    results.update(download_package.download_batch(
+                        self.ip_address, group[start:start + self.batch_size]))
+            packages = []
+        for package_name in packages:
             try:
-                download_package.download_package(self.ip_address, package_name)
+                results[package_name] = \
+                    download_package.download_package(self.ip_address, package_name)
             except Exception as e:
+                results[package_name] = None
                 self.logger.error(f"Can't download {package_name}")
                 self.logger.error(e)
         self.logger.info(f"All packages were downloaded.")
+        return results
+
+    def resolve_and_download(self):
+        """
+        Method for resolve packages by one repoquery and download the rest.
+
+        Unavailable packages are not downloaded, their status is None.
+        Ambiguous packages are passed to dnf as they are. When repoquery
+        fails, the whole list is downloaded unresolved.
+
+        :return: dict {"resolution": {package_name: dict}, "results": {package_name: status}}
+        """
+        packages = self.packages
+        if self.store is not None:
+            packages = self.store.missing(self.packages)
+        resolve_packages = ResolvePackages(self.logger, self.user, self.key_path,
+                                           ssh_client=self.ssh_client)
+        try:
+            resolution = resolve_packages.resolve(self.ip_address, packages) if packages else {}
+        except Exception as e:
+            self.logger.error(f"Can't resolve packages, downloading them unresolved: {e}")
+            resolution = {}
+        downloadable = [package_name for package_name in self.packages
+                        if package_name not in resolution
+                        or resolution[package_name]["status"] != UNAVAILABLE]
+        results = self.download_all(packages=downloadable)
+        for package_name, entry in resolution.items():
+            if entry["status"] == UNAVAILABLE:
+                results[package_name] = None
+        return {"resolution": resolution, "results": results}
@@ -1,19 +1,27 @@
 """Module for enabling extra repositories om the instance."""
 
+from logger.metrics import instrument
 from modules.ssh_client import SSHClient
-from retrying import retry
+from remote_functions.remote_command import execute, retry_async, run_inline
 
 
-class EnableRepo:
-    """Class for enabling repos on the EC2 instance."""
+class AsyncEnableRepo:
+    """
+    Class for enabling repos on the instance.
+
+    Commands are run by AsyncSSHClient or by SSHClient of EnableRepo.
+    """
 
-    def __init__(self, logger, user, key_path):
+    def __init__(self, logger, user, key_path, ssh_client=None):
         self.logger = logger
         self.user = user
         self.key_path = key_path
-        self.ssh_client = SSHClient(self.logger)
+        if ssh_client is None:
+            from modules.async_ssh_client import AsyncSSHClient
+            ssh_client = AsyncSSHClient(self.logger)
+        self.ssh_client = ssh_client
 
-    def enable_repo(self, ip_address):
+    async def enable_repo(self, ip_address):
         """
         Method for enabling repos via sed.
 
@@ -22,37 +30,69 @@ class EnableRepo:
         command = "sudo sed -i 's/enabled=0/enabled=1/g' " \
                   "/etc/yum.repos.d/*repo"
         self.logger.info("Trying to enable all repositories:")
-        self.ssh_client.execute_ssh_command(self.user,
-                                            command, ip_address,
-                                            self.key_path)
+        await execute(self.ssh_client, self.user, command, ip_address, self.key_path)
 
-    def check_repo(self, ip_address):
+    async def check_repo(self, ip_address):
         """
         Method for checking enabled repos on the instance.
 
         :param ip_address: ip of the instance.
         """
         command = "sudo dnf repolist enabled | grep -i source"
-        result = self.ssh_client.execute_ssh_command(self.user,
-                                                     command, ip_address,
-                                                     self.key_path)
+        result = await execute(self.ssh_client, self.user, command, ip_address, self.key_path)
         if result != 0:
             self.logger.info("Repositories disabled, try to enable...")
         return result
 
-    @retry(stop_max_attempt_number=2, wait_fixed=1000)
-    def enable_check(self, ip_address):
+    async def enable_check(self, ip_address):
         """
         Combined method for one way enabling and checking repos.
 
+        Tried twice with 1 second between attempts.
+
         :param ip_address: ip of the instance.
         """
-        try:
-            self.enable_repo(ip_address)
-            result = self.check_repo(ip_address)
-            if result != 0:
-                raise Exception
-        except Exception as e:
-            self.logger.error("Additional repositories can't be enabled. Trying to repeate.")
-            raise e
+        async def attempt():
+            try:
+                await self.enable_repo(ip_address)
+                result = await self.check_repo(ip_address)
+                if result != 0:
+                    raise Exception
+            except Exception as e:
+                self.logger.error("Additional repositories can't be enabled. Trying to repeate.")
+                raise e
+        await retry_async(attempt, attempts=2, wait=1.0)
+
+
+@instrument
+class EnableRepo:
+    """Class for enabling repos on the EC2 instance."""
+
+    def __init__(self, logger, user, key_path, ssh_client=None):
+        self.logger = logger
+        self.ssh_client = ssh_client or SSHClient(self.logger)
+        self.commands = AsyncEnableRepo(logger, user, key_path, ssh_client=self.ssh_client)
+
+    def enable_repo(self, ip_address):
+        """
+        Method for enabling repos via sed.
 
+        :param ip_address: ip of the instance.
+        """
+        run_inline(self.commands.enable_repo(ip_address))
+
+    def check_repo(self, ip_address):
+        """
+        Method for checking enabled repos on the instance.
+
+        :param ip_address: ip of the instance.
+        """
+        return run_inline(self.commands.check_repo(ip_address))
+
+    def enable_check(self, ip_address):
+        """
+        Combined method for one way enabling and checking repos.
+
+        :param ip_address: ip of the instance.
+        """
+        run_inline(self.commands.enable_check(ip_address))
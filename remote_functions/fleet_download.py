@@ -0,0 +1,217 @@
+"""Module for download package list on a fleet of instances."""
+
+import collections
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import config.conf as config
+from logger.metrics import instrument
+from modules.ec2_manager import Instance
+from modules.gcp_manager import GCPManager
+from remote_functions.download_package import DownloadPackage, split_sources
+
+
+class WorkQueues:
+    """
+    Class for split packages between hosts with work stealing.
+
+    Every host slot gets own queue sized by its weight. A host which
+    finished own queue takes packages from the tail of the longest one.
+    """
+
+    def __init__(self, packages, weights):
+        self._lock = threading.Lock()
+        self.queues = {slot: collections.deque() for slot in weights}
+        self.stolen = {slot: 0 for slot in weights}
+        total_weight = sum(weights.values())
+        slots = list(weights)
+        start = 0
+        for index, slot in enumerate(slots):
+            if index == len(slots) - 1:
+                end = len(packages)
+            else:
+                end = start + round(len(packages) * weights[slot] / total_weight)
+            self.queues[slot].extend(packages[start:end])
+            start = end
+
+    def next(self, slot, count=1):
+        """
+        Method for get next packages for the host slot.
+
+        :param slot: number of the host in the fleet
+        :param count: max number of packages
+        :return: list of str, empty when all queues are empty
+        """
+        with self._lock:
+            queue = self.queues[slot]
+            if not queue:
+                queue = max(self.queues.values(), key=len)
+                taken = [queue.pop() for _ in range(min(count, len(queue)))]
+                self.stolen[slot] += len(taken)
+                return taken
+            return [queue.popleft() for _ in range(min(count, len(queue)))]
+
+
+@instrument
+class FleetDownload:
+    """
+    Class for download all packages from list on several instances.
+
+    throughput keeps packages per second of every host slot and can be
+    passed as weights to the next download_all.
+    """
+
+    def __init__(self, logger, path_to_download, user, key_path, packages,
+                 release, provider="gcp", fleet_size=None, batch_size=None):
+        self.logger = logger
+        self.path_to_download = path_to_download
+        self.user = user
+        self.key_path = key_path
+        self.packages = packages
+        self.release = release
+        self.provider = provider
+        self.fleet_size = fleet_size or config.fleet_size
+        self.batch_size = batch_size or config.download_batch_size
+        self.instances = []
+        self._instances_lock = threading.Lock()
+        self.throughput = {}
+
+    def _start_ec2_instance(self, index):
+        """
+        Method for start one EC2 instance of the fleet.
+
+        The instance is added to the fleet before waiting for it, so
+        it is terminated when the fleet fails.
+
+        :param index: number of the instance in the fleet
+        :return: (instance manager, ip address)
+        """
+        instance = Instance(self.release, self.logger)
+        with self._instances_lock:
+            self.instances.append((instance, None))
+        return instance, instance.instance_ip()
+
+    def provision(self):
+        """
+        Method for start all instances of the fleet in parallel.
+
+        When any instance fails, all started instances are terminated.
+
+        :return: list of ip addresses
+        """
+        try:
+            if self.provider == "gcp":
+                self.instances = [(instance, None) for instance in
+                                  GCPManager.provision_many(self.logger, [self.release],
+                                                            replicas=self.fleet_size)]
+                self.instances = [(instance, instance.instance_ip())
+                                  for instance, _ in self.instances]
+            else:
+                with ThreadPoolExecutor(max_workers=self.fleet_size) as executor:
+                    started = list(executor.map(self._start_ec2_instance,
+                                                range(self.fleet_size)))
+                self.instances = started
+        except BaseException:
+            self.logger.error("Can't start the fleet, terminating started instances.")
+            self.terminate()
+            raise
+        self.logger.info(f"Fleet of {len(self.instances)} instances is running.")
+        return [ip_address for _, ip_address in self.instances]
+
+    def terminate(self):
+        """Method for terminate all instances of the fleet."""
+        for instance, _ in self.instances:
+            try:
+                instance.terminate()
+            except Exception as e:
+                self.logger.error(f"Can't terminate fleet instance: {e}")
+        self.instances = []
+
+    def _worker(self, slot, ip_address, queues, results):
+        """
+        Method for download packages from the queue on one host.
+
+        Packages are taken by batch_size names and downloaded by
+        DownloadPackage.download_batch, sources and binaries apart.
+
+        :param slot: number of the host in the fleet
+        :param ip_address: address of the instance
+        :param queues: WorkQueues
+        :param results: dict shared between workers
+        """
+        download_package = DownloadPackage(self.logger, self.path_to_download,
+                                           self.user, self.key_path)
+        download_package.create_path(ip_address)
+        download_package.check_directory(ip_address)
+        started = time.monotonic()
+        count = 0
+        package_names = queues.next(slot, self.batch_size)
+        while package_names:
+            for group in split_sources(package_names):
+                if not group:
+                    continue
+                batch_started = time.monotonic()
+                try:
+                    statuses = download_package.download_batch(ip_address, group)
+                except Exception as e:
+                    statuses = {}
+                    self.logger.error(f"Can't download {len(group)} packages")
+                    self.logger.error(e)
+                duration = round(time.monotonic() - batch_started, 3)
+                for package_name in group:
+                    results[package_name] = {
+                        "host": ip_address,
+                        "status": statuses.get(package_name),
+                        "duration": duration,
+                    }
+            count += len(package_names)
+            package_names = queues.next(slot, self.batch_size)
+        elapsed = time.monotonic() - started
+        self.throughput[slot] = count / elapsed if elapsed else 0.0
+        return count
+
+    def download_all(self, ip_addresses=None, weights=None):
+        """
+        Method for download all packages on the fleet.
+
+        :param ip_addresses: addresses of running instances,
+            instances are provisioned when not set
+        :param weights: dict {host slot: packages per second}, e.g.
+            throughput of the previous run, slots are positions in
+            ip_addresses, so they match on a freshly provisioned fleet
+        :return: dict report with per-package results and per-host stats
+        """
+        if ip_addresses is None:
+            ip_addresses = self.provision()
+        weights = {slot: (weights or {}).get(slot) or 1.0
+                   for slot in range(len(ip_addresses))}
+        queues = WorkQueues(list(self.packages), weights)
+        results = {}
+        with ThreadPoolExecutor(max_workers=len(ip_addresses)) as executor:
+            futures = {slot: executor.submit(self._worker, slot, ip_address,
+                                             queues, results)
+                       for slot, ip_address in enumerate(ip_addresses)}
+        hosts = {}
+        for slot, future in futures.items():
+            ip_address = ip_addresses[slot]
+            try:
+                count = future.result()
+            except Exception as e:
+                self.logger.error(f"Fleet host {ip_address} failed: {e}")
+                count = 0
+            hosts[ip_address] = {
+                "slot": slot,
+                "packages": count,
+                "stolen": queues.stolen[slot],
+                "throughput": round(self.throughput.get(slot, 0.0), 3),
+            }
+        # Packages left by failed hosts
+        for package_name in self.packages:
+            results.setdefault(package_name, {"host": None, "status": None,
+                                              "duration": 0.0})
+        failed = [name for name, result in results.items()
+                  if result["status"] != 0]
+        self.logger.info(f"Fleet downloaded {len(results) - len(failed)} "
+                         f"of {len(results)} packages.")
+        return {"results": results, "hosts": hosts, "failed": failed}
@@ -0,0 +1,55 @@
+"""Module for prepare fresh instance for downloading packages."""
+
+import config.conf as config
+from logger.metrics import instrument
+from remote_functions.check_license import CheckLicense
+from remote_functions.download_package import DownloadPackage
+from remote_functions.enable_repo import EnableRepo
+
+
+@instrument
+class PrepareInstance:
+    """
+    Class for run all setup steps on the instance before downloads.
+
+    Checks the license, enables repositories and creates
+    the download directory.
+    """
+
+    def __init__(self, logger, user=None, key_path=None, path_to_download=None):
+        self.logger = logger
+        self.user = user or config.instance_user
+        self.key_path = key_path or config.private_key_path
+        self.path_to_download = path_to_download or config.instance_mount_dir
+        self.check_license = CheckLicense(self.logger, self.user, self.key_path,
+                                          config.expected_license_hash,
+                                          config.license_rpm,
+                                          config.license_path)
+        self.enable_repo = EnableRepo(self.logger, self.user, self.key_path)
+        self.download_package = DownloadPackage(self.logger, self.path_to_download,
+                                                self.user, self.key_path)
+
+    def prepare(self, ip_address):
+        """
+        Method for run setup steps on the instance.
+
+        :param ip_address: address of the instance
+        """
+        self.check_license.check_license(ip_address)
+        self.enable_repo.enable_check(ip_address)
+        self.download_package.create_path(ip_address)
+        self.logger.info(f"Instance {ip_address} is prepared.")
+
+    def bake(self, ip_address):
+        """
+        Method for prepare instance which becomes a baked image.
+
+        Runs setup steps and warms dnf metadata cache, so instances
+        booted from the image skip them.
+
+        :param ip_address: address of the instance
+        """
+        self.prepare(ip_address)
+        self.download_package.ssh_client.execute_ssh_command(
+            self.user, "sudo dnf makecache", ip_address, self.key_path)
+        self.logger.info(f"Instance {ip_address} is ready for baking.")
@@ -0,0 +1,55 @@
+"""
+Helpers for remote functions written once for sync and async clients.
+
+Commands of a remote function are coroutines which await execute().
+AsyncSSHClient returns awaitables, SSHClient returns the status itself,
+so sync classes run the same coroutines by run_inline() in the calling
+thread and keep their blocking SSHClient and its connection pool.
+"""
+
+import asyncio
+import inspect
+
+
+async def execute(ssh_client, user, command, ip_address, key_path):
+    """
+    Function for execute command by sync or async ssh client.
+
+    :param ssh_client: SSHClient or AsyncSSHClient
+    :return: int status
+    """
+    result = ssh_client.execute_ssh_command(user, command, ip_address, key_path)
+    if inspect.isawaitable(result):
+        result = await result
+    return result
+
+
+async def retry_async(function, attempts, wait):
+    """
+    Function for repeat coroutine function like retrying.retry does.
+
+    :param function: coroutine function without arguments
+    :param attempts: int, same as stop_max_attempt_number
+    :param wait: float seconds, same as wait_fixed / 1000
+    :return: result of the function
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            return await function()
+        except Exception:
+            if attempt == attempts:
+                raise
+        await asyncio.sleep(wait)
+
+
+def run_inline(coroutine):
+    """
+    Function for run coroutine of a sync client in the calling thread.
+
+    SSHClient calls block, so every caller thread runs its own
+    commands and threads don't wait for each other on one loop.
+
+    :param coroutine: coroutine object
+    :return: result of the coroutine
+    """
+    return asyncio.run(coroutine)
@@ -0,0 +1,153 @@
+"""Module for extract packages metadata on the instance."""
+
+import base64
+import json
+import os
+import zlib
+
+from logger.metrics import instrument
+from modules.ssh_client import SSHClient
+
+# Modules shipped to the instance, in import order.
+SHIPPED_MODULES = [
+    "local_functions",
+    "local_functions.rpm_header",
+    "local_functions.rpm_payload",
+    "logger",
+    "logger.metrics",
+    "local_functions.package_info",
+]
+
+# Runs on the instance: registers shipped modules and prints
+# PackageInfo.get_all() of every rpm in the directory as one JSON line.
+BOOTSTRAP = """
+import base64, json, logging, os, subprocess, sys, types, zlib
+
+if sys.version_info < (3, 7):
+    _run = subprocess.run
+
+    def _run_compat(*args, capture_output=False, text=False, **kwargs):
+        if capture_output:
+            kwargs["stdout"] = kwargs["stderr"] = subprocess.PIPE
+        if text:
+            kwargs["universal_newlines"] = True
+        return _run(*args, **kwargs)
+    subprocess.run = _run_compat
+
+for name, source in json.loads(zlib.decompress(base64.b64decode(sys.argv[1]))):
+    module = types.ModuleType(name)
+    if "." not in name:
+        module.__path__ = []
+    sys.modules[name] = module
+    exec(compile(source, name, "exec"), module.__dict__)
+
+from local_functions.package_info import PackageInfo
+
+logging.basicConfig(stream=sys.stderr, level=logging.INFO)
+logger = logging.getLogger("remote_package_info")
+root = sys.argv[2]
+for name in sorted(os.listdir(root)):
+    if not name.endswith(".rpm"):
+        continue
+    path = os.path.join(root, name)
+    try:
+        record = PackageInfo(logger, path).get_all()
+    except Exception as e:
+        logger.error("Can't get info of %s: %s", path, e)
+        continue
+    sys.stdout.write(json.dumps(record, separators=(",", ":")) + "\\n")
+    sys.stdout.flush()
+"""
+
+
+@instrument
+class RemotePackageInfo:
+    """
+    Class for run PackageInfo on the instance next to downloaded packages.
+
+    Only compact JSON records come back over one SSH channel, one line
+    per package in the PackageInfo.get_all() format.
+    """
+
+    def __init__(self, logger, user, key_path, remote_path, local_path=None,
+                 ssh_client=None):
+        self.logger = logger
+        self.user = user
+        self.key_path = key_path
+        self.remote_path = remote_path
+        self.local_path = local_path
+        self.ssh_client = ssh_client or SSHClient(self.logger)
+
+    @staticmethod
+    def _module_sources():
+        """
+        Method for pack sources of shipped modules.
+
+        :return: str base64
+        """
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        sources = []
+        for name in SHIPPED_MODULES:
+            path = os.path.join(root, *name.split("."))
+            if os.path.isdir(path):
+                path = os.path.join(path, "__init__.py")
+            else:
+                path += ".py"
+            with open(path) as f:
+                sources.append([name, f.read()])
+        packed = zlib.compress(json.dumps(sources).encode("utf-8"), 9)
+        return base64.b64encode(packed).decode("ascii")
+
+    def command(self):
+        """
+        Method for build command which runs extraction on the instance.
+
+        :return: str
+        """
+        bootstrap = base64.b64encode(BOOTSTRAP.encode("utf-8")).decode("ascii")
+        return ("PY=$(command -v python3 || echo /usr/libexec/platform-python); "
+                f"sudo $PY -c \"import base64; exec(base64.b64decode('{bootstrap}'))\" "
+                f"{self._module_sources()} {self.remote_path}")
+
+    def _local_record(self, record):
+        """Method for map remote package path to local_path."""
+        if self.local_path is None:
+            return record
+        return {os.path.join(self.local_path, os.path.relpath(path, self.remote_path)): info
+                for path, info in record.items()}
+
+    def iter_all(self, ip_address):
+        """
+        Method for get metadata of all packages in remote_path one by one.
+
+        :param ip_address: address of the instance
+        :return: generator of {package_path: info} dicts
+        """
+        stream = self.ssh_client.stream_ssh_command(self.user, self.command(),
+                                                    ip_address, self.key_path,
+                                                    max_line_length=None)
+        count = 0
+        for stream_name, line in stream:
+            if stream_name == "stderr":
+                self.logger.warning(line)
+                continue
+            if not line:
+                continue
+            count += 1
+            yield self._local_record(json.loads(line))
+        status_code = stream.exit_status.result()
+        if status_code != 0:
+            self.logger.error(f"Error: remote extraction exited with {status_code}")
+        self.logger.info(f"Got metadata of {count} packages from {ip_address}")
+
+    def get_all(self, ip_address):
+        """
+        Method for get metadata of all packages in remote_path.
+
+        :param ip_address: address of the instance
+        :return: {dict} {package_path: info}
+        """
+        rpm_info = {}
+        for record in self.iter_all(ip_address):
+            rpm_info.update(record)
+        return rpm_info
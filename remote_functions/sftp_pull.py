@@ -0,0 +1,187 @@
+"""Module for pull download directory from instance over sftp."""
+
+import hashlib
+import os
+import stat
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import paramiko
+
+from logger.metrics import instrument, metrics
+from modules.ssh_client import SSHClient
+
+
+@instrument
+class SFTPPull:
+
+    """
+    Class for copy all files of remote directory to local machine.
+
+    Alternative to SSHFS mount: files are read with prefetched
+    (pipelined) sftp requests, several files at once, partial files
+    are resumed and every file is verified by size and sha256.
+    """
+    def __init__(self, logger, user, key_path, remote_path, local_path,
+                 concurrency=4, chunk_size=1024 * 1024, ssh_client=None):
+        self.logger = logger
+        self.user = user
+        self.key_path = key_path
+        self.remote_path = remote_path
+        self.local_path = local_path
+        self.concurrency = concurrency
+        self.chunk_size = chunk_size
+        self.ssh_client = ssh_client or SSHClient(self.logger)
+        self._local = threading.local()
+        self._sessions = []
+        self._sessions_lock = threading.Lock()
+
+    def remote_checksums(self, ip_address):
+        """
+        Method for get sha256 sums of remote files by one command.
+
+        :param ip_address: address of the instance
+        :return: dict {file name: sha256}
+        :raises Exception: when the command fails, partial checksums
+                           would mark good files as failed
+        """
+        command = (f"cd {self.remote_path} && "
+                   f"find . -maxdepth 1 -type f -exec sha256sum {{}} +")
+        checksums = {}
+        errors = []
+        stream = self.ssh_client.stream_ssh_command(self.user, command,
+                                                    ip_address, self.key_path)
+        for stream_name, line in stream:
+            if stream_name == "stderr":
+                self.logger.warning(line)
+                errors.append(line)
+                continue
+            if not line.strip():
+                continue
+            checksum, name = line.split(None, 1)
+            checksums[os.path.basename(name)] = checksum
+        status_code = stream.exit_status.result()
+        if status_code != 0:
+            self.logger.error(f"Error: checksums of {self.remote_path} "
+                              f"exited with {status_code}")
+            raise Exception(f"Can't get checksums of {self.remote_path} on {ip_address}: "
+                            f"{' '.join(errors).strip()}")
+        return checksums
+
+    def _sftp(self, ip_address):
+        """
+        Method for get sftp session of the current thread.
+
+        Sessions are separate channels of one pooled transport.
+        """
+        sftp = getattr(self._local, "sftp", None)
+        if sftp is None:
+            ssh_client = self.ssh_client.pool.get(self.user, ip_address,
+                                                  self.key_path)
+            try:
+                sftp = paramiko.SFTPClient.from_transport(ssh_client.get_transport())
+            except Exception:
+                self.ssh_client.pool.release(ssh_client)
+                raise
+            self._local.sftp = sftp
+            with self._sessions_lock:
+                self._sessions.append((sftp, ssh_client))
+        return sftp
+
+    def _close_sessions(self):
+        """Method for close sftp channels, the transport stays in the pool."""
+        with self._sessions_lock:
+            for sftp, ssh_client in self._sessions:
+                sftp.close()
+                self.ssh_client.pool.release(ssh_client)
+            self._sessions = []
+        self._local = threading.local()
+
+    def _local_sha256(self, path):
+        checksum = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(self.chunk_size), b""):
+                checksum.update(chunk)
+        return checksum
+
+    def pull_file(self, ip_address, name, size, expected_checksum):
+        """
+        Method for copy one file, resume when partial local copy exists.
+
+        :param ip_address: address of the instance
+        :param name: file name in remote_path
+        :param size: remote file size
+        :param expected_checksum: remote sha256 or None
+        :return: status ("copied", "skipped", "failed")
+        """
+        local_file = os.path.join(self.local_path, name)
+        remote_file = os.path.join(self.remote_path, name)
+        offset = os.path.getsize(local_file) if os.path.exists(local_file) else 0
+        if offset > size:
+            offset = 0
+        checksum = self._local_sha256(local_file) if offset else hashlib.sha256()
+        if offset == size and checksum.hexdigest() == expected_checksum:
+            return "skipped"
+        if offset == size:
+            # Same size but other content, copy again.
+            offset = 0
+            checksum = hashlib.sha256()
+
+        metrics.annotate(file=name, bytes=size - offset)
+        sftp = self._sftp(ip_address)
+        with sftp.open(remote_file, "rb") as remote, \
+                open(local_file, "ab" if offset else "wb") as local:
+            remote.seek(offset)
+            remote.prefetch(size)
+            for chunk in iter(lambda: remote.read(self.chunk_size), b""):
+                local.write(chunk)
+                checksum.update(chunk)
+        metrics.count("bytes_transferred_total", size - offset, mode="sftp")
+
+        if os.path.getsize(local_file) != size:
+            self.logger.error(f"Size mismatch for {name}.")
+            return "failed"
+        if expected_checksum and checksum.hexdigest() != expected_checksum:
+            self.logger.error(f"Checksum mismatch for {name}.")
+            os.remove(local_file)
+            return "failed"
+        return "copied"
+
+    def _pull_file_safe(self, ip_address, name, size, expected_checksum):
+        try:
+            return self.pull_file(ip_address, name, size, expected_checksum)
+        except Exception as e:
+            self.logger.error(f"Can't copy {name}: {e}")
+            return "failed"
+
+    def pull(self, ip_address):
+        """
+        Method for copy all files of remote_path to local_path.
+
+        :param ip_address: address of the instance
+        :return: dict {file name: status}
+        """
+        os.makedirs(self.local_path, exist_ok=True)
+        checksums = self.remote_checksums(ip_address)
+        try:
+            files = [attr for attr in
+                     self._sftp(ip_address).listdir_attr(self.remote_path)
+                     if stat.S_ISREG(attr.st_mode)]
+            # Big files first, so they don't finish last.
+            files.sort(key=lambda attr: attr.st_size, reverse=True)
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                futures = {attr.filename: executor.submit(self._pull_file_safe,
+                                                          ip_address,
+                                                          attr.filename,
+                                                          attr.st_size,
+                                                          checksums.get(attr.filename))
+                           for attr in files}
+            results = {name: future.result() for name, future in futures.items()}
+        finally:
+            self._close_sessions()
+        failed = [name for name, status in results.items() if status == "failed"]
+        self.logger.info(f"Copied {len(results) - len(failed)} of {len(results)} "
+                         f"files from {self.remote_path} to {self.local_path}")
+        if failed:
+            self.logger.error(f"Can't copy files: {', '.join(failed)}")
+        return results
@@ -1,8 +1,10 @@
 """Module for mount sshfs shared folder"""
 
 import subprocess
+from logger.metrics import instrument
 
 
+@instrument
 class SSHFS:
 
     """Class for mount sshfs mount from instance to local machine."""
@@ -0,0 +1,239 @@
+"""Module for pull download directory from instance as one compressed tar stream."""
+
+import gzip
+import hashlib
+import io
+import os
+import shlex
+import tarfile
+
+from logger.metrics import instrument, metrics
+from modules.ssh_client import CommandStream, SSHClient
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+# Remote compressors by preference: (command, magic bytes, local decompressor)
+COMPRESSORS = [
+    ("zstd -q -c -T0", b"\x28\xb5\x2f\xfd",
+     zstandard and (lambda f: zstandard.ZstdDecompressor().stream_reader(f))),
+    ("lz4 -q -c", b"\x04\x22\x4d\x18", lz4 and (lambda f: lz4.frame.LZ4FrameFile(f))),
+    ("gzip -c -1", b"\x1f\x8b", lambda f: gzip.GzipFile(fileobj=f)),
+]
+
+# Stream is a sha256sum manifest, an empty line and a tar of the files.
+REMOTE_SCRIPT = """
+set -o pipefail
+cd {path} || exit 1
+for compressor in {compressors}; do
+    command -v ${{compressor%% *}} > /dev/null && break
+done
+{{ find . -maxdepth 1 -type f -printf '%P\\0' | xargs -0r sha256sum
+  echo
+  find . -maxdepth 1 -type f -printf '%P\\0' | tar -cf - --null -T -
+}} | $compressor
+"""
+
+
+class _ChannelReader(io.RawIOBase):
+    """
+    Raw binary stream over stdout of a CommandStream, counts received bytes.
+
+    stderr is read together with stdout, so the remote side never stalls
+    on a full pipe, up to max_errors bytes of it are kept.
+    """
+
+    def __init__(self, stream, max_errors=65536):
+        self.chunks = stream.chunks()
+        self.max_errors = max_errors
+        self.errors = bytearray()
+        self.received = 0
+        self._pending = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def _next_stdout(self):
+        for name, data in self.chunks:
+            if name == "stdout":
+                return data
+            self.errors += data[:self.max_errors - len(self.errors)]
+        return b""
+
+    def readinto(self, buffer):
+        if not self._pending:
+            self._pending = memoryview(self._next_stdout())
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        self.received += size
+        return size
+
+    def drain(self):
+        """Method for read rest of the output until the command exits."""
+        while self._next_stdout():
+            pass
+
+
+@instrument
+class TarStream:
+
+    """
+    Class for copy all files of remote directory as one tar stream.
+
+    Alternative to SSHFS mount and SFTPPull: tar runs on the instance,
+    its output is compressed with zstd or lz4 when both sides support
+    it (gzip otherwise) and read from a single SSH channel. Files are
+    extracted while the stream arrives and verified by the sha256
+    manifest sent before them, files are renamed in place only when
+    their checksum matches.
+    """
+    def __init__(self, logger, user, key_path, remote_path, local_path,
+                 chunk_size=1024 * 1024, window_size=16 * 1024 * 1024, ssh_client=None):
+        self.logger = logger
+        self.user = user
+        self.key_path = key_path
+        self.remote_path = remote_path
+        self.local_path = local_path
+        self.chunk_size = chunk_size
+        self.window_size = window_size
+        self.ssh_client = ssh_client or SSHClient(self.logger)
+
+    @staticmethod
+    def compressors():
+        """
+        Method for get compressors which can be decompressed locally.
+
+        :return: list of (command, magic bytes, decompressor)
+        """
+        return [compressor for compressor in COMPRESSORS if compressor[2]]
+
+    def command(self):
+        """
+        Method for build remote command.
+
+        :return: str
+        """
+        compressors = " ".join(shlex.quote(command) for command, _, _ in self.compressors())
+        script = REMOTE_SCRIPT.format(path=shlex.quote(self.remote_path),
+                                      compressors=compressors)
+        return f"bash -c {shlex.quote(script)}"
+
+    def _decompress(self, stream):
+        """
+        Method for open decompressed stream, the compressor is detected by magic bytes.
+
+        :param stream: io.BufferedReader over the channel
+        :return: io.BufferedReader
+        """
+        magic = stream.peek(4)[:4]
+        for command, compressor_magic, decompressor in self.compressors():
+            if magic.startswith(compressor_magic):
+                self.logger.info(f"Tar stream compressed by {command.split()[0]}")
+                return io.BufferedReader(decompressor(stream), self.chunk_size)
+        raise ValueError(f"Unknown compression of tar stream: {magic!r}")
+
+    @staticmethod
+    def _read_manifest(stream):
+        """
+        Method for read sha256sum lines until the empty line.
+
+        :return: dict {file name: sha256}
+        """
+        manifest = {}
+        for line in iter(stream.readline, b""):
+            line = line.decode("utf-8").rstrip("\n")
+            if not line:
+                break
+            checksum, name = line.split(None, 1)
+            manifest[name] = checksum
+        return manifest
+
+    def extract_file(self, archive, member, expected_checksum):
+        """
+        Method for write one tar member and verify it.
+
+        :param archive: tarfile.TarFile in stream mode
+        :param member: tarfile.TarInfo
+        :param expected_checksum: sha256 of the manifest or None
+        :return: status ("copied", "failed")
+        """
+        name = member.name
+        if os.path.basename(name) != name or name in (".", ".."):
+            self.logger.error(f"Unexpected path in tar stream: {name}")
+            return "failed"
+        local_file = os.path.join(self.local_path, name)
+        partial_file = f"{local_file}.part"
+        metrics.annotate(file=name, bytes=member.size)
+        checksum = hashlib.sha256()
+        source = archive.extractfile(member)
+        try:
+            with open(partial_file, "wb") as local:
+                for chunk in iter(lambda: source.read(self.chunk_size), b""):
+                    local.write(chunk)
+                    checksum.update(chunk)
+            metrics.count("bytes_transferred_total", member.size, mode="tar")
+            if checksum.hexdigest() != expected_checksum:
+                self.logger.error(f"Checksum mismatch for {name}.")
+                return "failed"
+            os.replace(partial_file, local_file)
+            return "copied"
+        finally:
+            if os.path.exists(partial_file):
+                os.remove(partial_file)
+
+    def pull(self, ip_address):
+        """
+        Method for copy all files of remote_path to local_path.
+
+        :param ip_address: address of the instance
+        :return: dict {file name: status}
+        """
+        os.makedirs(self.local_path, exist_ok=True)
+        ssh_client = self.ssh_client.pool.get(self.user, ip_address, self.key_path)
+        results = {}
+        try:
+            channel = ssh_client.get_transport().open_session(window_size=self.window_size)
+        except Exception:
+            self.ssh_client.pool.release(ssh_client)
+            raise
+        try:
+            channel.exec_command(self.command())
+            command_stream = CommandStream(channel, chunk_size=self.chunk_size)
+            raw = _ChannelReader(command_stream)
+            stream = self._decompress(io.BufferedReader(raw, self.chunk_size))
+            manifest = self._read_manifest(stream)
+            with tarfile.open(fileobj=stream, mode="r|") as archive:
+                for member in archive:
+                    if member.isfile():
+                        results[member.name] = self.extract_file(
+                            archive, member, manifest.get(member.name))
+            raw.drain()
+            status_code = command_stream.exit_status.result()
+            errors = raw.errors.decode("utf-8", errors="replace")
+        except Exception:
+            # Broken transport, reconnect on the next command.
+            self.ssh_client.pool.discard(self.user, ip_address, self.key_path)
+            raise
+        finally:
+            channel.close()
+            self.ssh_client.pool.release(ssh_client)
+
+        for name in manifest:
+            results.setdefault(name, "failed")
+        failed = [name for name, status in results.items() if status == "failed"]
+        self.logger.info(f"Copied {len(results) - len(failed)} of {len(results)} "
+                         f"files from {self.remote_path} to {self.local_path}, "
+                         f"{raw.received} bytes received")
+        if status_code != 0:
+            self.logger.error(f"Error: tar stream exited with {status_code}: {errors.strip()}")
+        if failed:
+            self.logger.error(f"Can't copy files: {', '.join(failed)}")
+        return results